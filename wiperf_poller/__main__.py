@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
+import argparse
+import cProfile
 import logging
 import os
+import signal
 import sys
 import time
 
@@ -20,16 +22,22 @@ from wiperf_poller.testers.smbtester import SmbTester
 from wiperf_poller.testers.wirelessconnectiontester import WirelessConnectionTester
 
 from wiperf_poller.helpers.bouncer import Bouncer
-from wiperf_poller.helpers.config import read_local_config
+from wiperf_poller.helpers.config import read_local_config, get_config_mtime
+from wiperf_poller.helpers.cycletimer import CycleTimer
 from wiperf_poller.helpers.error_messages import ErrorMessages
 from wiperf_poller.helpers.ethernetadapter import EthernetAdapter
-from wiperf_poller.helpers.filelogger import FileLogger
+from wiperf_poller.helpers.ethstats import EthernetStats
+from wiperf_poller.helpers.filelogger import FileLogger, truncate_error_log
 from wiperf_poller.helpers.lockfile import LockFile
 from wiperf_poller.helpers.os_cmds import check_os_cmds
 from wiperf_poller.helpers.poll_status import PollStatus
 from wiperf_poller.helpers.remoteconfig import check_last_cfg_read
-from wiperf_poller.helpers.route import check_correct_mode_interface
+from wiperf_poller.helpers.rfsampler import RfSampler
+from wiperf_poller.helpers.route import check_correct_mode_interface, clear_route_cache
+from wiperf_poller.helpers.scheduler import Scheduler
 from wiperf_poller.helpers.statusfile import StatusFile
+from wiperf_poller.helpers.testscheduler import TestScheduler, EXCLUSIVE, DISRUPTIVE, CONCURRENT
+from wiperf_poller.helpers.timefunc import time_sync_status
 from wiperf_poller.helpers.watchdog import Watchdog
 from wiperf_poller.helpers.wirelessadapter import WirelessAdapter
 
@@ -59,15 +67,25 @@ file_logger.info("*****************************************************")
 file_logger.info(" Starting logging...")
 file_logger.info("*****************************************************")
 
-# Pull in our config.ini dict
-config_vars = read_local_config(config_file, file_logger)
+def load_config():
+    '''
+    Read in our config.ini dict & set the logging level to match
+    '''
+    config_vars = read_local_config(config_file, file_logger)
+
+    # set logging to debug if debugging enabled
+    if DEBUG or (config_vars['debug'] == 'on'):
+        #rot_handler = file_logger.handlers[0]
+        #rot_handler.setLevel(logging.DEBUG)
+        file_logger.setLevel(level=logging.DEBUG)
+        file_logger.info("(Note: logging set to debug level.)")
+    else:
+        file_logger.setLevel(level=logging.INFO)
 
-# set logging to debug if debugging enabled
-if DEBUG or (config_vars['debug'] == 'on'):
-    #rot_handler = file_logger.handlers[0]
-    #rot_handler.setLevel(logging.DEBUG)
-    file_logger.setLevel(level=logging.DEBUG)
-    file_logger.info("(Note: logging set to debug level.)")
+    return config_vars
+
+# Pull in our config.ini dict
+config_vars = load_config()
 
 # check we are running as root user (sudo)
 if os.geteuid() != 0:
@@ -88,174 +106,60 @@ watchdog_obj = Watchdog(watchdog_file, file_logger)
 # status file object
 status_file_obj = StatusFile(status_file, file_logger)
 
-# bouncer object
-bouncer_obj = Bouncer(bounce_file, config_vars, file_logger)
-
-# spooler object
-spooler_obj = SpoolExporter(config_vars, file_logger)
+def init_config_objects():
+    '''
+    Create the objects that depend on config.ini values (called at startup
+    and again in daemon mode if the config file changes)
+    '''
+    global bouncer_obj
+    global spooler_obj
+    global exporter_obj
+    global adapter_obj
+    global probe_mode
+    global wlan_if
+    global eth_if
+    global platform
+    global rf_sampler
+
+    # bouncer object
+    bouncer_obj = Bouncer(bounce_file, config_vars, file_logger)
+
+    # spooler object
+    spooler_obj = SpoolExporter(config_vars, file_logger)
+
+    # exporter object
+    exporter_obj = ResultsExporter(file_logger, watchdog_obj, lockf_obj, spooler_obj, config_vars['platform'], config_vars)
+
+    # adapter object
+    adapter_obj = ''
+    probe_mode = config_vars['probe_mode']
+    wlan_if = config_vars['wlan_if']
+    eth_if = config_vars['eth_if']
+    platform = config_vars['platform']
+
+    if probe_mode == "ethernet":
+        adapter_obj = EthernetAdapter(eth_if, file_logger, platform=platform)
+    elif probe_mode == "wireless":
+        adapter_obj = WirelessAdapter(wlan_if, file_logger, platform=platform)
+    else:
+        file_logger.info("Unknown probe mode: {} (exiting)".format(probe_mode))
 
-# exporter object
-exporter_obj = ResultsExporter(file_logger, watchdog_obj, lockf_obj, spooler_obj, config_vars['platform'])
+    # RF sampler object (started at the first poll cycle & left running
+    # between cycles in daemon mode)
+    if rf_sampler:
+        rf_sampler.stop()
+    rf_sampler = None
 
-# adapter object
-adapter_obj = ''
-probe_mode = config_vars['probe_mode']
-wlan_if = config_vars['wlan_if']
-eth_if = config_vars['eth_if']
-platform = config_vars['platform']
+    if probe_mode == "wireless" and config_vars['rf_sampler_enabled'] == 'yes':
+        rf_sampler = RfSampler(WirelessAdapter(wlan_if, file_logger, platform=platform), config_vars, file_logger)
 
-if probe_mode == "ethernet":
-    adapter_obj = EthernetAdapter(eth_if, file_logger, platform=platform)
-elif probe_mode == "wireless":
-    adapter_obj = WirelessAdapter(wlan_if, file_logger, platform=platform)
-else:
-    file_logger.info("Unknown probe mode: {} (exiting)".format(probe_mode))
+rf_sampler = None
+init_config_objects()
 
 ###############################################################################
-# Main
+# Tests
 ###############################################################################
-def main():
-
-    global file_logger
-    global config_vars
-    global watchdog_file
-    global config_file
-    global check_cfg_file
-
-    # if we have a config server specified, check to see if it's time
-    # to pull the config
-    file_logger.info("Checking if we use remote cfg file...")
-    if config_vars['cfg_url']:
-        
-        # if able to get cfg file, re-read params in case updated
-        if check_last_cfg_read(config_file, check_cfg_file, config_vars, file_logger):
-            config_vars = read_local_config(config_file, file_logger)
-
-    else:
-        file_logger.info("No remote cfg file confgured...using current local ini file.")
-
-    # create watchdog if doesn't exist
-    watchdog_obj.create_watchdog()
-
-    # check watchdog count...if higher than 3, time for a reboot
-    watchdog_count = watchdog_obj.get_watchdog_count()
-    if watchdog_count > 3:
-        file_logger.error("Watchdog count exceeded...rebooting")
-        bouncer_obj.reboot()
-
-    ###################################
-    # Check if script already running
-    ###################################
-    if lockf_obj.lock_file_exists():
-
-        # read lock file contents & check how old timestamp is..
-        file_logger.error("Existing lock file found...")
-        watchdog_obj.inc_watchdog_count()
-
-        # if timestamp older than 10 mins, break lock
-        if lockf_obj.lock_is_old():
-            file_logger.error("Existing lock stale, breaking lock...")
-            lockf_obj.break_lock()
-        else:
-            # lock not old enough yet, respect lock & exit
-            file_logger.error("Exiting due to lock file indicating script running.")
-            file_logger.error("(Delete {} if you are sure script not running)".format(lock_file))
-            sys.exit()
-    else:
-        # create lockfile with current timestamp to stop 2nd process starting
-        file_logger.info("No lock file found. Creating lock file.")
-        lockf_obj.write_lock_file()
-
-    # test issue flag - set if any tests hit major issues
-    # to stall further testing
-    config_vars['test_issue'] = False
-    config_vars['test_issue_descr'] = ""
-
-    # set up poll health obj
-    poll_obj = PollStatus(config_vars, file_logger)
-    poll_obj.probe_mode(probe_mode)
-    poll_obj.mgt_if(config_vars['mgt_if'])
-    
-    #############################################
-    # Run network checks
-    #############################################
-    # Note: test_issue flag not set by connection tests, as issues will result in process exit
-    file_logger.info("########## Network connection checks ##########")
-    connection_obj = ''
-
-    status_file_obj.write_status_file("network check")
-
-    if config_vars['probe_mode'] == 'ethernet':
-        file_logger.info("Checking ethernet connection is good...(layer 1 &2)")
-        connection_obj = EthernetConnectionTester(file_logger, eth_if, platform)
-    else:
-        file_logger.info("Checking wireless connection is good...(layer 1 &2)")
-        connection_obj = WirelessConnectionTester(file_logger, wlan_if, platform)
-    
-    connection_obj.run_tests(watchdog_obj, lockf_obj, config_vars, exporter_obj)
-    poll_obj.network('OK') 
-    
-    # update poll summary with IP
-    poll_obj.ip(adapter_obj.get_adapter_ip())
-
-    ################################################
-    # Empty results spool queue if required/enabled
-    ################################################
-    file_logger.info("######## spooler checks ########")
-    if config_vars['results_spool_enabled'] == 'yes':
-
-        # clear out old spooled files if required
-        spooler_obj.prune_old_files()
-
-        # if export method not spooler, mgt connect 
-        # must be OK. Empty spool queue 
-        if config_vars['exporter_type'] != 'spooler':
-
-            # check we have spooler dir
-            if spooler_obj.check_spool_dir_exists():
-                
-                # check number of files in spooler dir
-                file_list = spooler_obj.list_spool_files()
-
-                # step through spooled files & attempt to export
-                # (remove each spooled file as successfuly exported)
-                if len(file_list) > 0:
-
-                    for filename in file_list:
-
-                        full_file_name = "{}/{}".format(spooler_obj.spool_dir_root, filename)
-
-                        # read in the file as dict (from json)
-                        try:
-                            with open(full_file_name, "r") as json_file:
-                                results_list = json.load(json_file)
-                        except IOError as err:
-                            file_logger.error("JSON I/O file read error: {}".format(err))
-                            break
-                        
-                        for results_dict in results_list:
-
-                            # pull out the data source
-                            data_file = results_dict['data_source']
-                            results_dict.pop('data_source')
-
-                            column_headers = list(results_dict.keys())
-                            test_name = data_file
-
-                        # send the dict to exporter
-                        if exporter_obj.send_results(config_vars, results_dict, column_headers, data_file, test_name, file_logger):
-
-                            # remove data file
-                            os.remove(full_file_name)
-                            file_logger.info("Spooled results sent OK - {}".format(data_file))
-                        
-    
-    else:
-        file_logger.info("Spooler not enabled.")
-
-    #############################################
-    # Run speedtest (if enabled)
-    #############################################                                                                                                                                                                                                                      
+def run_speedtest(poll_obj):
 
     file_logger.info("########## speedtest ##########")
     if config_vars['speedtest_enabled'] == 'yes':
@@ -271,9 +175,8 @@ def main():
         file_logger.info("Speedtest not enabled in config file.")
         poll_obj.speedtest('Not enabled')
 
-    #############################
-    # Run ping test (if enabled)
-    #############################
+def run_ping_tests(poll_obj):
+
     file_logger.info("########## ping tests ##########")
     if config_vars['ping_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -296,9 +199,8 @@ def main():
             file_logger.info("Ping test not enabled in config file, bypassing this test...")
             poll_obj.ping('Not enabled')
 
-    ###################################
-    # Run DNS lookup tests (if enabled)
-    ###################################
+def run_dns_tests(poll_obj):
+
     file_logger.info("########## dns tests ##########")
     if config_vars['dns_test_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -318,9 +220,8 @@ def main():
             file_logger.info("DNS test not enabled in config file, bypassing this test...")
             poll_obj.dns('Not enabled')
 
-    #####################################
-    # Run HTTP lookup tests (if enabled)
-    #####################################
+def run_http_tests(poll_obj):
+
     file_logger.info("########## http tests ##########")
     if config_vars['http_test_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -339,10 +240,9 @@ def main():
         else:
             file_logger.info("HTTP test not enabled in config file, bypassing this test...")
             poll_obj.http('Not enabled')
-    
-    ###################################
-    # Run iperf3 tcp test (if enabled)
-    ###################################
+
+def run_iperf3_tcp_test(poll_obj):
+
     file_logger.info("########## iperf3 tcp test ##########")
     if config_vars['iperf3_tcp_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -362,9 +262,8 @@ def main():
             file_logger.info("Iperf3 tcp test not enabled in config file, bypassing this test...")
             poll_obj.iperf_tcp('Not enabled')
 
-    ###################################
-    # Run iperf3 udp test (if enabled)
-    ###################################
+def run_iperf3_udp_test(poll_obj):
+
     file_logger.info("########## iperf3 udp test ##########")
     if config_vars['iperf3_udp_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -383,9 +282,28 @@ def main():
             file_logger.info("Iperf3 udp test not enabled in config file, bypassing this test...")
             poll_obj.iperf_udp('Not enabled')
 
-    #####################################
-    # Run DHCP renewal test (if enabled)
-    #####################################
+def run_iperf3_matrix_tests(poll_obj):
+
+    file_logger.info("########## iperf3 matrix tests ##########")
+    if config_vars['iperf3_matrix_enabled'] == 'yes' and config_vars['test_issue'] == False:
+
+        iperf3_matrix_obj = IperfTester(file_logger, platform)
+        tests_passed = iperf3_matrix_obj.run_matrix_tests(config_vars, status_file_obj, check_correct_mode_interface, exporter_obj)
+
+        if tests_passed:
+            poll_obj.iperf_matrix('Completed')
+        else:
+            poll_obj.iperf_matrix('Failed')
+    else:
+        if config_vars['test_issue'] == True:
+            file_logger.info("Previous test failed: {}".format(config_vars['test_issue_descr']))
+            poll_obj.iperf_matrix('Not run')
+        else:
+            file_logger.info("Iperf3 matrix tests not enabled in config file, bypassing this test...")
+            poll_obj.iperf_matrix('Not enabled')
+
+def run_dhcp_test(poll_obj):
+
     file_logger.info("########## dhcp test ##########")
     if config_vars['dhcp_test_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -405,10 +323,8 @@ def main():
             file_logger.info("DHCP test not enabled in config file, bypassing this test...")
             poll_obj.dhcp('Not enabled')
 
+def run_smb_tests(poll_obj):
 
-    #####################################
-    # Run SMB renewal test (if enabled)
-    #####################################
     file_logger.info("########## SMB test ##########")
     if config_vars['smb_enabled'] == 'yes' and config_vars['test_issue'] == False:
 
@@ -427,6 +343,186 @@ def main():
             file_logger.info("smb test not enabled in config file, bypassing this test...")
             poll_obj.smb('Not enabled')
 
+###############################################################################
+# Poll cycle
+###############################################################################
+def poll():
+    '''
+    Run a poll cycle, making sure that any results queued for export are sent
+    even if the cycle ends early
+    '''
+    global cycle_timer
+
+    # time each phase of the poll cycle
+    cycle_timer = CycleTimer(config_vars, file_logger)
+    cycle_timer.install_subprocess_hook()
+    exporter_obj.cycle_timer = cycle_timer
+
+    # profile the poll cycle if required (note: only code run in the main
+    # thread is profiled, not tests running concurrently in other threads)
+    profiler = None
+    if config_vars['profile_enabled'] == 'yes':
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if rf_sampler:
+        rf_sampler.start()
+
+    try:
+        run_poll_cycle()
+    except BaseException:
+        # send any results queued by a poll cycle that ended early
+        exporter_obj.flush_results(config_vars)
+        raise
+    finally:
+        cycle_timer.remove_subprocess_hook()
+        exporter_obj.cycle_timer = None
+
+        file_logger.info("Poll cycle run time: {}mS (final results export: {}mS)".format(
+            cycle_timer.get_timings()['run_time_ms'], int(cycle_timer.phases.get('export_flush', 0) * 1000)))
+
+        if profiler:
+            profiler.disable()
+            try:
+                profiler.dump_stats(config_vars['profile_file'])
+                file_logger.info("Poll cycle profile written to: {}".format(config_vars['profile_file']))
+            except (IOError, OSError) as err:
+                file_logger.error("Unable to write poll cycle profile: {}".format(err))
+
+def run_poll_cycle():
+
+    global file_logger
+    global config_vars
+    global watchdog_file
+    global config_file
+    global check_cfg_file
+
+    cycle_timer.start_phase('startup')
+
+    # if we have a config server specified, check to see if it's time
+    # to pull the config
+    file_logger.info("Checking if we use remote cfg file...")
+    if config_vars['cfg_url']:
+        
+        # if able to get cfg file, re-read params in case updated
+        if check_last_cfg_read(config_file, check_cfg_file, config_vars, file_logger):
+            config_vars = load_config()
+
+    else:
+        file_logger.info("No remote cfg file confgured...using current local ini file.")
+
+    # read the clock sync status once for this poll cycle (exporters then
+    # use the cached status until it is older than time_sync_ttl secs)
+    time_sync_status.set_ttl(config_vars['time_sync_ttl'])
+    time_sync_status.refresh()
+
+    # routes are looked up once per destination per poll cycle
+    clear_route_cache()
+
+    # create watchdog if doesn't exist
+    watchdog_obj.create_watchdog()
+
+    # check watchdog count...if higher than 3, time for a reboot
+    watchdog_count = watchdog_obj.get_watchdog_count()
+    if watchdog_count > 3:
+        file_logger.error("Watchdog count exceeded...rebooting")
+        bouncer_obj.reboot()
+
+    ###################################
+    # Check if script already running
+    ###################################
+    if lockf_obj.lock_file_exists():
+
+        # read lock file contents & check how old timestamp is..
+        file_logger.error("Existing lock file found...")
+        watchdog_obj.inc_watchdog_count()
+
+        # if timestamp older than 10 mins, break lock
+        if lockf_obj.lock_is_old():
+            file_logger.error("Existing lock stale, breaking lock...")
+            lockf_obj.break_lock()
+        else:
+            # lock not old enough yet, respect lock & exit
+            file_logger.error("Exiting due to lock file indicating script running.")
+            file_logger.error("(Delete {} if you are sure script not running)".format(lock_file))
+            sys.exit()
+    else:
+        # create lockfile with current timestamp to stop 2nd process starting
+        file_logger.info("No lock file found. Creating lock file.")
+        lockf_obj.write_lock_file()
+
+    # test issue flag - set if any tests hit major issues
+    # to stall further testing
+    config_vars['test_issue'] = False
+    config_vars['test_issue_descr'] = ""
+
+    # set up poll health obj
+    poll_obj = PollStatus(config_vars, file_logger)
+    poll_obj.probe_mode(probe_mode)
+    poll_obj.mgt_if(config_vars['mgt_if'])
+    
+    #############################################
+    # Run network checks
+    #############################################
+    # Note: test_issue flag not set by connection tests, as issues will result in process exit
+    file_logger.info("########## Network connection checks ##########")
+    cycle_timer.start_phase('network_checks')
+    connection_obj = ''
+
+    status_file_obj.write_status_file("network check")
+
+    if config_vars['probe_mode'] == 'ethernet':
+        file_logger.info("Checking ethernet connection is good...(layer 1 &2)")
+        connection_obj = EthernetConnectionTester(file_logger, eth_if, platform)
+    else:
+        file_logger.info("Checking wireless connection is good...(layer 1 &2)")
+        connection_obj = WirelessConnectionTester(file_logger, wlan_if, platform)
+    
+    connection_obj.run_tests(watchdog_obj, lockf_obj, config_vars, exporter_obj)
+    poll_obj.network('OK') 
+    
+    # update poll summary with IP
+    poll_obj.ip(adapter_obj.get_adapter_ip())
+
+    ################################################
+    # Empty results spool queue if required/enabled
+    ################################################
+    file_logger.info("######## spooler checks ########")
+    cycle_timer.start_phase('spool_replay')
+    if config_vars['results_spool_enabled'] == 'yes':
+
+        # clear out old spooled files if required
+        exporter_obj.prune_spools()
+
+        # empty spool queue of each reporting platform that can be reached
+        # (sent in batches, with the spool checkpoint advanced as each batch
+        # is sent)
+        exporter_obj.replay_spools(config_vars)
+
+    else:
+        file_logger.info("Spooler not enabled.")
+
+    #############################################
+    # Run tests
+    #############################################
+    # Bandwidth-heavy tests run on their own, lightweight tests run alongside
+    # each other (up to the configured concurrency limit) and disruptive
+    # tests run last so they cannot upset any other test
+    cycle_timer.start_phase('tests')
+    test_scheduler = TestScheduler(file_logger, concurrency=config_vars['test_concurrency'], cycle_timer=cycle_timer)
+
+    test_scheduler.add_test('speedtest', EXCLUSIVE, run_speedtest, poll_obj)
+    test_scheduler.add_test('ping', CONCURRENT, run_ping_tests, poll_obj)
+    test_scheduler.add_test('dns', CONCURRENT, run_dns_tests, poll_obj)
+    test_scheduler.add_test('http', CONCURRENT, run_http_tests, poll_obj)
+    test_scheduler.add_test('iperf3_tcp', EXCLUSIVE, run_iperf3_tcp_test, poll_obj)
+    test_scheduler.add_test('iperf3_udp', EXCLUSIVE, run_iperf3_udp_test, poll_obj)
+    test_scheduler.add_test('iperf3_matrix', EXCLUSIVE, run_iperf3_matrix_tests, poll_obj)
+    test_scheduler.add_test('dhcp', DISRUPTIVE, run_dhcp_test, poll_obj)
+    test_scheduler.add_test('smb', EXCLUSIVE, run_smb_tests, poll_obj)
+
+    test_scheduler.run_tests()
+
     #####################################
     # Run WIFI time to authenticate test (if enabled)
     #####################################
@@ -453,15 +549,38 @@ def main():
     # Tidy up before exit
     #####################################
   
+    cycle_timer.end_phase()
+
     # dump poller status info
     if config_vars['poller_reporting_enabled'] == 'yes':
         poll_obj.dump(exporter_obj)
 
+    # dump summary of RF samples taken since last poll cycle
+    if rf_sampler:
+        rf_sampler.dump(exporter_obj)
+
+    # dump ethernet link stats & counter changes since last poll cycle
+    if probe_mode == "ethernet" or config_vars['eth_stats_enabled'] == 'yes':
+        eth_stats_obj = EthernetStats(EthernetAdapter(eth_if, file_logger, platform=platform), config_vars, file_logger)
+        eth_stats_obj.dump(exporter_obj)
+
     # dump error messages
     if config_vars['error_messages_enabled'] == 'yes':
         error_msg_obj = ErrorMessages(config_vars, error_log_file, file_logger)
         error_msg_obj.dump(exporter_obj)
 
+    # send all results queued for export during the poll cycle
+    cycle_timer.start_phase('export_flush')
+    exporter_obj.flush_results(config_vars)
+    cycle_timer.end_phase()
+
+    # dump poll cycle timing info (after the flush, so that the timings
+    # include all results exported in the cycle - the timing record itself
+    # is then sent on its own)
+    if config_vars['poll_timing_enabled'] == 'yes':
+        cycle_timer.dump(exporter_obj)
+        exporter_obj.flush_results(config_vars)
+
     # get rid of lock file
     status_file_obj.write_status_file("")
     lockf_obj.delete_lock_file()
@@ -476,6 +595,81 @@ def main():
     if config_vars['unit_bouncer']:
         bouncer_obj.check_for_bounce()
 
+
+###############################################################################
+# Daemon mode
+###############################################################################
+def run_daemon():
+    """
+    Run the poller as a resident process, running a poll cycle at each
+    test_interval/test_offset slot rather than being launched by cron. Modules
+    and objects stay loaded between cycles and config.ini is only re-read
+    when the file changes.
+    """
+    global config_vars
+
+    file_logger.info("Running in daemon mode.")
+
+    # poll cycles modify config_vars (e.g. the test_issue flag), so keep a
+    # clean copy of the config
+    base_config_vars = config_vars
+    config_mtime = get_config_mtime(config_file)
+
+    scheduler = Scheduler(base_config_vars['test_interval'], base_config_vars['test_offset'], file_logger)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+
+    while scheduler.wait_for_next_run():
+
+        # re-read config file only if it has changed since last read
+        current_mtime = get_config_mtime(config_file)
+        if current_mtime != config_mtime:
+            file_logger.info("Config file changed, re-reading: {}".format(config_file))
+            config_vars = base_config_vars = load_config()
+            init_config_objects()
+            scheduler.set_timing(base_config_vars['test_interval'], base_config_vars['test_offset'])
+            config_mtime = current_mtime
+
+        config_vars = dict(base_config_vars)
+
+        # error log must only contain errors from this poll cycle
+        truncate_error_log(file_logger, error_log_file)
+
+        try:
+            poll()
+        except SystemExit:
+            file_logger.warning("Poll cycle ended early, waiting for next cycle.")
+        except Exception as ex:
+            file_logger.exception("Unexpected error during poll cycle: {}".format(ex))
+
+        # make sure a cycle that bailed out does not leave our lock file behind
+        if lockf_obj.lock_owned:
+            try:
+                lockf_obj.delete_lock_file()
+            except SystemExit:
+                pass
+
+    if rf_sampler:
+        rf_sampler.stop()
+
+    file_logger.info("Daemon mode stopped.")
+
+
+###############################################################################
+# Main
+###############################################################################
+def main():
+
+    parser = argparse.ArgumentParser(description="Poller for the wiperf utility")
+    parser.add_argument('--daemon', action='store_true',
+        help="run as a resident process with an internal scheduler (instead of one process per cron run)")
+    args = parser.parse_args()
+
+    if args.daemon:
+        run_daemon()
+    else:
+        poll()
+
 def run():
     main()
 
@@ -485,4 +679,4 @@ def run():
 ###############################################################################
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
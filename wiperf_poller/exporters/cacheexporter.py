@@ -6,15 +6,21 @@ by alternative methods (user defined methods)
 
 Implementation details:
 
-1. Cache files may be in json or CSV format
+1. Cache files may be in json, jsonl (JSON Lines - one json object per line) or CSV format
 2. Cache files are stored under folder /var/cache/wiperf
 3. One folder to conatin cache files will be created for each day
 4. One file will be created for each test type per day (e.g. one for http, one for ping etc.)
 5. The following config parameters will be specified in config .ini:
     a. Caching enabled/disabled
     b. Retention period for files, in days (default = 3)
-    c. Cache file format (json or csv)
+    c. Cache file format (json, jsonl or csv)
     d. Hidden parameter : cache_dir which defaults to /var/cache/wiperf when not supplied
+6. jsonl files are only ever appended to (json files are re-written for each result,
+   so jsonl is preferred for SD card based probes). Appended data is fsync'ed every
+   'cache_fsync_interval' results and at the end of each poll cycle.
+7. An index file (<data_file>.idx) may optionally be created alongside each jsonl file.
+   Each line of the index contains the timestamp & file offset of a result, so that
+   read_cache_results() can skip straight to results after a specific time.
 """
 
 import csv
@@ -23,6 +29,53 @@ import os
 import shutil
 from datetime import datetime
 
+def read_cache_results(data_file, start_time=None):
+    """
+    Generator to read results from a jsonl cache file, one result at a time
+    (so that a whole day's results do not need to be loaded in to memory)
+
+    Args:
+        data_file (str): full path of jsonl cache file
+        start_time (int): if supplied, only results with a timestamp of
+                          start_time (or later) are returned
+
+    Yields:
+        dict: results data
+    """
+    offset = 0
+    index_file = os.path.splitext(data_file)[0] + ".idx"
+
+    # use the index file (if we have one) to skip to the first result required
+    if (start_time is not None) and os.path.exists(index_file):
+        with open(index_file, 'r') as idx_file:
+            for line in idx_file:
+                fields = line.split()
+
+                if len(fields) == 2 and float(fields[0]) >= start_time:
+                    offset = int(fields[1])
+                    break
+            else:
+                return
+
+    with open(data_file, 'r') as jsonl_file:
+        jsonl_file.seek(offset)
+
+        for line in jsonl_file:
+            if not line.strip():
+                continue
+
+            try:
+                dict_data = json.loads(line)
+            except ValueError:
+                # incomplete line (e.g. power lost during write)
+                continue
+
+            if (start_time is not None) and (dict_data.get('time', start_time) < start_time):
+                continue
+
+            yield dict_data
+
+
 class CacheExporter(object):
     """
     A class to dump cached results data in to a local folder for inspection/retrieval
@@ -39,18 +92,17 @@ class CacheExporter(object):
         self.day_dir_name = ''
 
         self.cache_checks_completed = False
+
+        # open jsonl (& index) files: {file name: file object}
+        self.open_files = {}
+        self.unsynced_count = 0
+        self.fsync_interval = 0
     
     
     def _check_cache_day_dir_exists(self):
         """
         Check if today's dir exists
         """
-        # Check if day dir already defined
-        if not self.day_dir_name:
-
-            # derive day directory name in format YYYY--MM-DD
-            self.day_dir_name = self.cache_root + "/" + datetime.today().strftime('%Y-%m-%d')
-
         if os.path.exists(self.day_dir_name) and os.path.isdir(self.day_dir_name):
             return True
 
@@ -130,6 +182,63 @@ class CacheExporter(object):
         return True
 
     
+    def _get_open_file(self, file_name):
+
+        if file_name not in self.open_files:
+            self.open_files[file_name] = open(file_name, 'a')
+
+        return self.open_files[file_name]
+
+    def _sync_files(self):
+        """
+        Flush & fsync all open jsonl/index files
+        """
+        for file_name, file_obj in self.open_files.items():
+            try:
+                file_obj.flush()
+                os.fsync(file_obj.fileno())
+            except (IOError, OSError) as err:
+                self.file_logger.error("Cache file sync error: {} ({})".format(file_name, err))
+
+        self.unsynced_count = 0
+
+    def close_cache_files(self):
+        """
+        Sync & close all open cache files (called at the end of each poll cycle)
+        """
+        self._sync_files()
+
+        for file_obj in self.open_files.values():
+            file_obj.close()
+
+        self.open_files = {}
+
+    def _dump_jsonl_data(self, data_file, dict_data, index_file=''):
+        """
+        Append the results data to today's jsonl file (& index if required)
+        """
+        try:
+            jsonl_file = self._get_open_file(data_file)
+            offset = jsonl_file.tell()
+            jsonl_file.write(json.dumps(dict_data) + "\n")
+            jsonl_file.flush()
+
+            if index_file:
+                idx_file = self._get_open_file(index_file)
+                idx_file.write("{} {}\n".format(dict_data.get('time', 0), offset))
+                idx_file.flush()
+
+        except (IOError, OSError) as err:
+            self.file_logger.error("JSONL I/O update error: {}".format(err))
+            return False
+
+        self.unsynced_count += 1
+
+        if self.fsync_interval and (self.unsynced_count >= self.fsync_interval):
+            self._sync_files()
+
+        return True
+
     def _dump_csv_data(self, data_file, dict_data, column_headers):
         """
         Dump the results data in today's csv file
@@ -161,6 +270,7 @@ class CacheExporter(object):
         self.cache_root = config_vars['cache_root']
         self.retention_period = int(config_vars['cache_retention_period'])
         self.data_format = config_vars['cache_data_format']
+        self.fsync_interval = int(config_vars['cache_fsync_interval'])
 
         # check if we want to limit cache dumping to specific data sources
         if data_filter:
@@ -168,6 +278,15 @@ class CacheExporter(object):
                 self.file_logger.debug("Data source filtered {}, not dumped in cache".format(data_file))
                 return True
 
+        # derive day directory name in format YYYY--MM-DD (re-run cache checks
+        # if the day has rolled over since the last result was dumped)
+        day_dir_name = self.cache_root + "/" + datetime.today().strftime('%Y-%m-%d')
+
+        if day_dir_name != self.day_dir_name:
+            self.close_cache_files()
+            self.day_dir_name = day_dir_name
+            self.cache_checks_completed = False
+
         # check cache checks, unless completed on previous iteration
         if not self.cache_checks_completed:
 
@@ -189,6 +308,13 @@ class CacheExporter(object):
             data_file = self.day_dir_name + "/" + data_file + ".json"
             self._dump_json_data(data_file, dict_data)
 
+        elif self.data_format == 'jsonl':
+            index_file = ''
+            if config_vars['cache_jsonl_index'] == 'yes':
+                index_file = self.day_dir_name + "/" + data_file + ".idx"
+            data_file = self.day_dir_name + "/" + data_file + ".jsonl"
+            self._dump_jsonl_data(data_file, dict_data, index_file)
+
         elif self.data_format == 'csv':
             data_file = self.day_dir_name + "/" + data_file + ".csv"
             self._dump_csv_data(data_file, dict_data, column_headers)
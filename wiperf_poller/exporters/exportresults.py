@@ -1,25 +1,215 @@
 """
 Set of functions to export results data to a variety of destinations
+
+Results are queued in memory during the poll cycle and sent to the
+reporting platform in batches when flush_results() is called (unless
+results batching is disabled in config.ini). The connection to the
+reporting platform is re-used for all batches sent in the poll cycle.
+
+Results may be sent to more than one reporting platform (e.g. while
+migrating between platforms), by configuring a comma separated list of
+exporter types. Results are sent to each platform concurrently, and each
+platform has its own spool & retry state, so a slow or unreachable platform
+does not hold up the others.
 """
 import csv
 import json
 import os
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from socket import gethostname
 
 from wiperf_poller.exporters.splunkexporter import SplunkExporter
-from wiperf_poller.exporters.influxexporter2 import influxexporter2
-from wiperf_poller.exporters.influxexporter import influxexporter
+from wiperf_poller.exporters.influxexporter2 import Influx2Exporter, get_tag_schema
+from wiperf_poller.exporters.influxexporter import InfluxExporter
 from wiperf_poller.exporters.spoolexporter import SpoolExporter
 from wiperf_poller.helpers.route import is_ipv6
+from wiperf_poller.helpers.timefunc import convert_timestamp
 from wiperf_poller.exporters.cacheexporter import CacheExporter
 
+###############################################################################
+# Exporter registry
+###############################################################################
+
+# exporter back-ends: exporter type (as used in config.ini) -> function that
+# creates the exporter object, called as: factory(config_vars, file_logger).
+# Exporter objects must provide:
+#
+#   export_results(results_list): send a batch of (source, results_dict)
+#       tuples to the reporting platform, returning True if sent OK. If only
+#       part of the batch was sent, the exporter may set its unsent_indexes
+#       attribute to the list indexes of the results not sent (otherwise
+#       none of the batch is treated as sent)
+#   close(): close any connection to the reporting platform
+exporter_registry = {}
+
+def register_exporter(exporter_type, factory):
+    """
+    Add an exporter back-end to the registry
+    """
+    exporter_registry[exporter_type] = factory
+
+def _url_host(host):
+
+    if is_ipv6(host):
+        return "[{}]".format(host)
+
+    return host
+
+def splunk_exporter(config_vars, file_logger):
+
+    return SplunkExporter(config_vars['splunk_host'], config_vars['splunk_token'], file_logger, config_vars['splunk_port'],
+        endpoint=config_vars['splunk_endpoint'], use_gzip=(config_vars['splunk_gzip'] == 'yes'),
+        use_ack=(config_vars['splunk_ack'] == 'yes'), ack_timeout=config_vars['splunk_ack_timeout'])
+
+def influx_exporter(config_vars, file_logger):
+
+    return InfluxExporter(gethostname(), _url_host(config_vars['influx_host']), config_vars['influx_port'], config_vars['influx_username'],
+        config_vars['influx_password'], config_vars['influx_database'], config_vars['influx_ssl'], file_logger)
+
+def influx2_exporter(config_vars, file_logger):
+
+    # construct url
+    scheme = 'https' if config_vars['influx2_ssl'] else 'http'
+    influx_url = "{}://{}:{}".format(scheme, _url_host(config_vars['influx2_host']), config_vars['influx2_port'])
+
+    return Influx2Exporter(gethostname(), influx_url, config_vars['influx2_token'],
+        config_vars['influx2_bucket'], config_vars['influx2_org'], file_logger, tag_schema=get_tag_schema(config_vars))
+
+register_exporter('splunk', splunk_exporter)
+register_exporter('influxdb', influx_exporter)
+register_exporter('influxdb2', influx2_exporter)
+
+
+class ExportDestination(object):
+    """
+    A reporting platform that results are exported to: the exporter object
+    (and its connection), plus the spool & retry state of the platform
+    """
+
+    def __init__(self, exporter_type, factory, spooler_obj, file_logger, export_timer=None):
+
+        self.exporter_type = exporter_type
+        self.factory = factory
+        self.spooler_obj = spooler_obj
+        self.file_logger = file_logger
+        self.export_timer = export_timer
+
+        # exporter object (and its connection) re-used during the poll cycle
+        self.exp_obj = None
+
+        # set by the mgt connection check at the start of each poll cycle -
+        # results for a platform that cannot be reached are spooled
+        self.reachable = True
+
+        # once a send has failed, the rest of the results in the poll cycle
+        # are spooled rather than waiting for each send to fail again
+        self.send_failed = False
+
+        # results of the last batch that were not sent
+        self.unsent_results = []
+
+    def _convert_times(self, config_vars, results_list):
+
+        # result timestamps are in the format of the first exporter type
+        time_format = config_vars['time_format']
+
+        if time_format == self.exporter_type:
+            return results_list
+
+        converted = []
+
+        for source, results_dict in results_list:
+            if 'time' in results_dict:
+                results_dict = dict(results_dict)
+                results_dict['time'] = convert_timestamp(results_dict['time'], time_format, self.exporter_type)
+            converted.append((source, results_dict))
+
+        return converted
+
+    def send_results_batch(self, config_vars, results_list):
+        """
+        Send a batch of results to the reporting platform (results are not
+        spooled if the send fails, the results not sent are left in
+        unsent_results)
+
+        Args:
+            config_vars (dict): all config vars
+            results_list (list): list of (data_file, results_dict) tuples
+
+        Returns:
+            bool: True if the batch was sent OK
+        """
+        start = time.monotonic()
+
+        try:
+            if not self.exp_obj:
+                self.exp_obj = self.factory(config_vars, self.file_logger)
+
+            self.file_logger.info("Sending {} result(s) to {} exporter.".format(len(results_list), self.exporter_type))
+
+            self.unsent_results = []
+
+            if self.exp_obj.export_results(self._convert_times(config_vars, results_list)):
+                return True
+
+            unsent_indexes = getattr(self.exp_obj, 'unsent_indexes', None)
+
+            if unsent_indexes is None:
+                self.unsent_results = list(results_list)
+            else:
+                self.unsent_results = [results_list[index] for index in unsent_indexes]
+                self.file_logger.warning("{} of {} result(s) not sent to {} exporter.".format(
+                    len(self.unsent_results), len(results_list), self.exporter_type))
+
+            self.send_failed = True
+            return False
+
+        finally:
+            if self.export_timer:
+                self.export_timer(time.monotonic() - start, len(results_list))
+
+    def export_results(self, config_vars, results_list):
+        """
+        Send a batch of results to the reporting platform, unless it could not
+        be reached at the start of the poll cycle or an earlier send in this
+        poll cycle failed
+
+        Returns:
+            bool: True if the batch was sent OK
+        """
+        if not self.reachable:
+            self.file_logger.info("Not sending {} result(s) to {} exporter as mgt platform not reachable.".format(len(results_list), self.exporter_type))
+            self.unsent_results = list(results_list)
+            return False
+
+        if self.send_failed:
+            self.file_logger.info("Not sending {} result(s) to {} exporter as earlier send failed.".format(len(results_list), self.exporter_type))
+            self.unsent_results = list(results_list)
+            return False
+
+        return self.send_results_batch(config_vars, results_list)
+
+    def close(self):
+        """
+        Close the connection to the reporting platform & the spool (the retry
+        state is reset for the next poll cycle)
+        """
+        if self.exp_obj:
+            self.exp_obj.close()
+            self.exp_obj = None
+
+        self.spooler_obj.close()
+        self.send_failed = False
+
+
 class ResultsExporter(object):
     """
     Class to implement universal resuts exporter for wiperf
     """
 
-    def __init__(self, file_logger, watchdog_obj, lockf_obj, spooler_obj, platform):
+    def __init__(self, file_logger, watchdog_obj, lockf_obj, spooler_obj, platform, config_vars):
 
         self.platform = platform
         self.file_logger = file_logger
@@ -27,79 +217,207 @@ class ResultsExporter(object):
         self.lockf_obj = lockf_obj
         self.cache_obj = CacheExporter(file_logger)
         self.spooler_obj = spooler_obj
-    
-    def send_results_to_splunk(self, host, token, port, dict_data, file_logger, source):
 
-        file_logger.info("Sending results event to Splunk: {} (dest host: {}, dest port: {})".format(source, host, port))
-        splunk_exp_obj=SplunkExporter(host, token, file_logger, port)
-        return splunk_exp_obj.export_result(dict_data, source)
+        # results waiting to be sent: list of (data_file, results_dict) tuples
+        self.results_queue = []
+
+        # reporting platforms results are sent to
+        self.destinations = self._create_destinations(config_vars)
+
+        # tests may run concurrently, so only export one result at a time
+        self.lock = threading.Lock()
+
+        # poll cycle timer (if export times are being recorded)
+        self.cycle_timer = None
+
+    def _create_destinations(self, config_vars):
+
+        destinations = []
+
+        for exporter_type in config_vars['exporter_types']:
+
+            if exporter_type not in exporter_registry:
+                self.file_logger.error("Unknown exporter type in config file: {} (ignored)".format(exporter_type))
+                continue
+
+            # the first platform uses the main spool, others have their own
+            if destinations:
+                spooler_obj = SpoolExporter(config_vars, self.file_logger,
+                    spool_dir=os.path.join(config_vars['results_spool_dir'], exporter_type))
+            else:
+                spooler_obj = self.spooler_obj
+
+            destinations.append(ExportDestination(exporter_type, exporter_registry[exporter_type], spooler_obj,
+                self.file_logger, export_timer=self._add_export_time))
+
+        return destinations
 
-    def send_results_to_influx(self, localhost, host, port, username, password, database, use_ssl, dict_data, source, file_logger):
+    def _add_export_time(self, export_time, count):
 
-        file_logger.info("Sending results data to Influx host: {}, port: {}, database: {})".format(host, port, database))
-        if is_ipv6(host): host = "[{}]".format(host)
-        return influxexporter(localhost, host, port, username, password, database, use_ssl, dict_data, source, file_logger)
-    
-    def send_results_to_influx2(self, localhost, url, token, bucket, org, dict_data, source, file_logger):
+        cycle_timer = self.cycle_timer
 
-        file_logger.info("Sending results data to Influx url: {}, bucket: {}, source: {})".format(url, bucket, source))
-        return influxexporter2(localhost, url, token, bucket, org, dict_data, source, file_logger)
-    
-    def send_results_to_spooler(self, config_vars, data_file, dict_data, file_logger):
+        if cycle_timer:
+            cycle_timer.add_export(export_time, count)
 
-        file_logger.info("Sending results data to spooler: {} (as mgt platform not available)".format(data_file))
-        return self.spooler_obj.spool_results(config_vars, data_file, dict_data, self.watchdog_obj, self.lockf_obj)
+    def _for_each_destination(self, function):
+        """
+        Call function(destination) for each reporting platform (concurrently
+        if there is more than one) & return a list of the return values
+        """
+        if len(self.destinations) <= 1:
+            return [function(destination) for destination in self.destinations]
+
+        with ThreadPoolExecutor(max_workers=len(self.destinations)) as executor:
+            return list(executor.map(function, self.destinations))
+
+    def close_exporters(self):
+        """
+        Close down connections to the reporting platforms (and their spools)
+        """
+        for destination in self.destinations:
+            destination.close()
+
+        self.spooler_obj.close()
+
+    def check_destinations(self, connection_obj):
+        """
+        Check that each reporting platform can be reached. Results for a
+        platform that cannot be reached are spooled for the rest of the poll
+        cycle (and its spool is not replayed).
+
+        Returns:
+            bool: True if at least one reporting platform can be reached
+        """
+        for destination in self.destinations:
+
+            self.file_logger.info("Checking we can get to the management platform (type = {})".format(destination.exporter_type))
+
+            destination.reachable = bool(connection_obj.check_connection(self.lockf_obj, destination.exporter_type))
+
+            if not destination.reachable:
+                self.file_logger.warning("Unable to reach {} mgt platform, its results will be spooled.".format(destination.exporter_type))
+
+        return any([destination.reachable for destination in self.destinations])
+
+    def send_results_to_spooler(self, config_vars, data_file, dict_data, file_logger, destination):
+        """
+        Spool a result for a reporting platform
+        """
+        file_logger.info("Sending results data to spooler: {} (as {} mgt platform not available)".format(data_file, destination.exporter_type))
+
+        return destination.spooler_obj.spool_results(config_vars, data_file, dict_data)
+
+    def _export_results(self, config_vars, destination, results_list):
+        """
+        Send results to a reporting platform, spooling them if the send fails
+        """
+        if destination.export_results(config_vars, results_list):
+            return True
 
+        # sending to reporting server failed, try spooling results (not sent)
+        # as last resort
+        all_spooled = True
+
+        for data_file, results_dict in destination.unsent_results:
+            if not self.send_results_to_spooler(config_vars, data_file, results_dict, self.file_logger, destination):
+                all_spooled = False
+
+        return all_spooled
 
     def send_results(self, config_vars, results_dict, column_headers, data_file, test_name, file_logger, delete_data_file=False):
 
-        sent_ok = False
+        with self.lock:
+            return self._send_results(config_vars, results_dict, column_headers, data_file, test_name, file_logger)
+
+    def _send_results(self, config_vars, results_dict, column_headers, data_file, test_name, file_logger):
 
         # dump the results to local cache if enabled
         if config_vars['cache_enabled'] =='yes':
             file_logger.info("Sending results to local file cache.")
             self.cache_obj.dump_cache_results(config_vars, data_file, results_dict, column_headers)
 
-        # dump the results to appropriate destination
-        if config_vars['exporter_type'] == 'splunk':
-
-            file_logger.info("Splunk update: {}, source={}".format(data_file, test_name))
-            sent_ok = self.send_results_to_splunk(config_vars['data_host'], config_vars['splunk_token'], config_vars['data_port'],
-                results_dict, file_logger, data_file)
-        
-        elif config_vars['exporter_type'] == 'influxdb':
-            
-            file_logger.info("InfluxDB update: {}, source={}".format(data_file, test_name))
-
-            sent_ok = self.send_results_to_influx(gethostname(), config_vars['data_host'], config_vars['data_port'], 
-                config_vars['influx_username'], config_vars['influx_password'], config_vars['influx_database'], config_vars['influx_ssl'], results_dict, data_file, file_logger)
-        
-        elif config_vars['exporter_type'] == 'influxdb2':
-            
-            file_logger.info("InfluxDB2 update: {}, source={}".format(data_file, test_name))
-
-            # construct url
-            host = config_vars['data_host']
-            scheme = 'https' if config_vars['influx2_ssl'] else 'http'
-            if is_ipv6(host): host = "[{}]".format(host)
-            influx_url = "{}://{}:{}".format(scheme, host, config_vars['data_port'])
-
-            sent_ok = self.send_results_to_influx2(gethostname(), influx_url, config_vars['influx2_token'],
-                    config_vars['influx2_bucket'], config_vars['influx2_org'], results_dict, data_file, file_logger)
-        
-        elif config_vars['exporter_type'] == 'spooler':
-
-            # Do nothing, but drop through to spooler export at end
-            pass
-        
-        else:
-            file_logger.info("Unknown exporter type in config file: {}".format(config_vars['exporter_type']))
-            self.lockf_obj.delete_lock_file()
-            sys.exit()
-
-        if sent_ok:
-            # we sent our data to  reporting plarform OK
+        # queue the results to be sent in a batch at the end of the poll cycle
+        # (take a copy, as some testers re-use their results dict)
+        if config_vars['results_batching'] == 'yes':
+            file_logger.info("Queued results for export: {}, source={}".format(data_file, test_name))
+            self.results_queue.append((data_file, dict(results_dict)))
             return True
-        else:
-            # sending to reporting server failed, try spooling result as last resort
-            return self.send_results_to_spooler(config_vars, data_file, results_dict, file_logger)
+
+        file_logger.info("{} update: {}, source={}".format(config_vars['exporter_type'], data_file, test_name))
+
+        results_list = [(data_file, results_dict)]
+
+        return all(self._for_each_destination(lambda destination: self._export_results(config_vars, destination, results_list)))
+
+    def prune_spools(self):
+        """
+        Remove old spooled results of all reporting platforms
+        """
+        for destination in self.destinations:
+            destination.spooler_obj.prune_old_files()
+
+    def _replay_spool(self, config_vars, destination):
+
+        if not destination.reachable:
+            self.file_logger.info("Not sending spooled results to {} exporter as mgt platform not reachable.".format(destination.exporter_type))
+            return False
+
+        return destination.spooler_obj.replay_results(config_vars, destination)
+
+    def replay_spools(self, config_vars):
+        """
+        Send spooled results to each reporting platform that can be reached
+        (concurrently)
+
+        Returns:
+            bool: True if all spooled results were sent
+        """
+        with self.lock:
+            try:
+                return all(self._for_each_destination(lambda destination: self._replay_spool(config_vars, destination)))
+            finally:
+                # (the retry state of a platform is kept for the rest of the
+                # poll cycle, only the spool files are closed)
+                for destination in self.destinations:
+                    destination.spooler_obj.close()
+
+    def _flush_destination(self, config_vars, destination, results_queue, batch_size):
+
+        all_sent = True
+
+        for index in range(0, len(results_queue), batch_size):
+
+            if not self._export_results(config_vars, destination, results_queue[index:index + batch_size]):
+                all_sent = False
+
+        return all_sent
+
+    def flush_results(self, config_vars):
+        """
+        Send all queued results to the reporting platforms in batches. Results
+        from any batch that cannot be sent are spooled.
+
+        Returns:
+            bool: True if all results were sent or spooled OK
+        """
+        with self.lock:
+
+            results_queue = self.results_queue
+            self.results_queue = []
+
+            # make sure all cached results are written to disk
+            self.cache_obj.close_cache_files()
+
+            if not results_queue:
+                self.close_exporters()
+                return True
+
+            self.file_logger.info("Sending {} queued result(s) to reporting platform.".format(len(results_queue)))
+
+            batch_size = max(int(config_vars['results_batch_size']), 1)
+
+            try:
+                return all(self._for_each_destination(lambda destination: self._flush_destination(config_vars, destination, results_queue, batch_size)))
+            finally:
+                # make sure all spooled results are written to disk
+                self.close_exporters()
@@ -1,71 +1,223 @@
-import datetime
-import sys
-from wiperf_poller.helpers.timefunc import time_synced, now_as_msecs
-
-# module import vars
-influx_modules = True
-import_err = ''
-
-try:
-    from influxdb import InfluxDBClient
-except ImportError as error:
-    influx_modules = False
-    import_err = error
-
-# TODO: Error checking if write to Influx fails 
-# TODO: convert to class
-
-def time_lookup():
-    return datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-
-
-def influxexporter(localhost, host, port, username, password, database, use_ssl, dict_data, source, file_logger):
-
-    if not influx_modules:
-        file_logger.error(" ********* MAJOR ERROR ********** ")
-        file_logger.error("One or more Influx Python .are not installed on this system. Influx export failed, exiting")
-        file_logger.error("(Execute the following command from the command line of the WLAN Pi: 'sudo pip3 install influxdb')")
-        file_logger.error(import_err)
-        sys.exit()
-
-    client = InfluxDBClient(host, port, username, password, database, ssl=use_ssl, verify_ssl=False, timeout=100)
-    file_logger.debug("Creating InfluxDB API client...")
-    file_logger.debug("Remote host: -{}-".format(host))
-    file_logger.debug("Port: -{}-".format(port))
-    file_logger.debug("Database: -{}-".format(database))
-    file_logger.debug("User: -{}-".format(username))
-
-    data_point = {
-        "measurement": source,
-        "tags": { "host": localhost },
-        "fields": {},
-    }
-
-    # if time-source sync'ed, add timestamp
-    if time_synced():
-        data_point['time'] = dict_data['time']
- 
-    # put results data in to payload to send to Influx
-    data_point['fields'] = dict_data
-
-    # send to Influx
-    try:
-        if client.write_points([data_point], time_precision='ms'):    
-            file_logger.info("Data sent to influx OK")
-        else:
-            file_logger.info("Issue with sending data sent to influx...")
-            return False
+"""
+A class to export results to InfluxDB (v1.x) using the http write API.
+
+Results are converted directly to InfluxDB line protocol (rather than
+building a list of points for a client library to convert) and each batch
+is sent in a single gzip compressed POST to /write, over an http session
+that is kept open for all batches sent in the poll cycle. Writes that fail
+due to a connection or server error are retried after a short delay (which
+is doubled for each retry).
+"""
+import gzip
+import math
+import time
+import requests
+import urllib3
+from wiperf_poller.helpers.timefunc import time_synced
+
+# number of times a failed write is retried
+WRITE_RETRIES = 2
+
+# delay before the first retry of a failed write (secs)
+RETRY_BACKOFF = 0.5
+
+# http timeout of each write (secs)
+WRITE_TIMEOUT = 10
+
+# http status codes of failed writes that are worth retrying
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# gzip compression level of write requests
+GZIP_LEVEL = 6
+
+# characters escaped in measurement names, tag keys/values & field keys
+_KEY_ESCAPES = str.maketrans({'\\': '\\\\', ' ': '\\ ', ',': '\\,', '=': '\\=', '\n': '\\n'})
+
+# characters escaped in string field values
+_STRING_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+def escape_key(key):
+    """
+    Escape a measurement name, tag key, tag value or field key for line protocol
+    """
+    return str(key).translate(_KEY_ESCAPES)
+
+def format_field_value(value):
+    """
+    Format a field value for line protocol (integers are written as integer
+    fields, as the InfluxDB python client did). Returns None if the value
+    cannot be written (None, NaN or infinity).
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+
+    if isinstance(value, int):
+        return '{}i'.format(value)
+
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        return repr(value)
+
+    return '"{}"'.format(str(value).translate(_STRING_ESCAPES))
+
+def make_line(measurement, tags, fields, timestamp=None):
+    """
+    Convert a data point to a line of line protocol. Fields with no value
+    and tags with an empty value are left out. Returns None if the point has
+    no fields to write.
+    """
+    field_set = []
+
+    for key, value in fields.items():
+        value = format_field_value(value)
+
+        if value is not None:
+            field_set.append('{}={}'.format(escape_key(key), value))
+
+    if not field_set:
+        return None
+
+    line = escape_key(measurement)
+
+    for key in sorted(tags):
+        if tags[key] not in [None, '']:
+            line += ',{}={}'.format(escape_key(key), escape_key(tags[key]))
+
+    line += ' ' + ','.join(field_set)
+
+    if timestamp is not None:
+        line += ' {}'.format(int(timestamp))
+
+    return line
+
+
+class InfluxExporter(object):
+    """
+    Class to export results to InfluxDB (v1.x). A single http session is
+    used for all results sent until close() is called.
+    """
+
+    def __init__(self, localhost, host, port, username, password, database, use_ssl, file_logger):
+
+        self.localhost = localhost
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.database = database
+        self.use_ssl = use_ssl
+        self.file_logger = file_logger
+
+        scheme = 'https' if use_ssl else 'http'
+        self.url = "{}://{}:{}/write".format(scheme, host, port)
+
+        self.session = None
+
+    def _get_session(self):
+
+        if not self.session:
+
+            # stop errors if using https
+            if self.use_ssl:
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+            self.session = requests.Session()
+            self.session.verify = False
+            self.session.auth = (self.username, self.password)
+            self.session.headers.update({'Content-Type': 'text/plain; charset=utf-8', 'Content-Encoding': 'gzip'})
+
+            self.file_logger.debug("Creating InfluxDB http session...")
+            self.file_logger.debug("URL: -{}-".format(self.url))
+            self.file_logger.debug("Database: -{}-".format(self.database))
+            self.file_logger.debug("User: -{}-".format(self.username))
+
+        return self.session
+
+    def close(self):
+        """
+        Close the http session to the InfluxDB server
+        """
+        if self.session:
+            self.session.close()
+            self.session = None
+
+    def _write(self, body):
+
+        params = {'db': self.database, 'precision': 'ms'}
+        retry_delay = RETRY_BACKOFF
+
+        for attempt in range(WRITE_RETRIES + 1):
+
+            if attempt:
+                self.file_logger.warning("Retrying write to Influx in {}s...".format(retry_delay))
+                time.sleep(retry_delay)
+                retry_delay *= 2
+
+            try:
+                response = self._get_session().post(self.url, params=params, data=body, timeout=WRITE_TIMEOUT)
+            except requests.exceptions.RequestException as err:
+                self.file_logger.error("Issue sending data to Influx: {}".format(err))
+                # start again with a new connection
+                self.close()
+                continue
+
+            if response.status_code == 204:
+                return True
+
+            self.file_logger.error("Issue sending data to Influx - http code: {} ({})".format(response.status_code, response.text[:200].strip()))
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                return False
 
-    except Exception as err:
-        file_logger.error("Issue sending data to Influx: {}".format(err))
         return False
-    
-    # close the http session
-    client.close()
-    
-    file_logger.debug("Data structure sent to Influx:")
-    file_logger.debug(data_point)
 
-    return True
+    def export_results(self, results_list):
+        """
+        Send a batch of results to InfluxDB in a single write
+
+        Args:
+            results_list (list): list of (source, results_dict) tuples
+
+        Returns:
+            bool: True if all data points written OK
+        """
+        add_time = time_synced()
+
+        tags = { "host": self.localhost }
+        lines = []
+
+        for source, dict_data in results_list:
+
+            fields = dict([(key, value) for key, value in dict_data.items() if key != 'time'])
+
+            # if time-source sync'ed, add timestamp
+            timestamp = dict_data.get('time') if add_time else None
+
+            line = make_line(source, tags, fields, timestamp)
+
+            if line is None:
+                self.file_logger.warning("No fields to send to Influx for result: {}".format(source))
+                continue
+
+            lines.append(line)
+
+        if not lines:
+            return True
+
+        data = '\n'.join(lines)
+
+        self.file_logger.debug("Data sent to Influx:")
+        self.file_logger.debug(data)
+
+        # send to Influx
+        if not self._write(gzip.compress(data.encode('utf-8'), compresslevel=GZIP_LEVEL)):
+            self.close()
+            return False
+
+        self.file_logger.info("Data sent to influx OK ({} points)".format(len(lines)))
 
-    
+        return True
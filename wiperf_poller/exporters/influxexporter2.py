@@ -1,6 +1,15 @@
-
-import datetime
+"""
+A class to export results to InfluxDB2.
+
+Each result is written as a single data point (one field per result value)
+with the result's own timestamp. Values used to identify a result (e.g. the
+ping target or SSID) are written as tags rather than fields, as listed in
+the tag schema for the data source of the result. Each batch of results is
+converted to line protocol and sent in a single write.
+"""
 import sys
+from wiperf_poller.exporters.influxexporter import make_line
+from wiperf_poller.helpers.timefunc import time_synced
 
 # module import vars
 influx_modules = True
@@ -8,66 +17,174 @@ import_err = ''
 
 try:
     import influxdb_client
-    from influxdb_client import InfluxDBClient, Point
+    from influxdb_client import InfluxDBClient, WritePrecision
     from influxdb_client.client.write_api import SYNCHRONOUS
 except ImportError as error:
     influx_modules = False
     import_err = error
 
-# TODO: Error checking if write to Influx fails 
-# TODO: convert to class
+# result values written as tags for all data sources
+DEFAULT_TAGS = ['location']
+
+# result values written as tags for each data source: config.ini data file
+# parameter -> result keys
+TAG_SCHEMA = {
+    'network_data_file': ['ssid', 'bssid'],
+    'rf_data_file': ['bssid'],
+    'eth_data_file': ['interface'],
+    'speedtest_data_file': ['provider', 'server_name'],
+    'ping_data_file': ['ping_host', 'ping_index'],
+    'iperf3_matrix_tcp_data_file': ['cell', 'server', 'direction'],
+    'iperf3_matrix_udp_data_file': ['cell', 'server', 'direction'],
+    'dns_data_file': ['dns_index', 'dns_target', 'dns_server', 'query_type'],
+    'http_data_file': ['http_index', 'http_target'],
+    'dhcp_data_file': ['mode'],
+    'smb_data_file': ['smb_index', 'smb_host', 'direction'],
+}
+
+def get_tag_schema(config_vars):
+    """
+    Return the tag schema keyed on data source (as named in config.ini)
+    """
+    tag_schema = {}
+
+    for data_file_param, tag_keys in TAG_SCHEMA.items():
+
+        data_file = config_vars.get(data_file_param)
+
+        if data_file:
+            tag_schema[data_file] = tag_keys
+
+    return tag_schema
+
+
+class Influx2Exporter(object):
+    """
+    Class to export results to InfluxDB2. A single API client & write API
+    are used for all results sent until close() is called.
+    """
+
+    def __init__(self, localhost, url, token, bucket, org, file_logger, tag_schema=None):
+
+        self.localhost = localhost
+        self.url = url
+        self.token = token
+        self.bucket = bucket
+        self.org = org
+        self.file_logger = file_logger
+
+        # data source -> result keys written as tags
+        self.tag_schema = tag_schema if tag_schema else {}
+
+        self.client = None
+        self.write_api = None
+
+    def _get_write_api(self):
+
+        if not influx_modules:
+            self.file_logger.error(" ********* MAJOR ERROR ********** ")
+            self.file_logger.error("One or more Influx Python .are not installed on this system. Influx export failed, exiting")
+            self.file_logger.error(import_err)
+            sys.exit()
+
+        if not self.write_api:
+
+            self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org, timeout=100)
+            self.file_logger.debug("Creating InfluxDB2 API client...")
+            self.file_logger.debug("URL: -{}-".format(self.url))
+            self.file_logger.debug("Token: -{}-".format(self.token))
+            self.file_logger.debug("Org: -{}-".format(self.org))
+
+            try:
+                self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+            except Exception as err:
+                self.file_logger.error("Error creating InfluxDB2 API client: {}".format(err))
+                self.close()
+                return False
+
+        return self.write_api
+
+    def close(self):
+        """
+        Close the write API & client connection to the InfluxDB2 server
+        """
+        if self.write_api:
+            self.write_api.close()
+            self.write_api = None
+
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    def make_point(self, source, dict_data, add_time=True):
+        """
+        Convert a result to a line protocol data point, splitting the result
+        values in to tags & fields using the tag schema of its data source.
+        Returns None if the result has no fields.
+        """
+        tag_keys = DEFAULT_TAGS + self.tag_schema.get(source, [])
+
+        tags = { "host": self.localhost }
+        fields = {}
+
+        for key, value in dict_data.items():
+
+            if key == 'time':
+                continue
+
+            if key in tag_keys:
+                if value is not None:
+                    tags[key] = str(value)
+            else:
+                fields[key] = value
+
+        # if time-source sync'ed, use the time of the result
+        timestamp = dict_data.get('time') if add_time else None
+
+        return make_line(source, tags, fields, timestamp)
 
-def time_lookup():
-    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    def export_results(self, results_list):
+        """
+        Send a batch of results to InfluxDB2 in a single write
 
+        Args:
+            results_list (list): list of (source, results_dict) tuples
 
-def influxexporter2(localhost, url, token, bucket, org, dict_data, source, file_logger):
+        Returns:
+            bool: True if all data points written OK
+        """
+        write_api = self._get_write_api()
 
-    if not influx_modules:
-        file_logger.error(" ********* MAJOR ERROR ********** ")
-        file_logger.error("One or more Influx Python .are not installed on this system. Influx export failed, exiting")
-        file_logger.error(import_err)
-        sys.exit()
+        if not write_api:
+            return False
 
-    client = InfluxDBClient(url=url, token=token, org=org, timeout=100)
-    file_logger.debug("Creating InfluxDB2 API client...")
-    file_logger.debug("URL: -{}-".format(url))
-    file_logger.debug("Token: -{}-".format(token))
-    file_logger.debug("Org: -{}-".format(org))
+        add_time = time_synced()
 
-    try:
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-    except Exception as err:
-        file_logger.error("Error creating InfluxDB2 API client: {}".format(err))
-        return False
+        data = []
 
-    now = time_lookup()
+        # construct data points to send to InFlux (one per result)
+        for source, dict_data in results_list:
 
-    data = []
+            data_point = self.make_point(source, dict_data, add_time)
 
-    # construct data structure to send to InFlux
-    for key, value in dict_data.items():
+            if data_point is None:
+                self.file_logger.warning("No fields to send to InfluxDB2 for result: {}".format(source))
+                continue
 
-        if key == 'time':
-            continue
+            data.append(data_point)
 
-        data_point = {"measurement": source,
-            "tags": { "host": localhost },
-            "fields": {key: value},
-            "time": now
-        }
+        if not data:
+            return True
 
-        data.append(data_point)
+        # send to Influx
+        self.file_logger.debug("Data sent to InfluxDB2:")
+        self.file_logger.debug(data)
+        try:
+            write_api.write(self.bucket, self.org, data, write_precision=WritePrecision.MS)
+            self.file_logger.info("Data sent to InfluxDB2 ({} points). (bucket: {})".format(len(data), self.bucket))
+        except Exception as err:
+            self.file_logger.error("Error sending data to InfluxDB2: {}".format(err))
+            self.close()
+            return False
 
-    # send to Influx
-    file_logger.debug("Data structure sent to Influx:")
-    file_logger.debug(data)
-    try:
-        write_api.write(bucket, org, data)
-        file_logger.info("Data sent to InfluxDB2. (bucket: {})".format(bucket))
-    except Exception as err:
-        file_logger.error("Error sending data to InfluxDB2: {}".format(err))
-        return False
-    
-    return True
-    
+        return True
@@ -1,23 +1,43 @@
 """
 A class to perform data export to Splunk using the HTTP event logger (HEC).
+
+Each batch of results is sent in a single (gzip compressed) http post over
+a session kept open for the poll cycle, either as HEC events (event
+endpoint) or as one json object per line (raw endpoint - one post for each
+data source in the batch). If indexer acknowledgement is enabled, a batch
+is only reported as sent once Splunk confirms that it has been indexed, so
+that spooled results are only removed from the spool once they are safe.
 """
 from wiperf_poller.helpers.os_cmds import NC_CMD
 from wiperf_poller.helpers.route import is_ipv6
 from wiperf_poller.helpers.timefunc import time_synced
+import gzip
 import json
 import requests
 import subprocess
 import socket
 import time
+import uuid
 from requests.exceptions import HTTPError
 import urllib3
 
+# http timeout of each post to Splunk (secs)
+POST_TIMEOUT = 10
+
+# gzip compression level of results sent
+GZIP_LEVEL = 6
+
+# secs before the first indexer acknowledgement check (doubled for each
+# further check, up to ACK_POLL_MAX)
+ACK_POLL_INTERVAL = 0.5
+ACK_POLL_MAX = 5
+
 class SplunkExporter(object):
     """
     Class to implement event export to Splunk
     """
 
-    def __init__(self, host, token, file_logger, port='8088', secure=True):
+    def __init__(self, host, token, file_logger, port='8088', secure=True, endpoint='event', use_gzip=True, use_ack=False, ack_timeout=30):
 
         # Splunk connection params
         self.host = host
@@ -25,9 +45,25 @@ class SplunkExporter(object):
         self.port = port
         self.secure = secure
 
+        # HEC endpoint results are sent to: event or raw
+        self.endpoint = endpoint
+        self.use_gzip = use_gzip
+        self.use_ack = use_ack
+        self.ack_timeout = float(ack_timeout)
+
+        # HEC channel (required for indexer acknowledgement & raw endpoint)
+        self.channel = str(uuid.uuid4())
+
         self.hostname = socket.gethostname()
         
         self.file_logger = file_logger
+
+        # http session re-used (keep-alive) for all results sent to Splunk
+        self.session = None
+
+        # list indexes of the results of the last batch not sent, if only
+        # part of the batch was sent (None if none of the batch was sent)
+        self.unsent_indexes = None
   
 
     def _url_generator(self, path='/'):
@@ -37,13 +73,32 @@ class SplunkExporter(object):
         if self.secure:
             scheme = 'https'
 
-        if is_ipv6(self.host): 
-            self.host = "[{}]".format(self.host)
+        host = self.host
 
-        url = "{}://{}:{}{}".format(scheme, self.host, self.port, path)
+        if is_ipv6(host): 
+            host = "[{}]".format(host)
+
+        url = "{}://{}:{}{}".format(scheme, host, self.port, path)
 
         return url
 
+    def _get_session(self):
+
+        if not self.session:
+            self.session = requests.Session()
+            self.session.verify = False
+            self.session.headers.update({'Authorization': 'Splunk ' + self.token, 'X-Splunk-Request-Channel': self.channel})
+
+        return self.session
+
+    def close(self):
+        """
+        Close the http session to the Splunk server
+        """
+        if self.session:
+            self.session.close()
+            self.session = None
+
     def check_splunk_port(self):
 
         self.file_logger.debug("  Checking port connection to Splunk server {}, port: {}".format(self.host, self.port))
@@ -125,36 +180,179 @@ class SplunkExporter(object):
     
     def export_result(self, results_dict, source):
 
-        # stop errors if using https
-        if self.secure:
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        
-        url = self._url_generator(path='/services/collector/event')
+        return self.export_results([(source, results_dict)])
 
-        token = self.token    
-        headers = {'Authorization':'Splunk '+ token}
+    def _post(self, path, data, params=None):
+        """
+        Post results data to a HEC endpoint - returns the ack id of the post
+        (None if indexer acknowledgement not in use), or False on failure
+        """
+        url = self._url_generator(path=path)
+        headers = {}
 
-        # create event to send to Splunk
-        event_data = { 'host': self.hostname, 'source': source, 'event': results_dict }
+        data = data.encode('utf-8')
 
-        if time_synced():
-            event_data['time'] = results_dict['time']
-        
-        json_event_data = json.dumps(event_data)
+        if self.use_gzip:
+            data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+            headers['Content-Encoding'] = 'gzip'
 
-        # send results data
         try:
-            self.file_logger.debug('Sending http post with results data.')
-            response = requests.post(url, data=json_event_data, headers=headers, verify=False)
+            response = self._get_session().post(url, params=params, data=data, headers=headers, timeout=POST_TIMEOUT)
         except Exception as err:
             self.file_logger.error('http error occurred when sending results data: {}'.format(err))
+            self.close()
             return False
 
         response_code = response.status_code
+
+        if response_code != 200:
+            self.file_logger.error("Data send failed - http code: {} ({})".format(response_code, response.text[:200].strip()))
+            return False
+
+        if not self.use_ack:
+            return None
+
+        try:
+            ack_id = response.json()['ackId']
+        except (ValueError, KeyError, TypeError):
+            self.file_logger.warning("No indexer acknowledgement id returned by Splunk (is indexer acknowledgement enabled for the HEC token?)")
+            return None
+
+        return ack_id
+
+    def _wait_for_acks(self, ack_ids):
+        """
+        Poll the HEC ack endpoint until all ack ids supplied are acknowledged
+        (or the ack timeout is reached). Returns the set of ack ids not
+        acknowledged (empty if all acknowledged).
+        """
+        url = self._url_generator(path='/services/collector/ack')
+
+        pending = set(ack_ids)
+        deadline = time.monotonic() + self.ack_timeout
+        poll_interval = ACK_POLL_INTERVAL
+
+        while pending:
+
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                self.file_logger.error("Timed out waiting for Splunk indexer acknowledgement (ack ids: {})".format(sorted(pending)))
+                return pending
+
+            time.sleep(min(poll_interval, remaining))
+            poll_interval = min(poll_interval * 2, ACK_POLL_MAX)
+
+            try:
+                response = self._get_session().post(url, data=json.dumps({'acks': sorted(pending)}), timeout=POST_TIMEOUT)
+                acks = response.json()['acks']
+            except Exception as err:
+                self.file_logger.error('Error checking Splunk indexer acknowledgement: {}'.format(err))
+                continue
+
+            for ack_id in list(pending):
+                if acks.get(str(ack_id)):
+                    pending.discard(ack_id)
+
+        self.file_logger.debug("Indexer acknowledgement received for ack ids: {}".format(sorted(ack_ids)))
+
+        return pending
+
+    def export_results(self, results_list):
+        """
+        Send a batch of results to Splunk (as multiple HEC events in a single
+        http post, or one raw endpoint post per data source). If indexer
+        acknowledgement is enabled, wait until Splunk confirms the results
+        have been indexed. If only some of the raw endpoint posts succeed,
+        the indexes of the results not sent are left in unsent_indexes.
+
+        Args:
+            results_list (list): list of (source, results_dict) tuples
         
-        if response_code == 200:
+        Returns:
+            bool: True if all events sent OK
+        """
+
+        # stop errors if using https
+        if self.secure:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        self.unsent_indexes = None
+
+        ack_ids = []
+
+        if self.endpoint == 'raw':
+
+            # raw events have no metadata, so send each data source separately
+            # (data source -> list indexes of its results)
+            sources = {}
+            for index, (source, results_dict) in enumerate(results_list):
+                sources.setdefault(source, []).append(index)
+
+            # ack id -> list indexes of the results sent in its post
+            ack_indexes = {}
+            unsent_indexes = []
+
+            for source, indexes in sources.items():
+
+                # once a post has failed, don't try to send the rest
+                if unsent_indexes:
+                    unsent_indexes.extend(indexes)
+                    continue
+
+                events = [json.dumps(results_list[index][1]) for index in indexes]
+
+                self.file_logger.debug('Sending http post with results data to raw endpoint ({} events, source: {}).'.format(len(events), source))
+                params = {'host': self.hostname, 'source': source, 'sourcetype': '_json'}
+
+                ack_id = self._post('/services/collector/raw', "\n".join(events), params=params)
+
+                if ack_id is False:
+                    unsent_indexes.extend(indexes)
+                    continue
+
+                if ack_id is not None:
+                    ack_ids.append(ack_id)
+                    ack_indexes[ack_id] = indexes
+
+            if ack_ids:
+                for ack_id in self._wait_for_acks(ack_ids):
+                    unsent_indexes.extend(ack_indexes[ack_id])
+
+            if unsent_indexes:
+                self.unsent_indexes = sorted(unsent_indexes)
+                return False
+
             self.file_logger.debug("Data sent OK.")
             return True
+
         else:
-            self.file_logger.error("Data send failed - http code: {}".format(response_code))
-            return False
\ No newline at end of file
+            add_time = time_synced()
+
+            # create events to send to Splunk (HEC accepts concatenated json events)
+            events = []
+
+            for source, results_dict in results_list:
+
+                event_data = { 'host': self.hostname, 'source': source, 'event': results_dict }
+
+                if add_time:
+                    event_data['time'] = results_dict['time']
+
+                events.append(json.dumps(event_data))
+
+            self.file_logger.debug('Sending http post with results data ({} events).'.format(len(events)))
+
+            ack_id = self._post('/services/collector/event', "\n".join(events))
+
+            if ack_id is False:
+                return False
+
+            if ack_id is not None:
+                ack_ids.append(ack_id)
+
+        if ack_ids and self._wait_for_acks(ack_ids):
+            return False
+
+        self.file_logger.debug("Data sent OK.")
+        return True
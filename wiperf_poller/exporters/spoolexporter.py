@@ -7,22 +7,39 @@ connectivity is restored.
 
 Implementation details:
 
-1. Spooler files will be in jsonformat
-2. Spooled files are stored under folder /var/spool/wiperf
-3. One file will be created for each test performed (it will be date/timestamped)
-5. The following config parameters will be specified in config .ini:
+1. Spooled results are appended to a journal of segment files, one result per line
+   (in json format), with the data source of each result added to it ('data_source')
+2. Segment files are stored under folder /var/spool/wiperf (segment-<timestamp>.jsonl).
+   A new segment is started when the current segment reaches 'spool_segment_size' bytes
+3. A checkpoint file records the segment & file offset up to which spooled results have
+   been successfully exported. Spooled results are replayed in batches, with the
+   checkpoint advanced after each batch is sent. Fully replayed segments are removed.
+   When results are exported to more than one reporting platform, the first platform
+   uses the spool folder above & each additional platform has its own spool (in a
+   sub-folder named after its exporter type, e.g. /var/spool/wiperf/splunk)
+4. The following config parameters will be specified in config .ini:
     a. Spooling enabled/disabled
-    b. Retention period for files, in minutes (default = 60)
-    c. Hidden parameter : 'spool_dir_root' which defaults to /var/spool/wiperf when not supplied
+    b. Retention period for results, in minutes (default = 60) - whole segments are
+       removed once their last result is older than this
+    c. Max size of the spool (KB) - oldest segments are removed if this is exceeded
+    d. Hidden parameter : 'spool_dir_root' which defaults to /var/spool/wiperf when not supplied
+5. Spool files from earlier versions (one json file per result) are migrated in to
+   the journal when spooled results are replayed
 """
 
 import json
 import os
 import shutil
-import sys
 from datetime import datetime, timedelta
 from wiperf_poller.helpers.timefunc import get_timestamp, time_synced
 
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+CHECKPOINT_FILE = 'checkpoint'
+
+# timestamp used in name of segment holding migrated (pre-journal) spool files
+LEGACY_SEGMENT_TIMESTAMP = '0000-00-00-000000000'
+
 class SpoolExporter(object):
     """
     A class to spool results data in to a local folder during loss of
@@ -30,16 +47,23 @@ class SpoolExporter(object):
     connectivity is restored.
     """
 
-    def __init__(self, config_vars, file_logger):
+    def __init__(self, config_vars, file_logger, spool_dir=None):
 
         self.file_logger = file_logger
         self.spool_enabled = config_vars['results_spool_enabled']
-        self.spool_dir_root = config_vars['results_spool_dir']
+        # (each additional reporting platform has its own spool dir)
+        self.spool_dir_root = spool_dir if spool_dir else config_vars['results_spool_dir']
         self.spool_max_age = int(config_vars['results_spool_max_age']) # time in minutes
+        self.spool_max_size = int(config_vars['results_spool_max_size']) * 1024 # size in bytes
+        self.segment_size = int(config_vars['results_spool_segment_size']) * 1024 # size in bytes
         self.config_vars = config_vars
 
         self.spool_checks_completed = False
-    
+
+        # segment currently being appended to
+        self.segment_name = ''
+        self.segment_file = None
+
     def check_spool_dir_exists(self):
         """
         Check if root cache dir exists (by default /var/spool/wiperf)
@@ -55,102 +79,355 @@ class SpoolExporter(object):
         Create spool root dir
         """
 
-        try: 
-            os.makedirs(self.spool_dir_root, exist_ok = True) 
+        try:
+            os.makedirs(self.spool_dir_root, exist_ok = True)
             self.file_logger.debug("Created spooling root dir: {}".format(self.spool_dir_root))
-        except OSError as e: 
-            self.file_logger.error("Cannot create spooling root dir: {} ({})".format(self.spool_dir_root, e.strerror)) 
+        except OSError as e:
+            self.file_logger.error("Cannot create spooling root dir: {} ({})".format(self.spool_dir_root, e.strerror))
             return False
         return True
-    
-    def list_spool_files(self):
 
-        # list files in spool dir (sorted by name a->z)
-        spool_files = os.listdir(self.spool_dir_root)
+    def list_spool_files(self):
+        """
+        List journal segment files in spool dir (oldest first)
+        """
+        spool_files = [filename for filename in os.listdir(self.spool_dir_root)
+            if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX)]
         spool_files.sort()
 
         return spool_files
 
-    
+    def _list_legacy_files(self):
+        """
+        List spool files created by earlier versions (one json file per result)
+        """
+        legacy_files = [filename for filename in os.listdir(self.spool_dir_root) if filename.endswith('.json')]
+        legacy_files.sort()
+
+        return legacy_files
+
+    def _full_name(self, filename):
+        return "{}/{}".format(self.spool_dir_root, filename)
+
+    def _read_checkpoint(self):
+        """
+        Read the checkpoint file - returns (segment name, offset)
+        """
+        try:
+            with open(self._full_name(CHECKPOINT_FILE), 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            return (checkpoint['segment'], int(checkpoint['offset']))
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return ('', 0)
+
+    def _write_checkpoint(self, segment_name, offset):
+        """
+        Atomically update the checkpoint file
+        """
+        checkpoint_name = self._full_name(CHECKPOINT_FILE)
+        tmp_name = checkpoint_name + ".tmp"
+
+        try:
+            with open(tmp_name, 'w') as checkpoint_file:
+                json.dump({'segment': segment_name, 'offset': offset}, checkpoint_file)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+
+            os.replace(tmp_name, checkpoint_name)
+        except (IOError, OSError) as err:
+            self.file_logger.error("Unable to update spool checkpoint: {}".format(err))
+            return False
+
+        return True
+
+    def _remove_segment(self, segment_name):
+
+        if segment_name == self.segment_name:
+            self.close()
+
+        try:
+            os.remove(self._full_name(segment_name))
+        except OSError as err:
+            self.file_logger.error("Unable to remove spool segment: {} ({})".format(segment_name, err))
+            return False
+
+        return True
+
     def prune_old_files(self):
         """
-        Remove files older than max_age policy
+        Remove segments older than max_age policy & oldest segments if the
+        spool exceeds its max size
         """
-     
+
         self.file_logger.info("Checking for files to prune.")
 
         if not self.check_spool_dir_exists():
             self.file_logger.info("Spool dir does not exist yet.")
             return True
-        
+
         file_list = self.list_spool_files()
 
         if not file_list:
             self.file_logger.info("No files to prune.")
             return True
 
-        # determine cut-off time for files as per max-age policy
+        # determine cut-off time for segments as per max-age policy
         age_limit = datetime.now() - timedelta(minutes=self.spool_max_age)
-        
-        prune_count = 0
-        for filename in file_list:
 
-            full_file_name = "{}/{}".format(self.spool_dir_root, filename)
+        segment_sizes = [os.path.getsize(self._full_name(filename)) for filename in file_list]
+        spool_size = sum(segment_sizes)
+
+        prune_count = 0
+        for filename, segment_size in zip(file_list, segment_sizes):
 
-            if os.path.getctime(full_file_name) < age_limit.timestamp():
-                os.remove(full_file_name)
-                prune_count += 1
+            # (segment mtime is the time the last result was appended)
+            if os.path.getmtime(self._full_name(filename)) < age_limit.timestamp():
+                self.file_logger.info("Spool segment exceeds max age, removing: {}".format(filename))
+            elif self.spool_max_size and (spool_size > self.spool_max_size):
+                self.file_logger.warning("Spool exceeds max size ({} bytes), removing: {}".format(spool_size, filename))
             else:
-                # As soon as we hit a file within policy, exit
+                # As soon as we hit a segment within policy, exit
                 break
-        
+
+            self._remove_segment(filename)
+            spool_size -= segment_size
+            prune_count += 1
+
         self.file_logger.info("Files pruned: {}".format(prune_count))
-        
+
         return True
 
+    def _append_record(self, dict_data):
+        """
+        Append a result to the current journal segment (starting a new segment
+        if required)
+        """
+        try:
+            if self.segment_file and (self.segment_file.tell() >= self.segment_size):
+                self.close()
+
+            if not self.segment_file:
+                segment_list = self.list_spool_files()
+
+                if segment_list and (os.path.getsize(self._full_name(segment_list[-1])) < self.segment_size):
+                    # carry on appending to the latest segment
+                    self.segment_name = segment_list[-1]
+                else:
+                    # segment name format: segment-YYYY-MM-DD-HHMMSSmmm.jsonl
+                    file_timestamp = datetime.today().strftime("%Y-%m-%d-%H%M%S%f")[:-3]
+                    self.segment_name = "{}{}{}".format(SEGMENT_PREFIX, file_timestamp, SEGMENT_SUFFIX)
+
+                self.segment_file = open(self._full_name(self.segment_name), 'a')
+
+            self.segment_file.write(json.dumps(dict_data) + "\n")
+            self.segment_file.flush()
+
+        except (IOError, OSError) as err:
+            self.file_logger.error("JSON I/O update error: {}".format(err))
+            return False
 
-    def _dump_json_data(self, data_file, dict_data):
+        return True
+
+    def close(self):
+        """
+        Sync & close the current journal segment
+        """
+        if self.segment_file:
+            try:
+                self.segment_file.flush()
+                os.fsync(self.segment_file.fileno())
+            except (IOError, OSError) as err:
+                self.file_logger.error("Spool segment sync error: {}".format(err))
+
+            self.segment_file.close()
+
+        self.segment_file = None
+        self.segment_name = ''
+
+    def _migrate_legacy_files(self):
         """
-        Dump the results data in timestamped json file
+        Move any spool files from earlier versions in to the journal (in to a
+        segment that sorts before all other segments, as they will contain
+        the oldest results)
         """
-        # write out the json data
+        legacy_files = self._list_legacy_files()
+
+        if not legacy_files:
+            return True
+
+        self.file_logger.info("Migrating {} spool file(s) in to spool journal.".format(len(legacy_files)))
+
+        segment_name = "{}{}{}".format(SEGMENT_PREFIX, LEGACY_SEGMENT_TIMESTAMP, SEGMENT_SUFFIX)
+
         try:
-            with open (data_file, 'w') as json_file:
-                json.dump( [ dict_data ], json_file, indent=2)
-        except IOError as err:
-                self.file_logger.error("JSON I/O update error: {}".format(err))
+            with open(self._full_name(segment_name), 'a') as segment_file:
+
+                for filename in legacy_files:
+
+                    full_file_name = self._full_name(filename)
+
+                    try:
+                        with open(full_file_name, "r") as json_file:
+                            results_list = json.load(json_file)
+                    except ValueError as err:
+                        self.file_logger.error("JSON file read error: {} ({})".format(full_file_name, err))
+                        results_list = []
+
+                    # (each file may contain more than one result)
+                    for results_dict in results_list:
+                        segment_file.write(json.dumps(results_dict) + "\n")
+
+                    segment_file.flush()
+                    os.fsync(segment_file.fileno())
+                    os.remove(full_file_name)
+
+        except (IOError, OSError) as err:
+            self.file_logger.error("JSON I/O file migration error: {}".format(err))
+            return False
+
+        return True
+
+    def _read_segment(self, segment_name, offset):
+        """
+        Generator to read results from a segment, starting at the offset supplied
+
+        Yields:
+            (offset of next record, results dict)
+        """
+        with open(self._full_name(segment_name), 'r') as segment_file:
+            segment_file.seek(offset)
+
+            while True:
+                line = segment_file.readline()
+
+                # stop at end of file, or at a partially written record
+                if not line.endswith("\n"):
+                    return
+
+                next_offset = segment_file.tell()
+
+                try:
+                    results_dict = json.loads(line)
+                except ValueError:
+                    self.file_logger.error("Skipping corrupt spooled result in: {}".format(segment_name))
+                    continue
+
+                yield (next_offset, results_dict)
+
+    def _send_batch(self, config_vars, exporter_obj, batch, segment_name, batch_offset):
+        """
+        Send a batch of spooled results & move the checkpoint past the batch.
+        If only part of the batch was sent, the results not sent are spooled
+        again (to be sent next poll cycle), so that the checkpoint can still
+        be moved past the batch without re-sending the results already sent.
+
+        Returns:
+            bool: True if the whole batch was sent
+        """
+        if exporter_obj.send_results_batch(config_vars, batch):
+            self._write_checkpoint(segment_name, batch_offset)
+            return True
+
+        unsent_results = exporter_obj.unsent_results
+
+        if len(unsent_results) < len(batch):
+
+            self.file_logger.info("Spooling {} result(s) again as only part of batch sent.".format(len(unsent_results)))
+
+            for data_file, results_dict in unsent_results:
+                if not self.spool_results(config_vars, data_file, results_dict):
+                    # resend the whole batch next poll cycle
+                    return False
+
+            self._write_checkpoint(segment_name, batch_offset)
+
+        return False
+
+    def replay_results(self, config_vars, exporter_obj):
+        """
+        Send spooled results to the reporting platform in batches, advancing
+        the checkpoint as each batch is sent
+
+        Returns:
+            bool: True if all spooled results were sent
+        """
+        if not self.check_spool_dir_exists():
+            return True
+
+        self._migrate_legacy_files()
+
+        # make sure we read everything spooled so far
+        self.close()
+
+        batch_size = max(int(config_vars['results_batch_size']), 1)
+
+        checkpoint_segment, checkpoint_offset = self._read_checkpoint()
+
+        sent_count = 0
+
+        for segment_name in self.list_spool_files():
+
+            # skip on to the position of the checkpoint (if it is in this segment)
+            offset = checkpoint_offset if segment_name == checkpoint_segment else 0
+
+            batch = []
+            batch_offset = offset
+
+            for next_offset, results_dict in self._read_segment(segment_name, offset):
+
+                # pull out the data source
+                data_file = results_dict.pop('data_source', '')
+                batch.append((data_file, results_dict))
+                batch_offset = next_offset
+
+                if len(batch) < batch_size:
+                    continue
+
+                if not self._send_batch(config_vars, exporter_obj, batch, segment_name, batch_offset):
+                    self.file_logger.error("Unable to send spooled results, will retry next poll cycle.")
+                    return False
+
+                sent_count += len(batch)
+                batch = []
+
+            if batch:
+                if not self._send_batch(config_vars, exporter_obj, batch, segment_name, batch_offset):
+                    self.file_logger.error("Unable to send spooled results, will retry next poll cycle.")
+                    return False
+
+                sent_count += len(batch)
+
+            # segment fully sent - remove it before clearing the checkpoint, so
+            # that the segment is not sent again if we are stopped in between
+            # (if it cannot be removed, checkpoint the end of the segment & try
+            # again next poll cycle)
+            if not self._remove_segment(segment_name):
+                self._write_checkpoint(segment_name, batch_offset)
                 return False
-        
+
+            self._write_checkpoint('', 0)
+
+        if sent_count:
+            self.file_logger.info("Spooled results sent OK - {} result(s)".format(sent_count))
+
         return True
 
 
-    def spool_results(self, config_vars, data_file, dict_data, watchdog_obj, lockf_obj):
+    def spool_results(self, config_vars, data_file, dict_data):
         """
-        Dump the results data in to a timestamped file
+        Append the results data to the spool journal
         """
 
         #self.file_logger.debug("Result={}".format(dict_data))
-        #self.file_logger.debug("Exporter={}".format(config_vars['exporter_type']))
-
-        # if we get here and the exporter is not set to spooler, must have had
-        # issue sending result to reporting server, try to spool it
-        if config_vars['exporter_type'] != 'spooler':
-        
-            if self.spool_enabled == 'yes':
-                self.file_logger.info("Spooling result as looks like an issue sending to reporting server.")
-            else:
-                self.file_logger.info("Unable to spool result as spooling disabled.")
-                return False
 
-        elif not self.spool_enabled == 'yes':
-            # to get here, exporter must have been changed to spooler due to comms issue at start 
-            # of poller checks. If spooling not enabled, increment watchdog, remove lock file & exit
-            # as no point in continuing as no way of saving results.
-            self.file_logger.error("Result spooling not enabled - Exiting.")
-            watchdog_obj.inc_watchdog_count()
-            lockf_obj.delete_lock_file()
-            sys.exit()
-        
+        # if we get here, the reporting platform could not be reached or there
+        # was an issue sending the result to it, try to spool it
+        if self.spool_enabled == 'yes':
+            self.file_logger.info("Spooling result as looks like an issue sending to reporting server.")
+        else:
+            self.file_logger.info("Unable to spool result as spooling disabled.")
+            return False
+
         # Do not allow spooling if probe is not time sync'ed - historical
         # data timestamps will be meaningless
         if not time_synced():
@@ -171,20 +448,12 @@ class SpoolExporter(object):
                 if not self._create_spool_dir():
                     self.file_logger.error("Unable to spool results data as spool root dir cannot be created: {}".format(self.spool_dir_root))
                     return False
-            
+
             self.spool_checks_completed = True
-        
+
         # add data source to results
+        dict_data = dict(dict_data)
         dict_data['data_source'] = data_file
-        
-        # derive spool filename in format YYYY-MM-DD-HHMMSSmmm-<data source>.json
-        file_timestamp = datetime.today().strftime("%Y-%m-%d-%H%M%S.%f")[:-3]
-        data_file = "{}/{}-{}.json".format(self.spool_dir_root, file_timestamp, data_file)
-
-        # dump data in to json format file
-        return self._dump_json_data(data_file, dict_data)
-
-
-
-
 
+        # append data to journal
+        return self._append_record(dict_data)
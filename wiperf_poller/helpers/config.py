@@ -8,6 +8,15 @@ import configparser
 import os
 import sys
 
+def get_config_mtime(config_file):
+    '''
+    Return the last modification time of the config file (0 if not readable)
+    '''
+    try:
+        return os.stat(config_file).st_mtime
+    except OSError:
+        return 0
+
 def read_local_config(config_file, file_logger):
     '''
     Read in and return all config file variables. 
@@ -40,12 +49,20 @@ def read_local_config(config_file, file_logger):
     if os.path.exists("/etc/wlanpi-state"):
         config_vars['platform'] = 'wlanpi'
     
-    # data exporter type for results
-    config_vars['exporter_type'] = gen_sect.get('exporter_type', 'splunk')
-    config_vars['time_format'] = gen_sect.get('exporter_type', 'splunk')
+    # data exporter type for results (comma separated list to send results to
+    # more than one platform - the first is used for mgt connectivity checks)
+    config_vars['exporter_types'] = [exporter_type.strip() for exporter_type in gen_sect.get('exporter_type', 'splunk').split(',') if exporter_type.strip()]
+    config_vars['exporter_type'] = config_vars['exporter_types'][0] if config_vars['exporter_types'] else ''
+    config_vars['time_format'] = config_vars['exporter_type']
 
     # report poller results after each cycle?
     config_vars['poller_reporting_enabled'] = gen_sect.get('poller_reporting_enabled', 'yes')
+    # report timings of each phase of the poll cycle?
+    config_vars['poll_timing_enabled'] = gen_sect.get('poll_timing_enabled', 'yes')
+    config_vars['poll_timing_data_file'] = gen_sect.get('poll_timing_data_file', 'wiperf-poll-timing')
+    # dump cProfile stats of each poll cycle to a file? (for troubleshooting only)
+    config_vars['profile_enabled'] = gen_sect.get('profile_enabled', 'no')
+    config_vars['profile_file'] = gen_sect.get('profile_file', '/var/log/wiperf_poll_cycle.prof')
 
     # Results spooling enabled?
     config_vars['results_spool_enabled'] = gen_sect.get('results_spool_enabled', 'yes')
@@ -53,11 +70,24 @@ def read_local_config(config_file, file_logger):
     config_vars['results_spool_max_age'] = gen_sect.get('results_spool_max_age', 30)
     # Dir for spool files
     config_vars['results_spool_dir'] = gen_sect.get('results_spool_dir', '/var/spool/wiperf')
+    # Max size of spooled results data (in KB)
+    config_vars['results_spool_max_size'] = gen_sect.get('results_spool_max_size', 10240)
+    # Size of each spool journal segment (in KB)
+    config_vars['results_spool_segment_size'] = gen_sect.get('results_spool_segment_size', 256)
+
+    # Results batching enabled? (results queued & sent in batches at end of poll cycle)
+    config_vars['results_batching'] = gen_sect.get('results_batching', 'yes')
+    # Max number of results sent in each batch
+    config_vars['results_batch_size'] = gen_sect.get('results_batch_size', 100)
 
     # local results caching enabled/disabled
     config_vars['cache_enabled'] = gen_sect.get('cache_enabled', 'no')
-    # format of cache output data (csv/json)
+    # format of cache output data (csv/json/jsonl)
     config_vars['cache_data_format'] = gen_sect.get('cache_data_format', 'csv')
+    # jsonl format: number of results written between fsyncs (0 = end of poll cycle only)
+    config_vars['cache_fsync_interval'] = gen_sect.get('cache_fsync_interval', 0)
+    # jsonl format: create index file for each day's data (yes/no)
+    config_vars['cache_jsonl_index'] = gen_sect.get('cache_jsonl_index', 'no')
     # root directory where cache data dumped
     config_vars['cache_root'] = gen_sect.get('cache_root', "/var/cache/wiperf")
     # retention period of cache files (in days)
@@ -78,6 +108,14 @@ def read_local_config(config_file, file_logger):
     config_vars['splunk_port'] = gen_sect.get('splunk_port', '8088')
     # Splunk HEC token
     config_vars['splunk_token'] = gen_sect.get('splunk_token')
+    # HEC endpoint results are sent to (event/raw)
+    config_vars['splunk_endpoint'] = gen_sect.get('splunk_endpoint', 'event')
+    # gzip compress results sent to Splunk?
+    config_vars['splunk_gzip'] = gen_sect.get('splunk_gzip', 'yes')
+    # wait for indexer acknowledgement of results sent? (must be enabled for the HEC token)
+    config_vars['splunk_ack'] = gen_sect.get('splunk_ack', 'no')
+    # max time to wait for indexer acknowledgement (secs)
+    config_vars['splunk_ack_timeout'] = gen_sect.get('splunk_ack_timeout', 30)
     ##############################
 
     ####### Influx1 config ########
@@ -115,6 +153,10 @@ def read_local_config(config_file, file_logger):
     # test cycle timing parameters
     config_vars['test_interval'] = gen_sect.get('test_interval', '5')
     config_vars['test_offset'] = gen_sect.get('test_offset', '0')
+    # max number of lightweight tests (ping, dns, http) run concurrently (1 = run sequentially)
+    config_vars['test_concurrency'] = gen_sect.get('test_concurrency', '3')
+    # max age (secs) of cached clock sync status before it is re-checked
+    config_vars['time_sync_ttl'] = gen_sect.get('time_sync_ttl', '60')
 
     # connectivity DNS lookup - site used for initial DNS lookup when assessing if DNS working OK
     config_vars['connectivity_lookup'] = gen_sect.get('connectivity_lookup', 'google.com')
@@ -153,6 +195,19 @@ def read_local_config(config_file, file_logger):
     # Get network test config params
     network_sect = config['Network_Test']
     config_vars['network_data_file'] = network_sect.get('networkd', 'wiperf-network')
+    # sample wireless adapter stats between poll cycles? (wireless probe mode only)
+    config_vars['rf_sampler_enabled'] = network_sect.get('rf_sampler_enabled', 'no')
+    # secs between RF samples
+    config_vars['rf_sample_interval'] = network_sect.get('rf_sample_interval', 1)
+    # max number of RF samples held between poll cycles
+    config_vars['rf_sample_buffer_size'] = network_sect.get('rf_sample_buffer_size', 3600)
+    config_vars['rf_data_file'] = network_sect.get('rf_data_file', 'wiperf-rf')
+    config_vars['rf_roam_data_file'] = network_sect.get('rf_roam_data_file', 'wiperf-rf-roam')
+    # report ethernet link stats & counter changes each poll cycle? (always reported in ethernet probe mode)
+    config_vars['eth_stats_enabled'] = network_sect.get('eth_stats_enabled', 'no')
+    config_vars['eth_data_file'] = network_sect.get('eth_data_file', 'wiperf-ethernet')
+    # file used to save the ethernet counters between poll cycles
+    config_vars['eth_stats_state_file'] = network_sect.get('eth_stats_state_file', '/var/cache/wiperf/eth_stats.json')
 
     # Get Speedtest config params
     speed_sect = config['Speedtest']
@@ -161,6 +216,20 @@ def read_local_config(config_file, file_logger):
     config_vars['server_id'] = speed_sect.get('server_id', '')
     config_vars['librespeed_args'] = speed_sect.get('librespeed_args', '')
     config_vars['speedtest_data_file'] = speed_sect.get('speedtest_data_file', 'wiperf-speedtest')
+    # max data used by each 'stream' provider speedtest (download + upload, MB)
+    config_vars['stream_byte_budget_mb'] = speed_sect.get('stream_byte_budget_mb', 20)
+    # max duration of each direction of the 'stream' provider speedtest (secs)
+    config_vars['stream_max_duration'] = speed_sect.get('stream_max_duration', 10)
+    # number of concurrent connections used by the 'stream' provider speedtest
+    config_vars['stream_threads'] = speed_sect.get('stream_threads', 4)
+    # base url of speedtest server for the 'stream' provider (e.g. http://10.1.1.1:8080/speedtest), blank = select Ookla server
+    config_vars['stream_server_url'] = speed_sect.get('stream_server_url', '')
+    # file used to cache the Ookla servers ranked by latency (ookla & stream providers)
+    config_vars['server_cache_file'] = speed_sect.get('server_cache_file', '/var/cache/wiperf/speedtest_servers.json')
+    # secs before the server cache is refreshed
+    config_vars['server_cache_ttl'] = speed_sect.get('server_cache_ttl', 86400)
+    # number of top cached servers re-probed to select the server for each test
+    config_vars['server_cache_probe_count'] = speed_sect.get('server_cache_probe_count', 3)
     config_vars['http_proxy'] = speed_sect.get('http_proxy', '')
     config_vars['https_proxy'] = speed_sect.get('https_proxy', '')
     config_vars['no_proxy'] = speed_sect.get('no_proxy', '')
@@ -195,6 +264,10 @@ def read_local_config(config_file, file_logger):
     config_vars['iperf3_tcp_server_hostname'] = iperft_sect.get('server_hostname', '')
     config_vars['iperf3_tcp_port'] = iperft_sect.get('port', '')
     config_vars['iperf3_tcp_duration'] = iperft_sect.get('duration', '')
+    # number of parallel streams (-P)
+    config_vars['iperf3_tcp_streams'] = iperft_sect.get('streams', '1')
+    # reverse mode (-R: server sends, probe receives)
+    config_vars['iperf3_tcp_reverse'] = iperft_sect.get('reverse', 'no')
 
     # Get iperf3 udp test params
     iperfu_sect = config['Iperf3_udp_test']
@@ -204,6 +277,28 @@ def read_local_config(config_file, file_logger):
     config_vars['iperf3_udp_port'] = iperfu_sect.get('port', '')
     config_vars['iperf3_udp_duration'] = iperfu_sect.get('duration', '')
     config_vars['iperf3_udp_bandwidth'] = iperfu_sect.get('bandwidth', '')
+    # reverse mode (-R: server sends, probe receives)
+    config_vars['iperf3_udp_reverse'] = iperfu_sect.get('reverse', 'no')
+
+    # Get iperf3 test matrix params (section is optional)
+    iperfm_sect = config['Iperf3_matrix_test'] if config.has_section('Iperf3_matrix_test') else {}
+    config_vars['iperf3_matrix_enabled'] = iperfm_sect.get('enabled', 'no')
+    config_vars['iperf3_matrix_tcp_data_file'] = iperfm_sect.get('iperf3_matrix_tcp_data_file', 'wiperf-iperf3-matrix-tcp')
+    config_vars['iperf3_matrix_udp_data_file'] = iperfm_sect.get('iperf3_matrix_udp_data_file', 'wiperf-iperf3-matrix-udp')
+    # comma separated lists of the matrix dimensions (servers may be host or host:port)
+    config_vars['iperf3_matrix_servers'] = iperfm_sect.get('servers', '')
+    config_vars['iperf3_matrix_protocols'] = iperfm_sect.get('protocols', 'tcp,udp')
+    config_vars['iperf3_matrix_directions'] = iperfm_sect.get('directions', 'up,down')
+    # bandwidths in bits/sec (tcp: 0 = unlimited)
+    config_vars['iperf3_matrix_tcp_bandwidths'] = iperfm_sect.get('tcp_bandwidths', '0')
+    config_vars['iperf3_matrix_udp_bandwidths'] = iperfm_sect.get('udp_bandwidths', '10000000')
+    config_vars['iperf3_matrix_port'] = iperfm_sect.get('port', '5201')
+    config_vars['iperf3_matrix_duration'] = iperfm_sect.get('duration', '10')
+    config_vars['iperf3_matrix_streams'] = iperfm_sect.get('streams', '1')
+    # max time (secs) spent running matrix tests each poll cycle
+    config_vars['iperf3_matrix_time_budget'] = iperfm_sect.get('time_budget', '60')
+    # file used to track position in the matrix across poll cycles
+    config_vars['iperf3_matrix_state_file'] = iperfm_sect.get('state_file', '/tmp/wiperf_iperf3_matrix.json')
 
     # Get DNS test params
     dns_sect = config['DNS_test']
@@ -219,6 +314,18 @@ def read_local_config(config_file, file_logger):
         # format: config_vars["dns_target1"]
         config_vars[target_name] = dns_sect.get(target_name, '')
 
+    # DNS servers to query (comma separated, default: first nameserver in /etc/resolv.conf)
+    config_vars['dns_servers'] = dns_sect.get('dns_servers', '')
+    # query types (comma separated: A, AAAA)
+    config_vars['dns_query_types'] = dns_sect.get('dns_query_types', 'A')
+    # query timeout (secs)
+    config_vars['dns_timeout'] = dns_sect.get('dns_timeout', 2)
+    # number of times each query is repeated & result reported (best/median)
+    config_vars['dns_repeat'] = dns_sect.get('dns_repeat', 1)
+    config_vars['dns_repeat_stat'] = dns_sect.get('dns_repeat_stat', 'best')
+    # check if target already cached by DNS server (yes/no)
+    config_vars['dns_cache_check'] = dns_sect.get('dns_cache_check', 'yes')
+
     # Get http test params
     http_sect = config['HTTP_test']
     config_vars['http_test_enabled'] = http_sect.get('enabled', 'no')
@@ -233,17 +340,40 @@ def read_local_config(config_file, file_logger):
         # format: config_vars["http_target1"]
         config_vars[target_name] = http_sect.get(target_name, '')
 
+    # http get timeout (secs)
+    config_vars['http_timeout'] = http_sect.get('http_timeout', 5)
+    # max number of http targets tested at the same time
+    config_vars['http_concurrency'] = http_sect.get('http_concurrency', 3)
+    # cold (new connection for timed get) or warm (re-use existing connection)
+    config_vars['http_mode'] = http_sect.get('http_mode', 'cold')
+
     # Get DHCP test params
     dhcp_sect = config['DHCP_test']
     config_vars['dhcp_test_enabled'] = dhcp_sect.get('enabled', 'no')
     config_vars['dhcp_test_mode'] = dhcp_sect.get('mode', 'passive')
     config_vars['dhcp_data_file'] = dhcp_sect.get('dhcp_data_file', 'wiperf-dhcp')
+    # DHCP test engine: dhclient (release & renew using dhclient) or packet (DHCP exchange run by wiperf)
+    config_vars['dhcp_engine'] = dhcp_sect.get('dhcp_engine', 'dhclient')
+    # DHCP exchange run by the packet engine: inform, renew or full (discover/offer/request/ack)
+    config_vars['dhcp_packet_mode'] = dhcp_sect.get('dhcp_packet_mode', 'renew')
+    # secs to wait for each DHCP reply (packet engine)
+    config_vars['dhcp_timeout'] = dhcp_sect.get('dhcp_timeout', 3)
 
     # Get SMB test config params
     smb_sect = config['SMB_test']
     config_vars['smb_enabled'] = smb_sect.get('enabled', 'no')
     config_vars['smb_data_file'] = smb_sect.get('smb_data_file', 'wiperf-smb')
     config_vars['smb_targets_count'] = smb_sect.get('smb_targets_count', 5)
+    # SMB test engine: auto (smbprotocol module if installed, otherwise mount & copy), smbprotocol or mount
+    config_vars['smb_engine'] = smb_sect.get('smb_engine', 'auto')
+    # SMB test direction (smbprotocol engine only): read, write or both
+    config_vars['smb_direction'] = smb_sect.get('smb_direction', 'read')
+    # size of each file written by the SMB write test (MB)
+    config_vars['smb_write_size_mb'] = smb_sect.get('smb_write_size_mb', 10)
+    # number of files written concurrently by the SMB write test
+    config_vars['smb_write_files'] = smb_sect.get('smb_write_files', 1)
+    # SMB server port (smbprotocol engine only)
+    config_vars['smb_port'] = smb_sect.get('smb_port', 445)
 
     config_vars['smb_global_username'] = smb_sect.get('smb_global_username', ' ')
     config_vars['smb_global_password'] = smb_sect.get('smb_global_password', ' ')
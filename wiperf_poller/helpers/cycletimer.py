@@ -0,0 +1,190 @@
+"""
+Cycle timer class - records how long each phase of a poll cycle takes (plus
+the time spent running OS commands & exporting results), so that the cause
+of long poll cycles can be tracked down. The timings are reported to the mgt
+platform in a 'wiperf-poll-timing' record at the end of each poll cycle.
+"""
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from wiperf_poller.helpers.timefunc import get_timestamp
+
+class CycleTimer(object):
+
+    '''
+    A class to time the phases of a poll cycle
+    '''
+
+    def __init__(self, config_vars, file_logger):
+
+        self.file_logger = file_logger
+        self.config_vars = config_vars
+        self.start_time = time.monotonic()
+
+        # phase timings (secs): {phase name: time}
+        self.phases = {}
+        self.current_phase = ''
+        self.phase_start = 0
+
+        # OS commands run: {command name: [count, time]}
+        self.subprocess_calls = {}
+
+        # results exported to the reporting platform
+        self.export_count = 0
+        self.export_time = 0.0
+
+        self.orig_subprocess_popen = None
+
+        # phases & counters may be updated by tests running concurrently
+        self.lock = threading.Lock()
+
+    def _add_phase_time(self, name, phase_time):
+
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + phase_time
+
+    def start_phase(self, name):
+        '''
+        End the current poll cycle phase (if any) & start timing a new phase
+        '''
+        self.end_phase()
+
+        self.current_phase = name
+        self.phase_start = time.monotonic()
+
+    def end_phase(self):
+        '''
+        End the current poll cycle phase
+        '''
+        if self.current_phase:
+            self._add_phase_time(self.current_phase, time.monotonic() - self.phase_start)
+
+        self.current_phase = ''
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Context manager to time an operation (e.g. a test) which may run
+        alongside other operations
+        '''
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._add_phase_time(name, time.monotonic() - start)
+
+    def add_export(self, export_time, count=1):
+        '''
+        Record the time taken to export results to the reporting platform
+        '''
+        with self.lock:
+            self.export_count += count
+            self.export_time += export_time
+
+    def _add_subprocess_call(self, cmd, call_time):
+
+        # name the call by the command run (without args)
+        if isinstance(cmd, (list, tuple)):
+            cmd = cmd[0] if cmd else ''
+        cmd_name = str(cmd).split(' ')[0]
+
+        with self.lock:
+            calls = self.subprocess_calls.setdefault(cmd_name, [0, 0.0])
+            calls[0] += 1
+            calls[1] += call_time
+
+    def install_subprocess_hook(self):
+        '''
+        Time all OS commands run during the poll cycle. subprocess.Popen is
+        wrapped (it is also used by subprocess.run(), check_output() etc.),
+        so processes started directly with Popen are timed too - from when
+        they are started until wait() or poll() sees that they have exited.
+        '''
+        if self.orig_subprocess_popen:
+            return
+
+        self.orig_subprocess_popen = subprocess.Popen
+        cycle_timer = self
+
+        class TimedPopen(self.orig_subprocess_popen):
+
+            def __init__(self, *args, **kwargs):
+                self.timer_start = time.monotonic()
+                self.timer_recorded = False
+                super().__init__(*args, **kwargs)
+
+            def _record_time(self):
+
+                if self.returncode is not None and not self.timer_recorded:
+                    self.timer_recorded = True
+                    cycle_timer._add_subprocess_call(self.args, time.monotonic() - self.timer_start)
+
+            def wait(self, *args, **kwargs):
+                try:
+                    return super().wait(*args, **kwargs)
+                finally:
+                    self._record_time()
+
+            def poll(self):
+                try:
+                    return super().poll()
+                finally:
+                    self._record_time()
+
+        subprocess.Popen = TimedPopen
+
+    def remove_subprocess_hook(self):
+        '''
+        Stop timing OS commands
+        '''
+        if self.orig_subprocess_popen:
+            subprocess.Popen = self.orig_subprocess_popen
+            self.orig_subprocess_popen = None
+
+    def get_timings(self):
+        '''
+        Return a dict of the timings recorded so far (all times in mS)
+        '''
+        self.end_phase()
+
+        timings = {
+            'time': get_timestamp(self.config_vars),
+            'run_time_ms': int((time.monotonic() - self.start_time) * 1000),
+        }
+
+        with self.lock:
+            for name, phase_time in self.phases.items():
+                timings['{}_ms'.format(name)] = int(phase_time * 1000)
+
+            timings['subprocess_count'] = sum([calls[0] for calls in self.subprocess_calls.values()])
+            timings['subprocess_ms'] = int(sum([calls[1] for calls in self.subprocess_calls.values()]) * 1000)
+            timings['export_count'] = self.export_count
+            timings['export_ms'] = int(self.export_time * 1000)
+
+        return timings
+
+    def dump(self, exporter_obj):
+        '''
+        Send the poll cycle timings to the mgt platform
+        '''
+        timings = self.get_timings()
+
+        self.file_logger.info("########## poll timing ##########")
+        self.file_logger.info("Poll cycle timings (mS): {}".format(timings))
+
+        for cmd_name, (count, call_time) in sorted(self.subprocess_calls.items(), key=lambda item: item[1][1], reverse=True):
+            self.file_logger.debug("  OS command: {} (calls: {}, total: {}mS)".format(cmd_name, count, int(call_time * 1000)))
+
+        column_headers = list(timings.keys())
+
+        # dump the results
+        data_file = self.config_vars['poll_timing_data_file']
+        test_name = "wiperf-poll-timing"
+
+        if exporter_obj.send_results(self.config_vars, timings, column_headers, data_file, test_name, self.file_logger):
+            self.file_logger.info("Poll timing info sent.")
+            return True
+        else:
+            self.file_logger.error("Issue sending poll timing info.")
+            return False
@@ -0,0 +1,381 @@
+"""
+DHCP client engine - runs a DHCP exchange with the DHCP server(s) reachable
+from an interface, sending & receiving the DHCP messages directly (on a
+packet socket bound to the interface), so that each phase of the exchange
+can be timed. The address configured on the interface is never changed.
+
+Exchanges supported:
+
+    inform: DHCPINFORM -> DHCPACK (asks for config only, the lease is not
+            touched)
+    renew:  DHCPREQUEST -> DHCPACK (renews the current lease, the request is
+            broadcast as in the REBINDING state of RFC 2131)
+    full:   DHCPDISCOVER -> DHCPOFFER -> DHCPREQUEST -> DHCPACK (for the
+            current address - if a different address is offered, the
+            exchange is stopped after the offer)
+"""
+import ctypes
+import os
+import random
+import select
+import socket
+import struct
+import time
+from wiperf_poller.helpers.icmp import checksum
+from wiperf_poller.helpers.route import get_interface_ipv4
+
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+
+DHCP_SERVER_PORT = 67
+DHCP_CLIENT_PORT = 68
+
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+
+# message types (option 53)
+DHCPDISCOVER = 1
+DHCPOFFER = 2
+DHCPREQUEST = 3
+DHCPDECLINE = 4
+DHCPACK = 5
+DHCPNAK = 6
+DHCPRELEASE = 7
+DHCPINFORM = 8
+
+MESSAGE_TYPES = {
+    DHCPDISCOVER: 'DHCPDISCOVER', DHCPOFFER: 'DHCPOFFER', DHCPREQUEST: 'DHCPREQUEST', DHCPDECLINE: 'DHCPDECLINE',
+    DHCPACK: 'DHCPACK', DHCPNAK: 'DHCPNAK', DHCPRELEASE: 'DHCPRELEASE', DHCPINFORM: 'DHCPINFORM',
+}
+
+# options
+OPT_SUBNET_MASK = 1
+OPT_ROUTER = 3
+OPT_DNS_SERVERS = 6
+OPT_DOMAIN_NAME = 15
+OPT_REQUESTED_IP = 50
+OPT_LEASE_TIME = 51
+OPT_MESSAGE_TYPE = 53
+OPT_SERVER_ID = 54
+OPT_PARAM_REQUEST_LIST = 55
+OPT_MAX_MESSAGE_SIZE = 57
+OPT_CLIENT_ID = 61
+OPT_END = 255
+
+# BOOTP messages are padded to at least this size
+MIN_MESSAGE_SIZE = 300
+
+# packet filter (classic BPF) for udp packets to the DHCP client port:
+#   ldh [12]; jeq #0x800; ldb [23]; jeq #17; ldh [20]; jset #0x1fff (fragment);
+#   ldxb 4*([14]&0xf); ldh [x+16]; jeq #68; ret #0x40000; ret #0
+DHCP_CLIENT_FILTER = [
+    (0x28, 0, 0, 12), (0x15, 0, 8, ETH_P_IP), (0x30, 0, 0, 23), (0x15, 0, 6, socket.IPPROTO_UDP),
+    (0x28, 0, 0, 20), (0x45, 4, 0, 0x1fff), (0xb1, 0, 0, 14), (0x48, 0, 0, 16),
+    (0x15, 0, 1, DHCP_CLIENT_PORT), (0x06, 0, 0, 0x40000), (0x06, 0, 0, 0),
+]
+
+def get_interface_mac(interface_name):
+    """
+    Get the MAC address of an interface (as bytes)
+    """
+    with open('/sys/class/net/{}/address'.format(interface_name), 'r') as address_file:
+        return bytes.fromhex(address_file.read().strip().replace(':', ''))
+
+def _option(code, value):
+
+    return struct.pack('!BB', code, len(value)) + value
+
+def build_message(msg_type, xid, mac, ciaddr='0.0.0.0', requested_ip=None, server_id=None, secs=0):
+    """
+    Build a DHCP (BOOTP) client message. Replies are requested to be
+    broadcast unless the client has an address (ciaddr).
+    """
+    flags = 0x8000 if ciaddr == '0.0.0.0' else 0
+
+    message = struct.pack('!BBBBIHH4s4s4s4s16s64s128s', 1, 1, len(mac), 0, xid, secs, flags,
+        socket.inet_aton(ciaddr), b'\x00' * 4, b'\x00' * 4, b'\x00' * 4, mac, b'', b'')
+
+    message += MAGIC_COOKIE
+    message += _option(OPT_MESSAGE_TYPE, bytes([msg_type]))
+    message += _option(OPT_CLIENT_ID, b'\x01' + mac)
+
+    if requested_ip:
+        message += _option(OPT_REQUESTED_IP, socket.inet_aton(requested_ip))
+
+    if server_id:
+        message += _option(OPT_SERVER_ID, socket.inet_aton(server_id))
+
+    if msg_type != DHCPRELEASE:
+        message += _option(OPT_MAX_MESSAGE_SIZE, struct.pack('!H', 1500))
+        message += _option(OPT_PARAM_REQUEST_LIST, bytes([OPT_SUBNET_MASK, OPT_ROUTER, OPT_DNS_SERVERS,
+            OPT_DOMAIN_NAME, OPT_LEASE_TIME, OPT_SERVER_ID]))
+
+    message += bytes([OPT_END])
+
+    return message.ljust(MIN_MESSAGE_SIZE, b'\x00')
+
+def parse_message(data):
+    """
+    Parse a DHCP message. Returns a dict of the main fields & options
+    ({option code: value bytes}), or None if not a valid DHCP message.
+    """
+    if len(data) < 240 or data[236:240] != MAGIC_COOKIE:
+        return None
+
+    (op, _htype, hlen, _hops, xid, _secs, _flags, ciaddr, yiaddr, siaddr, giaddr,
+        chaddr) = struct.unpack('!BBBBIHH4s4s4s4s16s', data[:44])
+
+    options = {}
+    index = 240
+
+    while index < len(data):
+        code = data[index]
+
+        if code == OPT_END:
+            break
+
+        # pad
+        if code == 0:
+            index += 1
+            continue
+
+        if index + 1 >= len(data):
+            break
+
+        length = data[index + 1]
+        # (options split across several instances are concatenated - RFC 3396)
+        options[code] = options.get(code, b'') + data[index + 2:index + 2 + length]
+        index += 2 + length
+
+    msg_type = options.get(OPT_MESSAGE_TYPE, b'\x00')[0]
+
+    return {
+        'op': op,
+        'xid': xid,
+        'msg_type': msg_type,
+        'ciaddr': socket.inet_ntoa(ciaddr),
+        'yiaddr': socket.inet_ntoa(yiaddr),
+        'siaddr': socket.inet_ntoa(siaddr),
+        'giaddr': socket.inet_ntoa(giaddr),
+        'chaddr': chaddr[:hlen],
+        'options': options,
+    }
+
+def build_frame(src_mac, src_ip, payload):
+    """
+    Build a broadcast ethernet frame carrying a DHCP client message (udp
+    68 -> 67). The udp checksum is optional for IPv4 & is not set.
+    """
+    udp = struct.pack('!HHHH', DHCP_CLIENT_PORT, DHCP_SERVER_PORT, 8 + len(payload), 0) + payload
+
+    ip_header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), random.randint(0, 0xffff), 0, 64,
+        socket.IPPROTO_UDP, 0, socket.inet_aton(src_ip), socket.inet_aton('255.255.255.255'))
+    ip_header = ip_header[:10] + struct.pack('!H', checksum(ip_header)) + ip_header[12:]
+
+    return b'\xff' * 6 + src_mac + struct.pack('!H', ETH_P_IP) + ip_header + udp
+
+def parse_frame(frame):
+    """
+    Extract the udp payload of a frame sent to the DHCP client port
+    (returns None for any other frame)
+    """
+    if len(frame) < 34 or struct.unpack('!H', frame[12:14])[0] != ETH_P_IP:
+        return None
+
+    header_len = (frame[14] & 0x0f) * 4
+    udp_start = 14 + header_len
+
+    if frame[23] != socket.IPPROTO_UDP or len(frame) < udp_start + 8:
+        return None
+
+    dst_port, udp_len = struct.unpack('!HH', frame[udp_start + 2:udp_start + 6])
+
+    if dst_port != DHCP_CLIENT_PORT:
+        return None
+
+    return frame[udp_start + 8:udp_start + udp_len]
+
+
+class DhcpError(Exception):
+
+    pass
+
+
+class DhcpClient(object):
+    '''
+    A class to run (& time) a DHCP exchange on an interface
+    '''
+
+    def __init__(self, file_logger, interface, timeout=3, retries=2):
+
+        self.file_logger = file_logger
+        self.interface = interface
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+
+        self.mac = get_interface_mac(interface)
+        self.sock = None
+        self.retransmits = 0
+
+    def _open(self):
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+
+        try:
+            # only pass DHCP client packets up from the kernel
+            filter_code = b''.join([struct.pack('HBBI', *instruction) for instruction in DHCP_CLIENT_FILTER])
+            filter_buffer = ctypes.create_string_buffer(filter_code)
+            filter_prog = struct.pack('HL', len(DHCP_CLIENT_FILTER), ctypes.addressof(filter_buffer))
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, filter_prog)
+        except OSError as err:
+            self.file_logger.debug("Unable to attach DHCP packet filter (all packets will be checked): {}".format(err))
+
+        self.sock.bind((self.interface, ETH_P_IP))
+
+    def _close(self):
+
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _exchange(self, msg_type, src_ip, xid, reply_types, **msg_args):
+        '''
+        Send a message & wait for a reply of one of the types expected
+        (retransmitting the message if no reply is received). Returns a tuple
+        of (reply, time from first transmission to reply in mS).
+        '''
+        start = time.monotonic()
+
+        for attempt in range(self.retries + 1):
+
+            secs = int(time.monotonic() - start)
+            frame = build_frame(self.mac, src_ip, build_message(msg_type, xid, self.mac, secs=secs, **msg_args))
+
+            if attempt:
+                self.retransmits += 1
+                self.file_logger.debug("dhcp: no reply, retransmitting {}".format(MESSAGE_TYPES[msg_type]))
+            else:
+                self.file_logger.debug("dhcp: sending {} (xid: {:#010x})".format(MESSAGE_TYPES[msg_type], xid))
+
+            self.sock.send(frame)
+
+            deadline = time.monotonic() + self.timeout
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                if not select.select([self.sock], [], [], remaining)[0]:
+                    break
+
+                payload = parse_frame(self.sock.recv(4096))
+                reply = parse_message(payload) if payload else None
+
+                if (not reply) or (reply['op'] != 2) or (reply['xid'] != xid) or (reply['chaddr'] != self.mac):
+                    continue
+
+                if reply['msg_type'] not in reply_types:
+                    continue
+
+                reply_time = (time.monotonic() - start) * 1000
+
+                self.file_logger.debug("dhcp: received {} from {} ({:.1f}mS)".format(
+                    MESSAGE_TYPES.get(reply['msg_type'], reply['msg_type']), self._server_id(reply), reply_time))
+
+                return (reply, reply_time)
+
+        raise DhcpError("no reply to {} ({} attempts)".format(MESSAGE_TYPES[msg_type], self.retries + 1))
+
+    def _server_id(self, reply):
+
+        server_id = reply['options'].get(OPT_SERVER_ID)
+
+        return socket.inet_ntoa(server_id) if server_id and len(server_id) == 4 else reply['siaddr']
+
+    def _check_ack(self, reply):
+
+        if reply['msg_type'] == DHCPNAK:
+            raise DhcpError("DHCPNAK received from {}".format(self._server_id(reply)))
+
+    def _result(self, mode, reply, phases):
+
+        lease_time = reply['options'].get(OPT_LEASE_TIME)
+
+        result = {
+            'mode': mode,
+            'server_id': self._server_id(reply),
+            'relay': reply['giaddr'],
+            'address': reply['yiaddr'] if reply['yiaddr'] != '0.0.0.0' else reply['ciaddr'],
+            'lease_time': struct.unpack('!I', lease_time)[0] if lease_time and len(lease_time) == 4 else None,
+            'retransmits': self.retransmits,
+        }
+        result.update(phases)
+        result['total_ms'] = sum(phases.values())
+
+        return result
+
+    def _inform(self, current_ip, xid):
+
+        reply, ack_ms = self._exchange(DHCPINFORM, current_ip, xid, [DHCPACK, DHCPNAK], ciaddr=current_ip)
+        self._check_ack(reply)
+
+        return self._result('inform', reply, {'inform_ack_ms': ack_ms})
+
+    def _renew(self, current_ip, xid):
+
+        reply, ack_ms = self._exchange(DHCPREQUEST, current_ip, xid, [DHCPACK, DHCPNAK], ciaddr=current_ip)
+        self._check_ack(reply)
+
+        return self._result('renew', reply, {'request_ack_ms': ack_ms})
+
+    def _full(self, current_ip, xid):
+
+        offer, offer_ms = self._exchange(DHCPDISCOVER, '0.0.0.0', xid, [DHCPOFFER], requested_ip=current_ip)
+
+        # don't request a different address, as this would move our lease
+        if current_ip and offer['yiaddr'] != current_ip:
+            self.file_logger.warning("dhcp: {} offered {} (current address: {}), not requesting offered address".format(
+                self._server_id(offer), offer['yiaddr'], current_ip))
+            return self._result('full', offer, {'discover_offer_ms': offer_ms})
+
+        ack, ack_ms = self._exchange(DHCPREQUEST, '0.0.0.0', xid, [DHCPACK, DHCPNAK],
+            requested_ip=offer['yiaddr'], server_id=self._server_id(offer))
+        self._check_ack(ack)
+
+        return self._result('full', ack, {'discover_offer_ms': offer_ms, 'request_ack_ms': ack_ms})
+
+    def run(self, mode='renew'):
+        '''
+        Run a DHCP exchange (mode: inform, renew or full). Returns a dict of
+        the results:
+
+            { 'mode', 'server_id', 'relay' (relay agent address, 0.0.0.0 if
+              none), 'address', 'lease_time' (secs), 'retransmits',
+              'total_ms', plus the time of each phase (mS):
+              'inform_ack_ms' (inform), 'request_ack_ms' (renew & full),
+              'discover_offer_ms' (full) }
+
+        Raises DhcpError if the exchange fails.
+        '''
+        current_ip = get_interface_ipv4(self.interface)
+
+        if mode in ['inform', 'renew'] and not current_ip:
+            raise DhcpError("{} has no IPv4 address for a DHCP {}".format(self.interface, mode))
+
+        if mode not in ['inform', 'renew', 'full']:
+            raise DhcpError("unknown DHCP test mode: {}".format(mode))
+
+        xid = int.from_bytes(os.urandom(4), 'big')
+        self.retransmits = 0
+
+        self._open()
+
+        try:
+            if mode == 'inform':
+                return self._inform(current_ip, xid)
+            elif mode == 'renew':
+                return self._renew(current_ip, xid)
+            else:
+                return self._full(current_ip, xid)
+        finally:
+            self._close()
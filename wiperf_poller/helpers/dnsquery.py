@@ -0,0 +1,246 @@
+"""
+Simple DNS query engine - sends DNS queries (over UDP) directly to DNS
+resolvers, so that lookup times are not hidden by any local cache (e.g.
+nscd) sitting in front of the system resolver
+
+Any number of queries are sent concurrently from a single select() loop,
+each with its own timeout.
+"""
+import random
+import selectors
+import socket
+import struct
+import time
+
+RESOLV_CONF = '/etc/resolv.conf'
+
+QUERY_TYPES = {
+    'A': 1,
+    'CNAME': 5,
+    'AAAA': 28,
+}
+
+RCODE_NAMES = {
+    0: 'NOERROR',
+    1: 'FORMERR',
+    2: 'SERVFAIL',
+    3: 'NXDOMAIN',
+    4: 'NOTIMP',
+    5: 'REFUSED',
+}
+
+# header flags
+FLAG_QR = 0x8000
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+
+def read_resolvers(resolv_conf=RESOLV_CONF):
+    """
+    Return a list of the nameservers configured in resolv.conf
+    """
+    resolvers = []
+
+    try:
+        with open(resolv_conf, 'r') as conf_file:
+            for line in conf_file:
+                fields = line.split()
+
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    resolvers.append(fields[1])
+    except OSError:
+        pass
+
+    return resolvers
+
+def build_query(qname, qtype, recursion_desired=True):
+    """
+    Build a DNS query packet - returns (query id, packet)
+    """
+    query_id = random.randint(0, 0xffff)
+    flags = FLAG_RD if recursion_desired else 0
+
+    packet = struct.pack("!HHHHHH", query_id, flags, 1, 0, 0, 0)
+
+    for label in qname.strip('.').split('.'):
+        label = label.encode('idna')
+        packet += struct.pack("!B", len(label)) + label
+
+    packet += b'\x00' + struct.pack("!HH", QUERY_TYPES[qtype], 1)
+
+    return (query_id, packet)
+
+def _skip_name(data, offset):
+
+    while True:
+        length = data[offset]
+
+        # compression pointer (always ends the name)
+        if length & 0xc0 == 0xc0:
+            return offset + 2
+
+        offset += 1
+
+        if length == 0:
+            return offset
+
+        offset += length
+
+def parse_response(data, query_id, qtype):
+    """
+    Parse a DNS response packet. Returns None if the packet is not a response
+    to our query, otherwise a dict of this format:
+
+        { 'rcode': response code,
+          'truncated': True if the TC flag set,
+          'answers': number of answer records of the type queried (or CNAMEs) }
+    """
+    if len(data) < 12:
+        return None
+
+    resp_id, flags, qdcount, ancount, _nscount, _arcount = struct.unpack("!HHHHHH", data[:12])
+
+    if (resp_id != query_id) or not (flags & FLAG_QR):
+        return None
+
+    answers = 0
+
+    try:
+        offset = 12
+
+        for _ in range(qdcount):
+            offset = _skip_name(data, offset) + 4
+
+        for _ in range(ancount):
+            offset = _skip_name(data, offset)
+            rr_type, _rr_class, _ttl, rd_length = struct.unpack("!HHIH", data[offset:offset + 10])
+            offset += 10 + rd_length
+
+            if rr_type in (QUERY_TYPES[qtype], QUERY_TYPES['CNAME']):
+                answers += 1
+
+    except (IndexError, struct.error):
+        # truncated/malformed answer section - use what we have
+        pass
+
+    return {
+        'rcode': flags & 0x000f,
+        'truncated': bool(flags & FLAG_TC),
+        'answers': answers,
+    }
+
+
+class DnsQuery(object):
+    '''
+    A single DNS query to a resolver (and its result)
+    '''
+
+    def __init__(self, resolver, qname, qtype, recursion_desired=True):
+
+        self.resolver = resolver
+        self.qname = qname
+        self.qtype = qtype
+        self.recursion_desired = recursion_desired
+
+        self.sock = None
+        self.query_id = None
+        self.sent = None
+
+        # result
+        self.response = None
+        self.error = ''
+        self.latency_ms = None
+
+
+class DnsQueryEngine(object):
+    '''
+    A class to send DNS queries to resolvers concurrently
+    '''
+
+    def __init__(self, file_logger, timeout=2):
+
+        self.file_logger = file_logger
+        self.timeout = float(timeout)
+
+    def _send_query(self, query):
+
+        addr_info = socket.getaddrinfo(query.resolver, 53, 0, socket.SOCK_DGRAM)[0]
+        family, _type, _proto, _canon, sockaddr = addr_info
+
+        query.sock = socket.socket(family, socket.SOCK_DGRAM)
+        query.sock.setblocking(False)
+        query.sock.connect(sockaddr)
+
+        query.query_id, packet = build_query(query.qname, query.qtype, query.recursion_desired)
+
+        query.sent = time.monotonic()
+        query.sock.send(packet)
+
+    def _read_response(self, query, now):
+
+        try:
+            data = query.sock.recv(4096)
+        except OSError as err:
+            # e.g. ICMP port unreachable from resolver
+            query.error = str(err)
+            return True
+
+        response = parse_response(data, query.query_id, query.qtype)
+
+        if response is None:
+            # not our response - keep waiting
+            return False
+
+        query.response = response
+        query.latency_ms = (now - query.sent) * 1000
+
+        return True
+
+    def run_queries(self, queries):
+        '''
+        Send a list of DnsQuery objects concurrently & wait for responses (or
+        timeouts). Results are stored in each query object.
+        '''
+        selector = selectors.DefaultSelector()
+        pending = []
+
+        try:
+            for query in queries:
+                try:
+                    self._send_query(query)
+                except (OSError, UnicodeError) as err:
+                    query.error = str(err)
+                    continue
+
+                selector.register(query.sock, selectors.EVENT_READ, query)
+                pending.append(query)
+
+            while pending:
+
+                now = time.monotonic()
+                deadline = min([query.sent + self.timeout for query in pending])
+
+                for key, _mask in selector.select(max(deadline - now, 0)):
+
+                    query = key.data
+
+                    if self._read_response(query, time.monotonic()):
+                        selector.unregister(query.sock)
+                        pending.remove(query)
+
+                now = time.monotonic()
+
+                for query in list(pending):
+                    if now - query.sent >= self.timeout:
+                        query.error = "timeout ({}s)".format(self.timeout)
+                        selector.unregister(query.sock)
+                        pending.remove(query)
+
+        finally:
+            selector.close()
+
+            for query in queries:
+                if query.sock:
+                    query.sock.close()
+                    query.sock = None
+
+        return queries
@@ -1,8 +1,23 @@
+import array
+import fcntl
 import re
+import socket
+import struct
 import subprocess
 import sys
 import time
 from wiperf_poller.helpers.os_cmds import IP_CMD, ROUTE_CMD, IF_DOWN_CMD, IF_UP_CMD
+from wiperf_poller.helpers.route import get_interface_ipv4, clear_route_cache
+
+SIOCETHTOOL = 0x8946
+ETHTOOL_GSET = 0x00000001
+
+# ethtool port types
+ETHTOOL_PORTS = {0x00: 'tp', 0x01: 'aui', 0x02: 'bnc', 0x03: 'mii', 0x04: 'fibre', 0x05: 'da', 0xef: 'none', 0xff: 'other'}
+
+# interface counters read from /sys/class/net/<if>/statistics
+ETH_COUNTERS = ['rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets', 'rx_errors', 'tx_errors',
+    'rx_dropped', 'tx_dropped', 'rx_crc_errors', 'collisions']
 
 
 class EthernetAdapter(object):
@@ -56,6 +71,9 @@ class EthernetAdapter(object):
         self.file_logger.debug("Ethernet interface config info: {}".format(if_info))
 
         # Extract interface up/down status
+        if not self.if_status:
+            self.if_status = self.sysfs_value('operstate').upper()
+
         if not self.if_status:
             pattern = r'state (.*?) mode'
             field_name = "if_status"
@@ -65,7 +83,114 @@ class EthernetAdapter(object):
 
         return True
 
-    
+    def sysfs_value(self, name):
+        '''
+        Read an attribute of the interface from /sys/class/net/<if>/ - returns
+        an empty string if the attribute is not available (e.g. the speed of
+        an interface with no link)
+        '''
+        try:
+            with open('/sys/class/net/{}/{}'.format(self.eth_if_name, name), 'r') as sysfs_file:
+                return sysfs_file.read().strip()
+        except (IOError, OSError):
+            return ''
+
+    def sysfs_info(self):
+        '''
+        Get the link state & traffic counters of the interface from sysfs.
+        Returns a dict of the values available (values not reported by the
+        driver are None), or False if the interface does not exist.
+        '''
+        operstate = self.sysfs_value('operstate')
+
+        if not operstate:
+            self.file_logger.error("Unable to read sysfs info of interface: {}".format(self.eth_if_name))
+            return False
+
+        info = {'operstate': operstate}
+
+        for name in ['carrier', 'speed', 'mtu', 'carrier_changes']:
+            value = self.sysfs_value(name)
+            info[name] = int(value) if value.lstrip('-').isdigit() else None
+
+        # speed is -1 if not known (e.g. virtual interfaces)
+        if info['speed'] is not None and info['speed'] < 0:
+            info['speed'] = None
+
+        duplex = self.sysfs_value('duplex')
+        info['duplex'] = duplex if duplex in ['full', 'half'] else None
+
+        for counter in ETH_COUNTERS:
+            value = self.sysfs_value('statistics/{}'.format(counter))
+            info[counter] = int(value) if value.isdigit() else None
+
+        self.file_logger.debug("Ethernet sysfs info: {}".format(info))
+
+        return info
+
+    def ethtool_info(self):
+        '''
+        Get the link settings of the interface using the ethtool ioctl
+        (ETHTOOL_GSET), as not all of them are available from sysfs. Returns
+        a dict: {'speed', 'duplex', 'autoneg', 'port'} (values not known are
+        None), or False if the driver does not support the ioctl.
+        '''
+        # struct ethtool_cmd
+        ethtool_cmd = '=IIIHBBBBBBIIHBBI2I'
+
+        buffer = array.array('B', struct.pack(ethtool_cmd, ETHTOOL_GSET, *([0] * 17)))
+        address = buffer.buffer_info()[0]
+        ifreq = struct.pack('16sP', self.eth_if_name[:15].encode(), address).ljust(40, b'\0')
+
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                fcntl.ioctl(sock.fileno(), SIOCETHTOOL, ifreq)
+        except OSError as err:
+            self.file_logger.debug("ethtool ioctl not supported by {}: {}".format(self.eth_if_name, err))
+            return False
+
+        fields = struct.unpack(ethtool_cmd, buffer.tobytes())
+        speed = (fields[12] << 16) | fields[3]
+        duplex = fields[4]
+
+        info = {
+            'speed': speed if speed not in [0, 0xffff, 0xffffffff] else None,
+            'duplex': {0: 'half', 1: 'full'}.get(duplex),
+            'autoneg': bool(fields[8]),
+            'port': ETHTOOL_PORTS.get(fields[5]),
+        }
+
+        self.file_logger.debug("Ethernet ethtool info: {}".format(info))
+
+        return info
+
+    def get_link_stats(self):
+        '''
+        Get the link state, link settings & traffic counters of the interface
+        (sysfs values, with the speed/duplex/autoneg reported by the ethtool
+        ioctl where available). Returns a dict, or False on error.
+        '''
+        info = self.sysfs_info()
+
+        if not info:
+            return False
+
+        info['autoneg'] = None
+        info['port'] = None
+
+        ethtool = self.ethtool_info()
+
+        if ethtool:
+            for key in ['speed', 'duplex', 'autoneg', 'port']:
+                if ethtool[key] is not None:
+                    info[key] = ethtool[key]
+
+        # link settings are stale when there is no link
+        if not info['carrier']:
+            info['speed'] = None
+            info['duplex'] = None
+
+        return info
 
     def get_ethernet_info(self):
         '''
@@ -103,13 +228,27 @@ class EthernetAdapter(object):
 
     def get_adapter_ip(self):
         '''
-        This method parses the output of the ifconfig command to figure out the
-        IP address of the wireless adapter.
+        This method gets the IP address of the ethernet adapter directly from
+        the kernel, falling back to parsing the output of the ip command.
 
-        As this is a wrapper around a CLI command, it is likely to break at
-        some stage
+        As the fallback is a wrapper around a CLI command, it is likely to
+        break at some stage
         '''
 
+        try:
+            ip_addr = get_interface_ipv4(self.eth_if_name)
+
+            if ip_addr is None or ip_addr.startswith('169.254.'):
+                ip_addr = "NA"
+
+            self.ip_addr = ip_addr
+            self.file_logger.debug("IP Address = " + self.ip_addr)
+
+            return self.ip_addr
+
+        except OSError as err:
+            self.file_logger.debug("Unable to get IP address of {} from kernel ({}), using ip command".format(self.eth_if_name, err))
+
         # Get interface info
         try:
             cmd = "{} -4 a show  {}".format(IP_CMD, self.eth_if_name)
@@ -211,6 +350,9 @@ class EthernetAdapter(object):
             self.file_logger.error(error_descr)
             return False
 
+        # routes via the interface may have changed
+        clear_route_cache()
+
         self.file_logger.info("Interface bounce completed OK.")
         return True
     
@@ -0,0 +1,191 @@
+"""
+Ethernet stats - reports the link state & traffic of the ethernet interface
+each poll cycle, read directly from sysfs & the ethtool ioctl (no commands
+are run). The interface counters from the last poll cycle are saved to a
+state file, so that the change in each counter since the last cycle (and the
+throughput, utilisation, error & drop rates over the interval) can be
+reported, giving a view of the load on the wired side of the probe.
+"""
+import json
+import os
+import time
+from wiperf_poller.helpers.ethernetadapter import ETH_COUNTERS
+from wiperf_poller.helpers.timefunc import get_timestamp
+
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+def get_boot_id():
+    """
+    Return the boot id of the kernel (counters are reset by a reboot)
+    """
+    try:
+        with open(BOOT_ID_FILE, 'r') as boot_id_file:
+            return boot_id_file.read().strip()
+    except (IOError, OSError):
+        return ''
+
+def counter_change(current, previous):
+    """
+    Return the increase of a counter since its previous value (allowing for
+    a counter reset, e.g. a driver reload). None if either value is missing.
+    """
+    if current is None or previous is None:
+        return None
+
+    if current >= previous:
+        return current - previous
+
+    return current
+
+def _percent(count, total):
+
+    return round(count * 100 / total, 3) if total else 0.0
+
+
+class EthernetStats(object):
+
+    '''
+    A class to report ethernet link stats & counter changes between poll
+    cycles
+    '''
+
+    # counters reported as changes since the last poll cycle
+    COUNTERS = ETH_COUNTERS + ['carrier_changes']
+
+    def __init__(self, adapter_obj, config_vars, file_logger):
+
+        self.adapter_obj = adapter_obj
+        self.config_vars = config_vars
+        self.file_logger = file_logger
+
+        self.state_file = config_vars['eth_stats_state_file']
+
+    def _read_state(self):
+
+        try:
+            with open(self.state_file, 'r') as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # counters from a previous boot or another interface are not comparable
+        if state.get('boot_id') != get_boot_id() or state.get('interface') != self.adapter_obj.eth_if_name:
+            self.file_logger.info("Ethernet stats state file not valid for this interface/boot, ignoring.")
+            return None
+
+        return state
+
+    def _write_state(self, state):
+
+        tmp_file = self.state_file + '.tmp'
+
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(tmp_file, 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(tmp_file, self.state_file)
+        except (IOError, OSError) as err:
+            self.file_logger.error("Unable to save ethernet stats state to {}: {}".format(self.state_file, err))
+
+    def get_stats(self):
+        '''
+        Return a dict of the current link stats, plus the counter changes &
+        rates since the last call (previous poll cycle), or False on error.
+        The counter fields are only included if the previous counters are
+        available (i.e. not on the first poll cycle).
+        '''
+        link_stats = self.adapter_obj.get_link_stats()
+
+        if not link_stats:
+            return False
+
+        now = time.time()
+        previous = self._read_state()
+
+        self._write_state({
+            'boot_id': get_boot_id(),
+            'interface': self.adapter_obj.eth_if_name,
+            'time': now,
+            'counters': dict([(counter, link_stats[counter]) for counter in self.COUNTERS]),
+        })
+
+        results_dict = {
+            'time': get_timestamp(self.config_vars),
+            'interface': self.adapter_obj.eth_if_name,
+            'operstate': link_stats['operstate'],
+            'carrier': link_stats['carrier'],
+            'speed_mbps': link_stats['speed'],
+            'duplex': link_stats['duplex'],
+            'autoneg': link_stats['autoneg'],
+            'mtu': link_stats['mtu'],
+        }
+
+        # link values not reported by the driver
+        for key, value in results_dict.items():
+            if value is None:
+                results_dict[key] = 'NA'
+
+        if previous is None:
+            self.file_logger.info("No previous ethernet counters available, reporting link state only.")
+            return results_dict
+
+        interval = now - previous['time']
+
+        if interval <= 0:
+            self.file_logger.warning("Ethernet stats interval not valid (clock changed?), reporting link state only.")
+            return results_dict
+
+        results_dict['interval_secs'] = round(interval, 1)
+
+        changes = {}
+        for counter in self.COUNTERS:
+            changes[counter] = counter_change(link_stats[counter], previous['counters'].get(counter))
+            results_dict[counter] = 'NA' if changes[counter] is None else changes[counter]
+
+        for direction in ['rx', 'tx']:
+
+            byte_count = changes['{}_bytes'.format(direction)]
+            packets = changes['{}_packets'.format(direction)]
+
+            if byte_count is not None:
+                mbps = byte_count * 8 / interval / 1000000
+                results_dict['{}_mbps'.format(direction)] = round(mbps, 3)
+
+                if link_stats['speed']:
+                    results_dict['{}_util_percent'.format(direction)] = round(mbps * 100 / link_stats['speed'], 2)
+
+            if packets is not None:
+                # errors/drops as a percentage of the packets seen
+                for counter in ['errors', 'dropped']:
+                    count = changes['{}_{}'.format(direction, counter)]
+                    if count is not None:
+                        results_dict['{}_{}_percent'.format(direction, counter)] = _percent(count, packets + count)
+
+        return results_dict
+
+    def dump(self, exporter_obj):
+        '''
+        Send the ethernet stats to the mgt platform
+        '''
+        self.file_logger.info("########## ethernet stats ##########")
+
+        results_dict = self.get_stats()
+
+        if not results_dict:
+            self.file_logger.error("Unable to get ethernet stats.")
+            return False
+
+        results_dict['location'] = self.config_vars['location']
+
+        self.file_logger.info("Ethernet stats: {}".format(results_dict))
+
+        column_headers = list(results_dict.keys())
+        data_file = self.config_vars['eth_data_file']
+        test_name = "Ethernet Stats"
+
+        if not exporter_obj.send_results(self.config_vars, results_dict, column_headers, data_file, test_name, self.file_logger):
+            self.file_logger.error("Issue sending ethernet stats.")
+            return False
+
+        self.file_logger.info("Ethernet stats sent.")
+        return True
@@ -4,6 +4,7 @@ a rotating file handle to maintain file sizes
 '''
 from __future__ import print_function
 import logging
+import os
 import time
 from logging.handlers import RotatingFileHandler
 
@@ -31,3 +32,24 @@ def FileLogger(log_file, error_log_file):
     logger.addHandler(file_handler)
 
     return logger    
+
+def truncate_error_log(logger, error_log_file):
+    '''
+    Empty the error log file so that it only holds errors from the current poll
+    cycle (it is normally emptied when the process starts, which is not often
+    enough when the poller runs as a long-lived process)
+    '''
+    error_log_path = os.path.abspath(error_log_file)
+
+    for handler in logger.handlers:
+
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == error_log_path:
+
+            handler.acquire()
+            try:
+                if handler.stream:
+                    handler.stream.flush()
+                    handler.stream.seek(0)
+                    handler.stream.truncate()
+            finally:
+                handler.release()
@@ -0,0 +1,225 @@
+"""
+HTTP probe - performs a http/https get, timing each phase of the request:
+
+    dns      : DNS lookup of the target hostname
+    connect  : TCP connection set-up
+    tls      : TLS handshake (https only)
+    ttfb     : time from request sent to response headers received
+    transfer : time to receive the response body
+
+Connections may be re-used (keep-alive) by subsequent requests made by the
+same probe object, so that a "warm" connection can be timed.
+"""
+import socket
+import ssl
+import time
+import http.client
+from urllib.parse import urlsplit, urljoin
+from urllib.request import getproxies, proxy_bypass
+
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+def uses_proxy(url):
+    """
+    Check if a http proxy is configured (via environment vars) for the URL
+    """
+    parts = urlsplit(url)
+    proxies = getproxies()
+
+    if not proxies.get(parts.scheme):
+        return False
+
+    return not proxy_bypass(parts.hostname)
+
+
+class HttpProbe(object):
+    '''
+    A class to perform http/https gets with a timing breakdown of each phase
+    '''
+
+    def __init__(self, file_logger, timeout=5, max_redirects=5):
+
+        self.file_logger = file_logger
+        self.timeout = float(timeout)
+        self.max_redirects = int(max_redirects)
+
+        # open connections: {(scheme, host, port): HTTPConnection}
+        self.connections = {}
+
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    def close(self):
+        '''
+        Close all open connections
+        '''
+        for conn in self.connections.values():
+            conn.close()
+
+        self.connections = {}
+
+    def _connect(self, scheme, host, port, timings):
+
+        # DNS lookup
+        start = time.monotonic()
+        addr_info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        timings['dns'] += time.monotonic() - start
+
+        # TCP connect (try each address returned, as create_connection does)
+        start = time.monotonic()
+        sock = None
+        last_err = None
+
+        for family, sock_type, proto, _canon, sockaddr in addr_info:
+            try:
+                sock = socket.socket(family, sock_type, proto)
+                sock.settimeout(self.timeout)
+                sock.connect(sockaddr)
+                break
+            except OSError as err:
+                last_err = err
+                sock.close()
+                sock = None
+
+        if sock is None:
+            raise last_err if last_err else OSError("unable to connect to {}".format(host))
+
+        timings['connect'] += time.monotonic() - start
+
+        # TLS handshake
+        if scheme == 'https':
+            start = time.monotonic()
+            sock = self.ssl_context.wrap_socket(sock, server_hostname=host)
+            timings['tls'] += time.monotonic() - start
+
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        conn.sock = sock
+
+        return conn
+
+    def _get_connection(self, scheme, host, port, timings):
+
+        key = (scheme, host, port)
+
+        if key in self.connections:
+            return (self.connections[key], True)
+
+        conn = self._connect(scheme, host, port, timings)
+        self.connections[key] = conn
+
+        return (conn, False)
+
+    def _request(self, url, timings):
+
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = parts.hostname
+        port = parts.port or (443 if scheme == 'https' else 80)
+
+        if scheme not in ['http', 'https']:
+            raise ValueError("Unsupported URL scheme: {}".format(url))
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = {
+            'User-Agent': 'wiperf',
+            'Accept': '*/*',
+            'Accept-Encoding': 'gzip, deflate',
+        }
+
+        conn, reused = self._get_connection(scheme, host, port, timings)
+
+        try:
+            start = time.monotonic()
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            timings['ttfb'] += time.monotonic() - start
+
+            start = time.monotonic()
+            body = response.read()
+            timings['transfer'] += time.monotonic() - start
+
+        except (http.client.HTTPException, OSError):
+            self.connections.pop((scheme, host, port), None)
+            conn.close()
+
+            # a kept-alive connection may have been closed by the server, so
+            # retry once with a new connection
+            if reused:
+                return self._request(url, timings)
+            raise
+
+        if response.will_close:
+            self.connections.pop((scheme, host, port), None)
+            conn.close()
+
+        timings['bytes'] += len(body)
+
+        return (response, reused)
+
+    def get(self, url):
+        '''
+        Perform a http get to the URL supplied (following any redirects)
+
+        Returns a dict of this format (times in mS):
+
+        {   'status_code': http status code of final response,
+            'dns_ms': dns lookup time,
+            'connect_ms': tcp connect time,
+            'tls_ms': tls handshake time,
+            'ttfb_ms': time to first byte (response headers),
+            'transfer_ms': content transfer time,
+            'total_ms': total time taken,
+            'bytes': bytes received (response bodies),
+            'mbps': throughput of content transfer,
+            'redirects': number of redirects followed,
+            'reused': True if an existing connection was used }
+
+        Exceptions (e.g. timeouts, connection errors) are raised to the caller.
+        '''
+        timings = {
+            'dns': 0.0,
+            'connect': 0.0,
+            'tls': 0.0,
+            'ttfb': 0.0,
+            'transfer': 0.0,
+            'bytes': 0,
+        }
+
+        redirects = 0
+        start = time.monotonic()
+
+        response, reused = self._request(url, timings)
+
+        while (response.status in REDIRECT_CODES) and response.getheader('Location') and (redirects < self.max_redirects):
+            url = urljoin(url, response.getheader('Location'))
+            redirects += 1
+            self.file_logger.debug("http redirect ({}) to: {}".format(response.status, url))
+            response, _reused = self._request(url, timings)
+
+        total = time.monotonic() - start
+
+        if timings['transfer'] > 0:
+            mbps = (timings['bytes'] * 8) / (timings['transfer'] * 1000000)
+        else:
+            mbps = 0.0
+
+        return {
+            'status_code': response.status,
+            'dns_ms': timings['dns'] * 1000,
+            'connect_ms': timings['connect'] * 1000,
+            'tls_ms': timings['tls'] * 1000,
+            'ttfb_ms': timings['ttfb'] * 1000,
+            'transfer_ms': timings['transfer'] * 1000,
+            'total_ms': total * 1000,
+            'bytes': timings['bytes'],
+            'mbps': mbps,
+            'redirects': redirects,
+            'reused': reused,
+        }
@@ -0,0 +1,336 @@
+"""
+In-process ICMP echo (ping) engine
+
+Pings any number of IPv4 targets concurrently from a single select()
+loop, returning the round trip time of each echo request sent. A raw
+ICMP socket is used (the poller runs as root), with a fallback to an
+unprivileged ICMP datagram socket (see net.ipv4.ping_group_range) if raw
+sockets are not permitted.
+"""
+import math
+import os
+import selectors
+import socket
+import struct
+import time
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+# payload size used by /bin/ping (gives 64 byte ICMP packets)
+PAYLOAD_SIZE = 56
+
+def checksum(data):
+    """
+    Calculate the internet checksum (RFC 1071) of the data supplied
+    """
+    if len(data) % 2:
+        data += b'\x00'
+
+    total = sum(struct.unpack("!{}H".format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += (total >> 16)
+
+    return ~total & 0xffff
+
+def percentile(samples, percent):
+    """
+    Return the requested percentile of the samples supplied (using linear
+    interpolation between the closest ranks)
+    """
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * (percent / 100.0)
+    lower = int(math.floor(rank))
+    upper = int(math.ceil(rank))
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def rtt_stats(rtts):
+    """
+    Calculate summary stats for a list of rtt samples (mS). The mdev value
+    is calculated in the same way as /bin/ping. Jitter is the mean difference
+    between consecutive samples.
+    """
+    if not rtts:
+        return {}
+
+    count = len(rtts)
+    rtt_avg = sum(rtts) / count
+    variance = (sum([rtt * rtt for rtt in rtts]) / count) - (rtt_avg * rtt_avg)
+
+    if count > 1:
+        jitter = sum([abs(rtts[i] - rtts[i - 1]) for i in range(1, count)]) / (count - 1)
+    else:
+        jitter = 0.0
+
+    return {
+        'rtt_min': min(rtts),
+        'rtt_avg': rtt_avg,
+        'rtt_max': max(rtts),
+        'rtt_mdev': math.sqrt(max(variance, 0)),
+        'rtt_p50': percentile(rtts, 50),
+        'rtt_p95': percentile(rtts, 95),
+        'jitter': jitter,
+    }
+
+
+class PingTarget(object):
+    '''
+    State of the echo requests sent to a single target
+    '''
+
+    def __init__(self, host, addr, sock, ident, raw, count):
+
+        self.host = host
+        self.addr = addr
+        self.sock = sock
+        self.ident = ident
+        self.raw = raw
+        self.count = count
+
+        # seq 0 is an unmeasured warm-up packet (e.g. to resolve the arp entry
+        # of the target before we start timing)
+        self.next_seq = 0
+        self.next_send = 0
+        self.warming_up = True
+
+        # outstanding requests: {seq: send time}
+        self.pending = {}
+        self.rtts = []
+        self.pkts_tx = 0
+        self.start_time = None
+        self.end_time = None
+
+    def done(self):
+        return (self.next_seq > self.count) and not self.pending
+
+
+class IcmpPinger(object):
+    '''
+    A class to ping multiple hosts concurrently using ICMP sockets
+    '''
+
+    def __init__(self, file_logger, timeout=1, interval=0.2):
+
+        self.file_logger = file_logger
+        self.timeout = float(timeout)
+        self.interval = float(interval)
+
+    def _open_socket(self):
+        '''
+        Open an ICMP socket - returns (socket, is_raw_socket)
+        '''
+        try:
+            return (socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True)
+        except PermissionError:
+            return (socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False)
+
+    def _send_request(self, target, now):
+
+        seq = target.next_seq
+        payload = struct.pack("!d", now).ljust(PAYLOAD_SIZE, b'\x00')
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, target.ident, seq)
+        packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum(header + payload), target.ident, seq) + payload
+
+        try:
+            target.sock.sendto(packet, (target.addr, 0))
+        except OSError as err:
+            self.file_logger.error("Error sending ping to {}: {}".format(target.host, err))
+
+        target.pending[seq] = now
+        target.next_seq += 1
+
+        if seq == 0:
+            return
+
+        if target.start_time is None:
+            target.start_time = now
+
+        target.pkts_tx += 1
+        target.next_send = now + self.interval
+
+    def _finish_warmup(self, target, now):
+
+        target.warming_up = False
+        target.next_send = now
+
+    def _read_reply(self, target, now):
+
+        try:
+            data, (src_addr, _port) = target.sock.recvfrom(2048)
+        except OSError:
+            return
+
+        # raw sockets deliver the IP header (and receive all ICMP packets)
+        if target.raw:
+            header_len = (data[0] & 0x0f) * 4
+            data = data[header_len:]
+
+            if src_addr != target.addr:
+                return
+
+        if len(data) < 8:
+            return
+
+        icmp_type, _code, _csum, ident, seq = struct.unpack("!BBHHH", data[:8])
+
+        if icmp_type != ICMP_ECHO_REPLY:
+            return
+
+        # the kernel sets the ident of datagram ICMP sockets itself
+        if target.raw and (ident != target.ident):
+            return
+
+        send_time = target.pending.pop(seq, None)
+
+        if send_time is None:
+            # late or duplicate reply
+            return
+
+        if seq == 0:
+            self._finish_warmup(target, now)
+            return
+
+        target.rtts.append((now - send_time) * 1000)
+        target.end_time = now
+
+    def _expire_requests(self, target, now):
+
+        for seq, send_time in list(target.pending.items()):
+
+            if now - send_time < self.timeout:
+                continue
+
+            del target.pending[seq]
+
+            if seq == 0:
+                self._finish_warmup(target, now)
+            else:
+                target.end_time = now
+
+    def _next_event(self, targets):
+
+        events = []
+
+        for target in targets:
+            for send_time in target.pending.values():
+                events.append(send_time + self.timeout)
+
+            if (not target.warming_up) and (target.next_seq <= target.count):
+                events.append(target.next_send)
+
+        if not events:
+            return None
+
+        return min(events)
+
+    def ping_hosts(self, hosts, count):
+        '''
+        Ping a list of hosts concurrently, sending 'count' echo requests to each
+        host (after an initial unmeasured warm-up request)
+
+        Returns a list with a result for each host supplied (in the same order).
+        Each result is False if the host could not be pinged, or a dict of this
+        format:
+
+        {   'host': host,
+            'pkts_tx': number of requests sent,
+            'pkts_rx': number of replies received,
+            'pkt_loss': percentage packet loss,
+            'test_time': test duration (mS),
+            'rtts': list of rtt samples (mS) }
+        '''
+        count = int(count)
+
+        targets = []
+        results = []
+
+        selector = selectors.DefaultSelector()
+
+        try:
+            for index, host in enumerate(hosts):
+
+                try:
+                    addr = socket.getaddrinfo(host, None, socket.AF_INET)[0][4][0]
+                except (socket.gaierror, IndexError) as err:
+                    self.file_logger.error("Hit an error when pinging {} : {}".format(host, err))
+                    targets.append(None)
+                    continue
+
+                sock, raw = self._open_socket()
+                sock.setblocking(False)
+
+                ident = (os.getpid() + index) & 0xffff
+                target = PingTarget(host, addr, sock, ident, raw, count)
+                targets.append(target)
+
+                selector.register(sock, selectors.EVENT_READ, target)
+
+            active = [target for target in targets if target]
+            now = time.monotonic()
+
+            # send warm-up requests
+            for target in active:
+                self._send_request(target, now)
+
+            while True:
+
+                active = [target for target in active if not target.done()]
+
+                if not active:
+                    break
+
+                now = time.monotonic()
+                next_event = self._next_event(active)
+                wait_time = max(next_event - now, 0) if next_event is not None else self.timeout
+
+                for key, _mask in selector.select(wait_time):
+                    self._read_reply(key.data, time.monotonic())
+
+                now = time.monotonic()
+
+                for target in active:
+
+                    self._expire_requests(target, now)
+
+                    if (not target.warming_up) and (target.next_seq <= target.count) and (now >= target.next_send):
+                        self._send_request(target, now)
+
+        finally:
+            selector.close()
+
+            for target in targets:
+                if target:
+                    target.sock.close()
+
+        for target in targets:
+
+            if not target:
+                results.append(False)
+                continue
+
+            pkts_rx = len(target.rtts)
+
+            if target.pkts_tx:
+                pkt_loss = int(round((target.pkts_tx - pkts_rx) * 100 / target.pkts_tx))
+            else:
+                pkt_loss = 100
+
+            if target.start_time is not None and target.end_time is not None:
+                test_time = int((target.end_time - target.start_time) * 1000)
+            else:
+                test_time = 0
+
+            results.append({
+                'host': target.host,
+                'pkts_tx': target.pkts_tx,
+                'pkts_rx': pkts_rx,
+                'pkt_loss': pkt_loss,
+                'test_time': test_time,
+                'rtts': target.rtts,
+            })
+
+        return results
@@ -0,0 +1,165 @@
+"""
+iperf3 test matrix - the set of iperf3 tests (servers x protocols x directions
+x bandwidths) to be run across poll cycles. As running every test in the
+matrix each poll cycle would take too long, each cycle runs as many tests as
+fit in its time budget, picking up where the previous cycle left off. The
+position in the matrix is saved to a state file, so that the rotation
+continues across poll cycles (& restarts of the poller).
+"""
+import json
+import os
+import time
+
+# estimate of time taken to set up & tear down each test (secs)
+TEST_OVERHEAD = 3
+
+def _split_list(value):
+
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
+class Iperf3MatrixCell(object):
+    '''
+    A single test in the iperf3 test matrix
+    '''
+
+    def __init__(self, server_hostname, port, protocol, direction, bandwidth):
+
+        self.server_hostname = server_hostname
+        self.port = port
+        self.protocol = protocol
+        self.direction = direction
+        self.bandwidth = bandwidth
+
+    @property
+    def reverse(self):
+        # down = server sends to probe
+        return self.direction == 'down'
+
+    @property
+    def cell_id(self):
+        '''
+        Identifier of the cell, used to tag results so that results of the
+        same test can be compared over time
+        '''
+        return "{}:{}/{}/{}/{}".format(self.server_hostname, self.port, self.protocol, self.direction, self.bandwidth)
+
+
+class Iperf3Matrix(object):
+    '''
+    A class to build the iperf3 test matrix & track our position in it
+    '''
+
+    def __init__(self, config_vars, file_logger):
+
+        self.config_vars = config_vars
+        self.file_logger = file_logger
+
+        self.state_file = config_vars['iperf3_matrix_state_file']
+        self.duration = int(config_vars['iperf3_matrix_duration'])
+        self.time_budget = int(config_vars['iperf3_matrix_time_budget'])
+
+        self.cells = self._build_cells()
+        self.next_index = self._read_state()
+
+    def _build_cells(self):
+
+        cells = []
+
+        default_port = int(self.config_vars['iperf3_matrix_port'])
+        bandwidths = {
+            'tcp': [int(bandwidth) for bandwidth in _split_list(self.config_vars['iperf3_matrix_tcp_bandwidths'])] or [0],
+            'udp': [int(bandwidth) for bandwidth in _split_list(self.config_vars['iperf3_matrix_udp_bandwidths'])] or [10000000],
+        }
+
+        for server in _split_list(self.config_vars['iperf3_matrix_servers']):
+
+            # servers may be specified as host or host:port ([addr]:port for ipv6)
+            server_hostname, _sep, port = server.rpartition(':')
+            if not server_hostname or not port.isdigit() or (':' in server_hostname and not server_hostname.endswith(']')):
+                server_hostname, port = server, default_port
+            server_hostname = server_hostname.strip('[]')
+
+            for protocol in _split_list(self.config_vars['iperf3_matrix_protocols']):
+
+                protocol = protocol.lower()
+                if protocol not in bandwidths:
+                    self.file_logger.error("Unknown iperf3 matrix protocol: {} (ignored)".format(protocol))
+                    continue
+
+                for direction in _split_list(self.config_vars['iperf3_matrix_directions']):
+
+                    direction = direction.lower()
+                    if direction not in ['up', 'down']:
+                        self.file_logger.error("Unknown iperf3 matrix direction: {} (ignored)".format(direction))
+                        continue
+
+                    for bandwidth in bandwidths[protocol]:
+                        cells.append(Iperf3MatrixCell(server_hostname, int(port), protocol, direction, bandwidth))
+
+        return cells
+
+    def _signature(self):
+
+        return [cell.cell_id for cell in self.cells]
+
+    def _read_state(self):
+
+        try:
+            with open(self.state_file, 'r') as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return 0
+
+        # if the matrix has changed, start again from the beginning
+        if state.get('cells') != self._signature():
+            self.file_logger.info("iperf3 test matrix changed, starting from first test.")
+            return 0
+
+        return int(state.get('next_index', 0)) % max(len(self.cells), 1)
+
+    def _write_state(self):
+
+        state = {
+            'cells': self._signature(),
+            'next_index': self.next_index,
+        }
+
+        tmp_file = self.state_file + '.tmp'
+
+        try:
+            with open(tmp_file, 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(tmp_file, self.state_file)
+        except (IOError, OSError) as err:
+            self.file_logger.error("Unable to save iperf3 matrix state to {}: {}".format(self.state_file, err))
+
+    def test_time(self):
+        '''
+        Estimated time to run one test (secs)
+        '''
+        return self.duration + TEST_OVERHEAD
+
+    def get_tests(self):
+        '''
+        Return a generator of the cells to be tested this poll cycle (starting
+        from where the last cycle finished). Cells are returned until the next
+        test would not complete within the time budget (at least one test is
+        always run) or every cell has been tested. Our position in the matrix
+        is saved as each cell is returned.
+        '''
+        start = time.monotonic()
+
+        for count in range(len(self.cells)):
+
+            elapsed = time.monotonic() - start
+            if count and (elapsed + self.test_time() > self.time_budget):
+                self.file_logger.info("iperf3 matrix time budget reached ({} of {} tests run)".format(count, len(self.cells)))
+                return
+
+            cell = self.cells[self.next_index]
+
+            self.next_index = (self.next_index + 1) % len(self.cells)
+            self._write_state()
+
+            yield cell
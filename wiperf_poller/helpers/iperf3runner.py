@@ -0,0 +1,306 @@
+"""
+iperf3 runner - runs the iperf3 client program as a subprocess & reads its
+json output as the test runs (using --json-stream if supported by the
+installed iperf3 version, otherwise the -J output at the end of the test).
+
+Per-interval results (throughput, retransmits, cwnd, jitter, loss) are
+available as well as the test summary. udp jitter & loss are measured by the
+receiving end of the test, so for udp tests from the probe to the server the
+server's own interval results are fetched too (--get-server-output). The test is stopped if it runs past
+its timeout or is cancelled (from another thread).
+"""
+import json
+import os
+import selectors
+import subprocess
+import threading
+import time
+from wiperf_poller.helpers.os_cmds import IPERF3_CMD
+
+# --json-stream support of installed iperf3 program: {iperf3 cmd: True/False}
+_json_stream_support = {}
+_json_stream_lock = threading.Lock()
+
+def supports_json_stream(iperf3_cmd=IPERF3_CMD):
+    """
+    Check if the iperf3 program supports the --json-stream option (iperf3
+    v3.17 onwards). The result is cached, so the check is only run once.
+    """
+    with _json_stream_lock:
+        if iperf3_cmd not in _json_stream_support:
+            try:
+                help_text = subprocess.run([iperf3_cmd, '--help'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=5).stdout.decode()
+                _json_stream_support[iperf3_cmd] = '--json-stream' in help_text
+            except (OSError, subprocess.SubprocessError):
+                _json_stream_support[iperf3_cmd] = False
+
+        return _json_stream_support[iperf3_cmd]
+
+
+class Iperf3Result(object):
+    '''
+    The results of an iperf3 test run (attribute names match the result
+    object of the iperf3 python module, so they may be used interchangeably)
+    '''
+
+    def __init__(self, protocol, intervals, end_data, error='', server_intervals=None):
+
+        self.protocol = protocol
+        self.intervals = intervals
+        self.error = error
+
+        # interval results of the server (if fetched)
+        self.server_intervals = server_intervals or []
+
+        # interval results of the receiving end of the test (the only end
+        # that reports udp jitter & loss)
+        self.receiver_intervals = self.server_intervals or self.intervals
+
+        end_data = end_data or {}
+
+        if protocol == 'tcp':
+            sum_sent = end_data.get('sum_sent', {})
+            sum_received = end_data.get('sum_received', {})
+
+            self.sent_bytes = sum_sent.get('bytes', 0)
+            self.sent_Mbps = sum_sent.get('bits_per_second', 0) / 1000000
+            self.retransmits = sum_sent.get('retransmits', 0)
+            self.received_bytes = sum_received.get('bytes', 0)
+            self.received_Mbps = sum_received.get('bits_per_second', 0) / 1000000
+
+        else:
+            # (reverse mode udp tests report the receiver stats in sum_received)
+            udp_sum = end_data.get('sum_received') or end_data.get('sum', {})
+
+            self.bytes = udp_sum.get('bytes', 0)
+            self.Mbps = udp_sum.get('bits_per_second', 0) / 1000000
+            self.jitter_ms = udp_sum.get('jitter_ms', 0)
+            self.packets = udp_sum.get('packets', 0)
+            self.lost_packets = udp_sum.get('lost_packets', 0)
+            self.lost_percent = udp_sum.get('lost_percent', 0)
+
+
+def parse_interval(data):
+    """
+    Extract the stats of a test interval from an iperf3 json interval object.
+    Returns a dict of this format (stats not reported for the protocol used
+    are None):
+
+        { 'start': interval start (secs), 'end': interval end (secs),
+          'bytes': bytes transferred, 'mbps': throughput,
+          'retransmits': tcp retransmits (sender), 'cwnd_kbytes': tcp congestion
+          window (sender, sum of all streams), 'jitter_ms': udp jitter,
+          'packets': udp packets, 'lost_packets': udp lost packets,
+          'lost_percent': udp loss, 'omitted': True if an omitted interval }
+    """
+    interval_sum = data.get('sum', {})
+    streams = data.get('streams', [])
+
+    cwnd = [stream['snd_cwnd'] for stream in streams if 'snd_cwnd' in stream]
+
+    return {
+        'start': interval_sum.get('start', 0),
+        'end': interval_sum.get('end', 0),
+        'bytes': interval_sum.get('bytes', 0),
+        'mbps': interval_sum.get('bits_per_second', 0) / 1000000,
+        'retransmits': interval_sum.get('retransmits'),
+        'cwnd_kbytes': sum(cwnd) / 1024 if cwnd else None,
+        'jitter_ms': interval_sum.get('jitter_ms'),
+        'packets': interval_sum.get('packets'),
+        'lost_packets': interval_sum.get('lost_packets'),
+        'lost_percent': interval_sum.get('lost_percent'),
+        'omitted': interval_sum.get('omitted', False),
+    }
+
+
+class Iperf3Runner(object):
+    '''
+    A class to run an iperf3 client test as a subprocess
+    '''
+
+    def __init__(self, file_logger, iperf3_cmd=IPERF3_CMD):
+
+        self.file_logger = file_logger
+        self.iperf3_cmd = iperf3_cmd
+
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        '''
+        Stop a running test (may be called from another thread)
+        '''
+        self.cancel_event.set()
+
+    def _build_cmd(self, server_hostname, port, protocol, duration, bandwidth, blksize, streams, reverse, interval, json_stream):
+
+        cmd = [self.iperf3_cmd, '-c', server_hostname, '-p', str(port), '-t', str(duration),
+            '-i', str(interval), '-P', str(streams)]
+
+        if json_stream:
+            # flush each interval result as soon as it is available
+            cmd.extend(['--json-stream', '--forceflush'])
+        else:
+            cmd.append('-J')
+
+        if protocol == 'udp':
+            cmd.append('-u')
+
+        if bandwidth:
+            cmd.extend(['-b', str(bandwidth)])
+
+        if blksize:
+            cmd.extend(['-l', str(blksize)])
+
+        if reverse:
+            cmd.append('-R')
+        elif protocol == 'udp':
+            # the server receives, so only its intervals have jitter & loss
+            cmd.append('--get-server-output')
+
+        return cmd
+
+    def _parse_server_output(self, server_output):
+
+        if not isinstance(server_output, dict):
+            return []
+
+        return [parse_interval(interval_data) for interval_data in server_output.get('intervals', [])]
+
+    def _stop_process(self, process):
+
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def run(self, server_hostname, port=5201, protocol='tcp', duration=10, bandwidth=None, blksize=None,
+        streams=1, reverse=False, interval=1, timeout=None, on_interval=None):
+        '''
+        Run an iperf3 client test. Each interval result is passed to the
+        on_interval callback (if supplied) as it is received.
+
+        Returns an Iperf3Result object (check its error attribute for test
+        failures). If the test does not complete within the timeout (secs),
+        it is stopped & an error result is returned.
+        '''
+        self.cancel_event.clear()
+
+        if timeout is None:
+            timeout = max(60, duration + 20)
+
+        json_stream = supports_json_stream(self.iperf3_cmd)
+        cmd = self._build_cmd(server_hostname, port, protocol, duration, bandwidth, blksize, streams, reverse, interval, json_stream)
+
+        self.file_logger.debug("iperf3 command: {}".format(' '.join(cmd)))
+
+        intervals = []
+        server_intervals = []
+        end_data = None
+        error = ''
+
+        # raw json output (when --json-stream not supported)
+        json_output = b''
+
+        # partial line of --json-stream output
+        line_buffer = b''
+
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as err:
+            return Iperf3Result(protocol, intervals, end_data, "unable to run iperf3: {}".format(err))
+
+        stdout_fd = process.stdout.fileno()
+
+        selector = selectors.DefaultSelector()
+        selector.register(stdout_fd, selectors.EVENT_READ)
+
+        deadline = time.monotonic() + timeout
+
+        try:
+            while True:
+
+                if self.cancel_event.is_set():
+                    error = "test cancelled"
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    error = "test timed out ({}s)".format(timeout)
+                    break
+
+                # wake up regularly to check for cancellation
+                if not selector.select(min(remaining, 0.5)):
+                    continue
+
+                data = os.read(stdout_fd, 65536)
+
+                # end of output (iperf3 has exited)
+                if not data:
+                    break
+
+                if not json_stream:
+                    json_output += data
+                    continue
+
+                line_buffer += data
+                *lines, line_buffer = line_buffer.split(b'\n')
+
+                for line in lines:
+                    if not line.strip():
+                        continue
+
+                    try:
+                        message = json.loads(line.decode())
+                    except ValueError:
+                        self.file_logger.debug("Unable to parse iperf3 output: {}".format(line))
+                        continue
+
+                    event = message.get('event')
+
+                    if event == 'interval':
+                        interval_result = parse_interval(message.get('data', {}))
+                        intervals.append(interval_result)
+
+                        if on_interval:
+                            on_interval(interval_result)
+
+                    elif event == 'server_output_json':
+                        server_intervals = self._parse_server_output(message.get('data'))
+
+                    elif event == 'end':
+                        end_data = message.get('data', {})
+
+                    elif event == 'error':
+                        error = str(message.get('data', 'unknown error'))
+        finally:
+            selector.close()
+            self._stop_process(process)
+            process.stdout.close()
+
+        # parse the -J output
+        if json_output and not error:
+            try:
+                results = json.loads(json_output.decode())
+
+                error = results.get('error', '')
+                end_data = results.get('end', {})
+
+                for interval_data in results.get('intervals', []):
+                    interval_result = parse_interval(interval_data)
+                    intervals.append(interval_result)
+
+                    if on_interval:
+                        on_interval(interval_result)
+
+                server_intervals = self._parse_server_output(results.get('server_output_json'))
+
+            except ValueError as err:
+                error = "unable to parse iperf3 output: {}".format(err)
+
+        if not error and not end_data:
+            error = "no results returned by iperf3 (exit code: {})".format(process.returncode)
+
+        return Iperf3Result(protocol, intervals, end_data, error, server_intervals)
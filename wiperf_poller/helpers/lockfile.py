@@ -17,6 +17,9 @@ class LockFile(object):
         self.lock_file = lock_file
         self.file_logger = file_logger
 
+        # set when this process created the current lock file
+        self.lock_owned = False
+
     def lock_file_exists(self):
 
         if os.path.exists(self.lock_file):
@@ -49,6 +52,7 @@ class LockFile(object):
             time_now = int(time.time())
             with open(self.lock_file, 'w') as lockf:
                 lockf.write(str(time_now))
+            self.lock_owned = True
             return True
         except Exception as ex:
             self.file_logger.error("Issue writing lock file: {}, exiting...".format(ex))
@@ -64,6 +68,7 @@ class LockFile(object):
     def delete_lock_file(self):
         try:
             os.remove(self.lock_file)
+            self.lock_owned = False
             self.file_logger.info("removing lock file")
             return True
         except Exception as ex:
@@ -0,0 +1,401 @@
+"""
+Minimal netlink helpers - used to read wireless adapter info (nl80211 over
+generic netlink) and route lookups (rtnetlink) directly from the kernel,
+rather than running (and scraping the output of) iwconfig/iw/ip commands
+
+Only the small subset of netlink messages & attributes used by wiperf is
+supported.
+"""
+import os
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+
+# netlink message types & flags
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+
+# rtnetlink route messages & attributes (see linux/rtnetlink.h)
+RTM_GETROUTE = 26
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PREFSRC = 7
+
+# generic netlink controller
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# nl80211 commands & attributes (see linux/nl80211.h)
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_STATION = 17
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFNAME = 4
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_STA_INFO = 21
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_SSID = 52
+NL80211_ATTR_CHANNEL_WIDTH = 159
+NL80211_ATTR_CENTER_FREQ1 = 160
+
+NL80211_STA_INFO_RX_BYTES = 2
+NL80211_STA_INFO_TX_BYTES = 3
+NL80211_STA_INFO_SIGNAL = 7
+NL80211_STA_INFO_TX_BITRATE = 8
+NL80211_STA_INFO_RX_PACKETS = 9
+NL80211_STA_INFO_TX_PACKETS = 10
+NL80211_STA_INFO_TX_RETRIES = 11
+NL80211_STA_INFO_TX_FAILED = 12
+NL80211_STA_INFO_SIGNAL_AVG = 13
+NL80211_STA_INFO_RX_BITRATE = 14
+NL80211_STA_INFO_RX_BYTES64 = 23
+NL80211_STA_INFO_TX_BYTES64 = 24
+
+NL80211_RATE_INFO_BITRATE = 1
+NL80211_RATE_INFO_MCS = 2
+NL80211_RATE_INFO_BITRATE32 = 5
+NL80211_RATE_INFO_VHT_MCS = 6
+NL80211_RATE_INFO_HE_MCS = 13
+
+# nl80211_chan_width enum values -> width (MHz)
+CHANNEL_WIDTHS = {
+    0: 20,   # 20 MHz, non-HT
+    1: 20,
+    2: 40,
+    3: 80,
+    4: 160,  # 80+80 MHz
+    5: 160,
+    6: 5,
+    7: 10,
+}
+
+
+class NetlinkError(Exception):
+    pass
+
+
+def _pad(length):
+    return (length + 3) & ~3
+
+def pack_attr(attr_type, payload):
+    """
+    Pack a netlink attribute (payload must be bytes)
+    """
+    length = 4 + len(payload)
+    return struct.pack("=HH", length, attr_type) + payload + b'\x00' * (_pad(length) - length)
+
+def parse_attrs(data):
+    """
+    Parse a block of netlink attributes in to a dict: {attr type: payload}
+    """
+    attrs = {}
+    offset = 0
+
+    while offset + 4 <= len(data):
+        length, attr_type = struct.unpack_from("=HH", data, offset)
+
+        if length < 4:
+            break
+
+        # mask off the nested/byte order flags
+        attrs[attr_type & 0x3fff] = data[offset + 4:offset + length]
+        offset += _pad(length)
+
+    return attrs
+
+def attr_u8(attrs, attr_type, signed=False):
+    if attr_type not in attrs:
+        return None
+    return struct.unpack("=b" if signed else "=B", attrs[attr_type][:1])[0]
+
+def attr_u16(attrs, attr_type):
+    if attr_type not in attrs:
+        return None
+    return struct.unpack("=H", attrs[attr_type][:2])[0]
+
+def attr_u32(attrs, attr_type):
+    if attr_type not in attrs:
+        return None
+    return struct.unpack("=I", attrs[attr_type][:4])[0]
+
+def attr_u64(attrs, attr_type):
+    if attr_type not in attrs:
+        return None
+    return struct.unpack("=Q", attrs[attr_type][:8])[0]
+
+
+class NetlinkSocket(object):
+    '''
+    A class to send netlink requests & collect the responses
+    '''
+
+    def __init__(self, protocol):
+
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+        self.sock.bind((0, 0))
+        self.sock.settimeout(2)
+        self.seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, msg_type, payload, dump=False):
+        '''
+        Send a request & return a list of the message bodies of each reply
+        '''
+        self.seq += 1
+
+        flags = NLM_F_REQUEST | NLM_F_ACK
+        if dump:
+            flags |= NLM_F_DUMP
+
+        header = struct.pack("=IHHII", 16 + len(payload), msg_type, flags, self.seq, 0)
+
+        self.sock.send(header + payload)
+
+        replies = []
+
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+
+            while offset + 16 <= len(data):
+                length, reply_type, _flags, seq, _pid = struct.unpack_from("=IHHII", data, offset)
+
+                if length < 16:
+                    return replies
+
+                body = data[offset + 16:offset + length]
+                offset += _pad(length)
+
+                if seq != self.seq:
+                    continue
+
+                if reply_type == NLMSG_DONE:
+                    return replies
+
+                if reply_type == NLMSG_ERROR:
+                    error = struct.unpack_from("=i", body)[0]
+
+                    # error 0 is the ack of our request (end of non-dump replies)
+                    if error == 0:
+                        return replies
+
+                    raise NetlinkError("Netlink request error: {}".format(os.strerror(-error)))
+
+                replies.append(body)
+
+
+class GenericNetlink(NetlinkSocket):
+    '''
+    A class to send generic netlink requests & collect the responses
+    '''
+
+    def __init__(self, family_name):
+
+        super().__init__(NETLINK_GENERIC)
+
+        try:
+            self.family_id = self._resolve_family(family_name)
+        except Exception:
+            self.close()
+            raise
+
+    def _resolve_family(self, family_name):
+
+        attrs = pack_attr(CTRL_ATTR_FAMILY_NAME, family_name.encode() + b'\x00')
+        replies = self.request(GENL_ID_CTRL, CTRL_CMD_GETFAMILY, attrs)
+
+        for reply in replies:
+            family_id = attr_u16(reply, CTRL_ATTR_FAMILY_ID)
+            if family_id is not None:
+                return family_id
+
+        raise NetlinkError("Unable to resolve generic netlink family: {}".format(family_name))
+
+    def request(self, msg_type, cmd, attrs=b'', dump=False):
+        '''
+        Send a request & return a list of the attributes (dicts) of each reply
+        '''
+        payload = struct.pack("=BBH", cmd, 1, 0) + attrs
+        replies = super().request(msg_type, payload, dump)
+
+        # skip the generic netlink header of each reply
+        return [parse_attrs(body[4:]) for body in replies]
+
+
+class RtNetlink(NetlinkSocket):
+    '''
+    A class to look up routes using rtnetlink
+    '''
+
+    def __init__(self):
+
+        super().__init__(NETLINK_ROUTE)
+
+    def get_route(self, ip_address):
+        '''
+        Get the route the kernel will use to reach an IPv4/IPv6 address (as
+        "ip route get" does). Returns a dict with the following keys (values
+        are None if not available):
+
+            dev (interface name), gateway, src (preferred source address)
+        '''
+        family = socket.AF_INET6 if ':' in ip_address else socket.AF_INET
+        dst = socket.inet_pton(family, ip_address)
+
+        # struct rtmsg: family, dst_len, src_len, tos, table, protocol, scope, type, flags
+        payload = struct.pack("=BBBBBBBBI", family, len(dst) * 8, 0, 0, 0, 0, 0, 0, 0)
+        payload += pack_attr(RTA_DST, dst)
+
+        replies = super().request(RTM_GETROUTE, payload)
+
+        if not replies:
+            raise NetlinkError("No route returned for: {}".format(ip_address))
+
+        # skip the rtmsg header of the reply
+        attrs = parse_attrs(replies[0][12:])
+
+        dev = None
+        oif = attr_u32(attrs, RTA_OIF)
+        if oif is not None:
+            dev = socket.if_indextoname(oif)
+
+        gateway = None
+        if RTA_GATEWAY in attrs:
+            gateway = socket.inet_ntop(family, attrs[RTA_GATEWAY])
+
+        src = None
+        if RTA_PREFSRC in attrs:
+            src = socket.inet_ntop(family, attrs[RTA_PREFSRC])
+
+        return {
+            'dev': dev,
+            'gateway': gateway,
+            'src': src,
+        }
+
+
+def _rate_info(data):
+    """
+    Extract the bitrate (Mbps) & MCS from a nested nl80211 rate info attribute
+    """
+    attrs = parse_attrs(data)
+
+    bitrate = attr_u32(attrs, NL80211_RATE_INFO_BITRATE32)
+    if bitrate is None:
+        bitrate = attr_u16(attrs, NL80211_RATE_INFO_BITRATE)
+
+    mcs = None
+    for attr_type in (NL80211_RATE_INFO_MCS, NL80211_RATE_INFO_VHT_MCS, NL80211_RATE_INFO_HE_MCS):
+        mcs = attr_u8(attrs, attr_type)
+        if mcs is not None:
+            break
+
+    # (bitrate is supplied in units of 100kbps)
+    return (bitrate / 10.0 if bitrate is not None else None, mcs)
+
+
+def _counter(attrs, attr_type_64, attr_type_32):
+    """
+    Return the 64 bit version of a counter if available, otherwise the 32 bit version
+    """
+    value = attr_u64(attrs, attr_type_64)
+    if value is None:
+        value = attr_u32(attrs, attr_type_32)
+
+    return value
+
+
+class Nl80211(object):
+    '''
+    A class to read wireless interface & station info using nl80211
+    '''
+
+    def __init__(self):
+
+        self.genl = GenericNetlink('nl80211')
+
+    def close(self):
+        self.genl.close()
+
+    def get_interface(self, if_name):
+        '''
+        Get wireless interface info. Returns a dict with the following keys
+        (values are None if not available):
+
+            ssid, freq (MHz), center_freq (MHz), channel_width (MHz)
+        '''
+        attrs = pack_attr(NL80211_ATTR_IFINDEX, struct.pack("=I", socket.if_nametoindex(if_name)))
+        replies = self.genl.request(self.genl.family_id, NL80211_CMD_GET_INTERFACE, attrs)
+
+        if not replies:
+            raise NetlinkError("No interface info returned for: {}".format(if_name))
+
+        reply = replies[0]
+
+        ssid = None
+        if NL80211_ATTR_SSID in reply:
+            ssid = reply[NL80211_ATTR_SSID].decode('utf-8', 'replace')
+
+        channel_width = attr_u32(reply, NL80211_ATTR_CHANNEL_WIDTH)
+
+        return {
+            'ssid': ssid,
+            'freq': attr_u32(reply, NL80211_ATTR_WIPHY_FREQ),
+            'center_freq': attr_u32(reply, NL80211_ATTR_CENTER_FREQ1),
+            'channel_width': CHANNEL_WIDTHS.get(channel_width) if channel_width is not None else None,
+        }
+
+    def get_station(self, if_name):
+        '''
+        Get info about the station (AP) the wireless interface is associated
+        with. Returns None if not associated, otherwise a dict with the
+        following keys (values are None if not available):
+
+            bssid, signal (dBm), signal_avg (dBm), tx_bitrate (Mbps), rx_bitrate (Mbps),
+            tx_mcs, rx_mcs, tx_retries, tx_failed, tx_packets, rx_packets, tx_bytes, rx_bytes
+        '''
+        attrs = pack_attr(NL80211_ATTR_IFINDEX, struct.pack("=I", socket.if_nametoindex(if_name)))
+        replies = self.genl.request(self.genl.family_id, NL80211_CMD_GET_STATION, attrs, dump=True)
+
+        for reply in replies:
+
+            if NL80211_ATTR_MAC not in reply or NL80211_ATTR_STA_INFO not in reply:
+                continue
+
+            sta_info = parse_attrs(reply[NL80211_ATTR_STA_INFO])
+
+            tx_bitrate, tx_mcs = (None, None)
+            if NL80211_STA_INFO_TX_BITRATE in sta_info:
+                tx_bitrate, tx_mcs = _rate_info(sta_info[NL80211_STA_INFO_TX_BITRATE])
+
+            rx_bitrate, rx_mcs = (None, None)
+            if NL80211_STA_INFO_RX_BITRATE in sta_info:
+                rx_bitrate, rx_mcs = _rate_info(sta_info[NL80211_STA_INFO_RX_BITRATE])
+
+            return {
+                'bssid': ':'.join(['{:02x}'.format(octet) for octet in reply[NL80211_ATTR_MAC][:6]]),
+                'signal': attr_u8(sta_info, NL80211_STA_INFO_SIGNAL, signed=True),
+                'signal_avg': attr_u8(sta_info, NL80211_STA_INFO_SIGNAL_AVG, signed=True),
+                'tx_bitrate': tx_bitrate,
+                'rx_bitrate': rx_bitrate,
+                'tx_mcs': tx_mcs,
+                'rx_mcs': rx_mcs,
+                'tx_retries': attr_u32(sta_info, NL80211_STA_INFO_TX_RETRIES),
+                'tx_failed': attr_u32(sta_info, NL80211_STA_INFO_TX_FAILED),
+                'tx_packets': attr_u32(sta_info, NL80211_STA_INFO_TX_PACKETS),
+                'rx_packets': attr_u32(sta_info, NL80211_STA_INFO_RX_PACKETS),
+                'tx_bytes': _counter(sta_info, NL80211_STA_INFO_TX_BYTES64, NL80211_STA_INFO_TX_BYTES),
+                'rx_bytes': _counter(sta_info, NL80211_STA_INFO_RX_BYTES64, NL80211_STA_INFO_RX_BYTES),
+            }
+
+        return None
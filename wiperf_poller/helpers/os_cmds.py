@@ -52,6 +52,7 @@ OS_OPT_CMDS = {
     #'GREP_CMD': _find_cmd('/bin/grep'),
     #'WPA_CMD': _find_cmd('/sbin/wpa_cli'),
     'LIBRESPEED_CMD': _find_cmd('/usr/local/bin/librespeed-cli'),
+    'IPERF3_CMD': _find_cmd('/usr/bin/iperf3'),
 }
 
 # define exportable vars
@@ -77,6 +78,7 @@ UMOUNT_CMD = OS_OPT_CMDS['UMOUNT_CMD']
 #GREP_CMD = OS_OPT_CMDS['GREP_CMD']
 #WPA_CMD = OS_OPT_CMDS['WPA_CMD']
 LIBRESPEED_CMD = OS_OPT_CMDS['LIBRESPEED_CMD']
+IPERF3_CMD = OS_OPT_CMDS['IPERF3_CMD']
 
 def check_os_cmds(file_logger):
     """
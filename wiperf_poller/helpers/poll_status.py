@@ -24,6 +24,7 @@ class PollStatus():
             'http': 'N/A',
             'iperf_tcp': 'N/A',
             'iperf_udp': 'N/A',
+            'iperf_matrix': 'N/A',
             'dhcp': 'N/A',
             'smb': 'N/A',
             'auth': 'N/A',
@@ -57,6 +58,9 @@ class PollStatus():
     def iperf_udp(self, value):
         self.status_dict['iperf_udp'] = str(value)
     
+    def iperf_matrix(self, value):
+        self.status_dict['iperf_matrix'] = str(value)
+    
     def dhcp(self, value):
         self.status_dict['dhcp'] = str(value)
     
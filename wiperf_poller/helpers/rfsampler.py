@@ -0,0 +1,304 @@
+"""
+RF sampler - samples the wireless adapter stats (signal level, bit rates,
+MCS & tx retries) in a background thread at a configurable rate, so that
+signal dips & roaming events between poll cycles are not missed. Samples
+are held in fixed-size ring buffers (arrays, rather than lists of dicts) and
+a summary of the samples (plus any BSSID changes seen) is exported once per
+poll cycle.
+"""
+import array
+import math
+import threading
+import time
+from wiperf_poller.helpers.icmp import percentile
+from wiperf_poller.helpers.timefunc import get_timestamp
+
+# value stored in ring buffers when a stat is not available for a sample
+NO_VALUE = float('nan')
+
+class RingBuffer(object):
+
+    '''
+    A fixed-size ring buffer of numeric values, backed by an array
+    '''
+
+    def __init__(self, size, typecode='d'):
+
+        self.size = max(int(size), 1)
+        self.values = array.array(typecode, [0] * self.size)
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def clear(self):
+
+        self.index = 0
+        self.count = 0
+
+    def get_values(self):
+        '''
+        Return a list of the values held (oldest first)
+        '''
+        start = (self.index - self.count) % self.size
+
+        if start + self.count <= self.size:
+            return self.values[start:start + self.count].tolist()
+
+        return self.values[start:].tolist() + self.values[:self.index].tolist()
+
+
+def sample_stats(values):
+    """
+    Calculate min/max/mean/p5/p50/p95 of a list of samples (samples that are
+    not available are ignored). Returns None if there are no valid samples.
+    """
+    ordered = sorted([value for value in values if not math.isnan(value)])
+
+    if not ordered:
+        return None
+
+    return {
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': sum(ordered) / len(ordered),
+        'p5': percentile(ordered, 5),
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+    }
+
+def counter_delta(values):
+    """
+    Return the total increase of a counter across a list of samples (allowing
+    for counter resets, e.g. after a re-association)
+    """
+    values = [value for value in values if not math.isnan(value)]
+    delta = 0
+
+    for i in range(1, len(values)):
+        if values[i] >= values[i - 1]:
+            delta += values[i] - values[i - 1]
+        else:
+            delta += values[i]
+
+    return int(delta)
+
+
+class RfSampler(object):
+
+    '''
+    A class to sample wireless adapter stats in a background thread
+    '''
+
+    # stats sampled: (results field prefix, station stats key)
+    STATS = [
+        ('signal_level_dbm', 'signal'),
+        ('tx_rate_mbps', 'tx_bitrate'),
+        ('rx_rate_mbps', 'rx_bitrate'),
+        ('tx_mcs', 'tx_mcs'),
+        ('rx_mcs', 'rx_mcs'),
+    ]
+
+    def __init__(self, adapter_obj, config_vars, file_logger):
+
+        self.adapter_obj = adapter_obj
+        self.config_vars = config_vars
+        self.file_logger = file_logger
+
+        self.interval = max(float(config_vars['rf_sample_interval']), 0.1)
+        buffer_size = int(config_vars['rf_sample_buffer_size'])
+
+        self.buffers = {}
+        for _field, key in self.STATS:
+            self.buffers[key] = RingBuffer(buffer_size)
+        self.retries_buffer = RingBuffer(buffer_size)
+
+        # BSSID changes seen since last dump: [(time, old bssid, new bssid, signal level)]
+        self.bssid = ''
+        self.bssid_changes = []
+        self.max_bssid_changes = buffer_size
+
+        self.sample_errors = 0
+        self.window_start = time.time()
+
+        # samples are added by the sampler thread & read by the poll cycle
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def is_running(self):
+
+        return bool(self.thread) and self.thread.is_alive()
+
+    def start(self):
+        '''
+        Start sampling (does nothing if already running)
+        '''
+        if self.is_running():
+            return
+
+        self.file_logger.info("Starting RF sampler (interval: {}s)".format(self.interval))
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='rf-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop sampling
+        '''
+        if not self.thread:
+            return
+
+        self.stop_event.set()
+        self.thread.join(timeout=self.interval + 5)
+        self.thread = None
+
+        self.adapter_obj.close_station_stats()
+
+    def _run(self):
+
+        next_sample = time.monotonic()
+
+        while not self.stop_event.is_set():
+
+            self.sample()
+
+            # keep to a fixed sample rate, skipping samples if we fall behind
+            next_sample += self.interval
+            now = time.monotonic()
+            if next_sample < now:
+                next_sample = now + self.interval
+
+            self.stop_event.wait(next_sample - now)
+
+    def sample(self):
+        '''
+        Take a sample of the wireless adapter stats
+        '''
+        try:
+            stats = self.adapter_obj.get_station_stats()
+        except Exception as ex:
+            stats = None
+            self.file_logger.debug("RF sampler error: {}".format(ex))
+
+        now = time.time()
+
+        with self.lock:
+
+            if stats is None:
+                self.sample_errors += 1
+                return
+
+            for _field, key in self.STATS:
+                value = stats.get(key)
+                self.buffers[key].append(NO_VALUE if value is None else value)
+
+            retries = stats.get('tx_retries')
+            self.retries_buffer.append(NO_VALUE if retries is None else retries)
+
+            bssid = stats.get('bssid')
+            if bssid:
+                if self.bssid and (bssid != self.bssid) and (len(self.bssid_changes) < self.max_bssid_changes):
+                    self.bssid_changes.append((now, self.bssid, bssid, stats.get('signal')))
+                self.bssid = bssid
+
+    def get_summary(self, reset=True):
+        '''
+        Return a summary of the samples taken since the last summary as a
+        tuple: (summary dict, list of bssid changes). The sample buffers are
+        cleared unless reset is False.
+        '''
+        with self.lock:
+
+            summary = {
+                'time': get_timestamp(self.config_vars),
+                'sample_count': self.buffers['signal'].count,
+                'sample_errors': self.sample_errors,
+                'window_secs': int(time.time() - self.window_start),
+                'bssid': self.bssid,
+                'bssid_changes': len(self.bssid_changes),
+            }
+
+            for field, key in self.STATS:
+                stats = sample_stats(self.buffers[key].get_values())
+
+                if stats is None:
+                    continue
+
+                for stat_name in ['min', 'max', 'mean', 'p5', 'p50', 'p95']:
+                    summary['{}_{}'.format(field, stat_name)] = round(stats[stat_name], 2)
+
+            summary['tx_retries'] = counter_delta(self.retries_buffer.get_values())
+
+            bssid_changes = list(self.bssid_changes)
+
+            if reset:
+                # keep the last retries sample, so that the retries between
+                # this window & the next are counted
+                last_retries = self.retries_buffer.get_values()[-1:]
+
+                for buffer in self.buffers.values():
+                    buffer.clear()
+                self.retries_buffer.clear()
+                for retries in last_retries:
+                    self.retries_buffer.append(retries)
+
+                self.bssid_changes = []
+                self.sample_errors = 0
+                self.window_start = time.time()
+
+        return (summary, bssid_changes)
+
+    def dump(self, exporter_obj):
+        '''
+        Send a summary of the samples taken (& any BSSID changes) to the mgt
+        platform
+        '''
+        summary, bssid_changes = self.get_summary()
+
+        self.file_logger.info("########## rf samples ##########")
+
+        if not summary['sample_count']:
+            self.file_logger.warning("No RF samples available to report.")
+            return False
+
+        summary['location'] = self.config_vars['location']
+
+        self.file_logger.info("RF sample summary: {}".format(summary))
+
+        column_headers = list(summary.keys())
+        data_file = self.config_vars['rf_data_file']
+        test_name = "RF Samples"
+
+        if not exporter_obj.send_results(self.config_vars, summary, column_headers, data_file, test_name, self.file_logger):
+            self.file_logger.error("Issue sending RF sample summary.")
+            return False
+
+        data_file = self.config_vars['rf_roam_data_file']
+        test_name = "RF BSSID Changes"
+
+        for change_time, old_bssid, new_bssid, signal_level in bssid_changes:
+
+            self.file_logger.info("BSSID change: {} -> {}".format(old_bssid, new_bssid))
+
+            results_dict = {
+                'time': get_timestamp(self.config_vars, change_time),
+                'old_bssid': old_bssid,
+                'new_bssid': new_bssid,
+                'signal_level_dbm': signal_level if signal_level is not None else 'NA',
+                'location': self.config_vars['location'],
+            }
+
+            column_headers = list(results_dict.keys())
+
+            if not exporter_obj.send_results(self.config_vars, results_dict, column_headers, data_file, test_name, self.file_logger):
+                self.file_logger.error("Issue sending BSSID change event.")
+                return False
+
+        self.file_logger.info("RF sample summary sent.")
+        return True
@@ -1,10 +1,105 @@
 
 from socket import gethostbyname
+import errno
+import fcntl
+import socket
+import struct
 import subprocess
 import re
 import sys
+import threading
+from wiperf_poller.helpers.netlink import RtNetlink, NetlinkError
 from wiperf_poller.helpers.os_cmds import IP_CMD
 
+
+class RouteCache(object):
+
+    '''
+    A class to look up (& cache) the route the kernel will use to reach a
+    destination. Routes are looked up using rtnetlink, with a fallback to the
+    "ip route get" command if rtnetlink is not available.
+
+    The cache is cleared at the start of each poll cycle and whenever we
+    modify the routing table (route injection).
+    '''
+
+    def __init__(self):
+
+        # cached routes: {(ip version, ip address): route detail}
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        '''
+        Clear all cached routes
+        '''
+        with self.lock:
+            self.routes = {}
+
+    def _netlink_route(self, ip_address):
+
+        rtnetlink = RtNetlink()
+
+        try:
+            route = rtnetlink.get_route(ip_address)
+        finally:
+            rtnetlink.close()
+
+        # format route in the same way as "ip route get"
+        route_detail = ip_address
+        if route['gateway']:
+            route_detail += " via {}".format(route['gateway'])
+        if route['dev']:
+            route_detail += " dev {}".format(route['dev'])
+        if route['src']:
+            route_detail += " src {}".format(route['src'])
+
+        return route_detail
+
+    def _cmd_route(self, ip_address, file_logger, ip_ver):
+
+        # get specific route details of path that will be used by kernel (cannot be used to modify routing entry)
+        ip_route_cmd = "{} {} route get ".format(IP_CMD, ip_ver) + ip_address + " | head -n 1"
+
+        try:
+            route_detail = subprocess.check_output(ip_route_cmd, stderr=subprocess.STDOUT, shell=True).decode()
+            return route_detail.strip()
+        except subprocess.CalledProcessError as exc:
+            output = exc.output.decode()
+            file_logger.error("  Issue looking up route (route cmd syntax?): {} (command used: {})".format(str(output), ip_route_cmd))
+            return ''
+
+    def get_route(self, ip_address, file_logger, ip_ver=''):
+        '''
+        Return the route that will be used to reach an IP address, in the
+        format: <ip address> via <gateway> dev <interface> src <source address>
+        (empty string if the route cannot be determined)
+        '''
+        key = (ip_ver, ip_address)
+
+        with self.lock:
+            if key in self.routes:
+                return self.routes[key]
+
+        try:
+            route_detail = self._netlink_route(ip_address)
+        except (NetlinkError, OSError, ValueError) as err:
+            file_logger.debug("  Unable to look up route using rtnetlink ({}), using ip command".format(err))
+            route_detail = self._cmd_route(ip_address, file_logger, ip_ver)
+
+        # do not cache failed lookups
+        if route_detail:
+            with self.lock:
+                self.routes[key] = route_detail
+
+        return route_detail
+
+# single route cache shared by all testers
+route_cache = RouteCache()
+
+def clear_route_cache():
+    route_cache.clear()
+
 def is_ipv4(ip_address):
     """
     Check if an address is in ivp4 format
@@ -25,6 +120,14 @@ def _ipv4_find_gateway(interface_name, file_logger):
     # a gateway for each interface to use in static
     # route entries (assuming they exist)
 
+    # read the routing table directly from the kernel if we can
+    try:
+        gateway = get_default_gateway(interface_name)
+        file_logger.info("  Checked gateway for interface : {}. Result: {}".format(interface_name, gateway))
+        return gateway if gateway else ''
+    except (OSError, ValueError, StopIteration) as err:
+        file_logger.debug("  Unable to read routing table ({}), using ip command".format(err))
+
     # get routing table, otherwise show route that will actually be chosen by kernel
     #
     # extract with grep & cut from line of this format:
@@ -41,6 +144,56 @@ def _ipv4_find_gateway(interface_name, file_logger):
         return ''
 
 
+def get_interface_ipv4(interface_name):
+    """
+    Get the (primary) IPv4 address of an interface directly from the kernel
+    (SIOCGIFADDR ioctl). Returns None if the interface has no IPv4 address.
+    """
+    SIOCGIFADDR = 0x8915
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack('256s', interface_name[:15].encode()))
+        except OSError as err:
+            if err.errno == errno.EADDRNOTAVAIL:
+                return None
+            raise
+
+    return socket.inet_ntoa(ifreq[20:24])
+
+
+def get_default_gateway(interface_name, route_file='/proc/net/route'):
+    """
+    Get the IPv4 default gateway of an interface from the kernel routing table
+    (/proc/net/route). If there is more than one default route entry for the
+    interface, the gateway of the entry with the lowest metric is returned.
+    Returns None if there is no default route via the interface.
+    """
+    gateways = []
+
+    with open(route_file, 'r') as routes:
+        # skip header line
+        next(routes)
+
+        for line in routes:
+            fields = line.split()
+
+            if len(fields) < 8 or fields[0] != interface_name:
+                continue
+
+            # Iface, Destination, Gateway, Flags, RefCnt, Use, Metric, Mask (hex, host byte order)
+            if int(fields[1], 16) != 0 or int(fields[7], 16) != 0:
+                continue
+
+            gateway = socket.inet_ntoa(struct.pack("=I", int(fields[2], 16)))
+            gateways.append((int(fields[6]), gateway))
+
+    if not gateways:
+        return None
+
+    return sorted(gateways)[0][1]
+
+
 def resolve_name(hostname, file_logger):
     """
     if hostname passed, DNS lookup, otherwise, return unchanged IP address
@@ -73,21 +226,18 @@ def get_test_traffic_interface(config_vars, file_logger):
 def get_first_ipv4_route_to_dest(ip_address, file_logger, ip_ver=''):
     """
     Check the routes to a specific ip destination & return first entry
+    (routes are cached until the cache is cleared)
     """
 
     ip_address = resolve_name(ip_address, file_logger)
 
-    # get specific route details of path that will be used by kernel (cannot be used to modify routing entry)
-    ip_route_cmd = "{} {} route get ".format(IP_CMD, ip_ver) + ip_address + " | head -n 1"
-
-    try:
-        route_detail = subprocess.check_output(ip_route_cmd, stderr=subprocess.STDOUT, shell=True).decode()
-        file_logger.info("  Checked interface route to : {}. Result: {}".format(ip_address, route_detail.strip()))
-        return route_detail.strip()
-    except subprocess.CalledProcessError as exc:
-        output = exc.output.decode()
-        file_logger.error("  Issue looking up route (route cmd syntax?): {} (command used: {})".format(str(output), ip_route_cmd))
+    if not ip_address:
         return ''
+
+    route_detail = route_cache.get_route(ip_address, file_logger, ip_ver)
+    file_logger.info("  Checked interface route to : {}. Result: {}".format(ip_address, route_detail))
+
+    return route_detail
         
 def get_first_ipv6_route_to_dest(ip_address, file_logger):
     """
@@ -214,6 +364,9 @@ def inject_default_route(ip_address, config_vars, file_logger):
         file_logger.error('  [Route Injection] Route is not a default route entry...cannot resolve this routing issue: {}'.format(route_to_dest))
         return False
   
+    # routing table is about to change, so cached routes will no longer be valid
+    route_cache.clear()
+
     # delete and re-add route with a new metric
     try:
         del_route_cmd = "{} route del ".format(IP_CMD) + route_to_dest
@@ -247,6 +400,9 @@ def inject_default_route(ip_address, config_vars, file_logger):
         file_logger.error('  [Route Injection] Route addition failed!')
         return False
 
+    # routing table changed, so cached routes are no longer valid
+    route_cache.clear()
+
     file_logger.info("  [Route Injection] Route injection complete")
     return True
 
@@ -282,6 +438,9 @@ def _inject_static_route(ip_address, req_interface, traffic_type, file_logger, i
         output = proc_exc.output.decode()
         file_logger.error('  [Route Injection] Route addition ({})failed! ({})'.format(traffic_type, output))
         return False
+    finally:
+        # routing table (may have) changed, so cached routes are no longer valid
+        route_cache.clear()
 
     file_logger.info("  [Route Injection] Route injection ({})complete".format(traffic_type))
     return True
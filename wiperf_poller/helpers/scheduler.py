@@ -0,0 +1,77 @@
+"""
+Scheduler class - used in daemon mode to run poll cycles at the same
+times that cron would have launched the poller
+"""
+import time
+
+class Scheduler(object):
+
+    '''
+    A class to schedule poll cycles every test_interval minutes (offset by
+    test_offset minutes), aligned to the local wall clock in the same way
+    as a cron entry of the form: <offset>-59/<interval> * * * *
+    '''
+
+    def __init__(self, test_interval, test_offset, file_logger):
+
+        self.file_logger = file_logger
+        self.stop_requested = False
+
+        self.interval = 0
+        self.offset = 0
+        self.set_timing(test_interval, test_offset)
+
+    def set_timing(self, test_interval, test_offset):
+        '''
+        Set the cycle interval & offset (both supplied in minutes)
+        '''
+        self.interval = max(int(test_interval), 1) * 60
+        self.offset = (int(test_offset) * 60) % self.interval
+
+        self.file_logger.debug("Scheduler timing: interval {}s, offset {}s".format(self.interval, self.offset))
+
+    def next_run_time(self, now=None):
+        '''
+        Return the epoch time of the next poll cycle slot after 'now'
+        '''
+        if now is None:
+            now = time.time()
+
+        # align slots to local time (as cron does), not UTC
+        utc_offset = time.localtime(now).tm_gmtoff
+        local_now = now + utc_offset
+
+        next_slot = ((local_now - self.offset) // self.interval + 1) * self.interval + self.offset
+
+        return next_slot - utc_offset
+
+    def wait_for_next_run(self):
+        '''
+        Sleep until the next poll cycle slot is due. If a cycle overran, any
+        slots missed are skipped rather than run back to back.
+
+        Returns False if a stop was requested while waiting.
+        '''
+        next_run = self.next_run_time()
+
+        self.file_logger.info("Next poll cycle scheduled for: {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(next_run))))
+
+        while not self.stop_requested:
+
+            remaining = next_run - time.time()
+
+            if remaining <= 0:
+                return True
+
+            # sleep in short steps so that we respond promptly to a stop request
+            time.sleep(min(remaining, 1))
+
+        return False
+
+    def stop(self, signum=None, frame=None):
+        '''
+        Request that the scheduler stops (may be used as a signal handler)
+        '''
+        self.file_logger.info("Stop requested for scheduler (signal: {})".format(signum))
+        self.stop_requested = True
@@ -0,0 +1,249 @@
+"""
+SMB test engine - reads (or writes) files over SMB2/3 using the smbprotocol
+module, rather than mounting the share & copying the file with OS commands.
+Files are read in to a re-used buffer & discarded (nothing is written to the
+local filesystem), so the transfer time is not affected by local disk or
+page cache performance. Several files may be transferred concurrently, and
+the throughput of each chunk of each file is recorded.
+"""
+import os
+import threading
+import time
+
+# module import vars
+smb_modules = True
+import_err = ''
+
+try:
+    import smbclient
+except ImportError as error:
+    smb_modules = False
+    import_err = error
+
+# size of each read/write & of each chunk the throughput is measured over (bytes)
+CHUNK_SIZE = 1024 * 1024
+
+def _mbps(byte_count, secs):
+
+    # (same units as the mount & copy SMB test)
+    return ((byte_count * 8) / secs) / 1024 / 1024 if secs > 0 else 0.0
+
+
+class SmbTransfer(object):
+    '''
+    Progress of the transfer of a single file
+    '''
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.bytes = 0
+        self.chunk_rates = []
+        self.start_time = None
+        self.end_time = None
+        self.error = ''
+
+        self.chunk_bytes = 0
+        self.chunk_start = None
+
+    def start(self):
+
+        self.start_time = time.monotonic()
+        self.chunk_start = self.start_time
+
+    def add(self, byte_count, final=False):
+
+        self.bytes += byte_count
+        self.chunk_bytes += byte_count
+
+        if self.chunk_bytes >= CHUNK_SIZE or (final and self.chunk_bytes):
+            now = time.monotonic()
+            self.chunk_rates.append(_mbps(self.chunk_bytes, now - self.chunk_start))
+            self.chunk_bytes = 0
+            self.chunk_start = now
+
+    def finish(self):
+
+        self.add(0, final=True)
+        self.end_time = time.monotonic()
+
+
+class SmbEngine(object):
+    '''
+    A class to perform SMB read & write tests using the smbprotocol module
+    '''
+
+    def __init__(self, file_logger, host, username, password, port=445, timeout=60, require_signing=True):
+
+        self.file_logger = file_logger
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = int(port)
+        self.timeout = timeout
+        self.require_signing = require_signing
+
+        # connections used by this engine only (not shared with other tests)
+        self.connection_cache = {}
+        self.deadline = None
+
+    def _smb_args(self):
+
+        return {'port': self.port, 'connection_cache': self.connection_cache}
+
+    def _unc_path(self, path, filename):
+
+        # path format as used for mounting: /share/dir
+        path = path.strip('/').replace('/', '\\')
+
+        return '\\\\{}\\{}\\{}'.format(self.host, path, filename)
+
+    def connect(self):
+        '''
+        Connect & authenticate to the SMB server - returns False on failure
+        '''
+        try:
+            smbclient.register_session(self.host, username=self.username, password=self.password,
+                connection_timeout=self.timeout, require_signing=self.require_signing, **self._smb_args())
+        except Exception as ex:
+            self.file_logger.error("Unable to connect to SMB server {}: {}".format(self.host, ex))
+            return False
+
+        return True
+
+    def close(self):
+
+        try:
+            smbclient.reset_connection_cache(connection_cache=self.connection_cache)
+        except Exception as ex:
+            self.file_logger.debug("Error closing SMB connection to {}: {}".format(self.host, ex))
+
+    def _timed_out(self):
+
+        return time.monotonic() > self.deadline
+
+    def _read_file(self, unc_path, transfer):
+
+        buffer = bytearray(CHUNK_SIZE)
+
+        try:
+            with smbclient.open_file(unc_path, mode='rb', buffering=0, **self._smb_args()) as smb_file:
+
+                transfer.start()
+
+                while True:
+                    byte_count = smb_file.readinto(buffer)
+                    if not byte_count:
+                        break
+
+                    transfer.add(byte_count)
+
+                    if self._timed_out():
+                        transfer.error = "timed out"
+                        return
+
+                transfer.finish()
+
+        except Exception as ex:
+            transfer.error = str(ex)
+
+    def _write_file(self, unc_path, transfer, size):
+
+        data = memoryview(os.urandom(CHUNK_SIZE))
+
+        try:
+            # (mode 'x' - a new file is always created for the test)
+            with smbclient.open_file(unc_path, mode='xb', buffering=0, **self._smb_args()) as smb_file:
+
+                transfer.start()
+
+                while transfer.bytes < size:
+                    byte_count = smb_file.write(data[:min(CHUNK_SIZE, size - transfer.bytes)])
+                    transfer.add(byte_count)
+
+                    if self._timed_out():
+                        transfer.error = "timed out"
+                        break
+
+            if not transfer.error:
+                transfer.finish()
+
+        except Exception as ex:
+            transfer.error = str(ex)
+
+        # remove the test file
+        try:
+            smbclient.remove(unc_path, **self._smb_args())
+        except Exception as ex:
+            self.file_logger.debug("Unable to remove SMB test file {}: {}".format(unc_path, ex))
+
+    def _run_transfers(self, direction, transfers, worker, args):
+
+        self.deadline = time.monotonic() + self.timeout
+
+        threads = []
+        for transfer, unc_path in transfers:
+            thread = threading.Thread(target=worker, args=(unc_path, transfer) + args, name='smb-{}'.format(direction), daemon=True)
+            threads.append(thread)
+
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join(timeout=self.timeout + 10)
+
+        failed = False
+
+        for transfer, unc_path in transfers:
+            if transfer.error or transfer.end_time is None:
+                self.file_logger.error("SMB {} of {} failed: {}".format(direction, unc_path, transfer.error or "timed out"))
+                failed = True
+
+        if failed:
+            return False
+
+        transfer_time = max([transfer.end_time for transfer, _unc_path in transfers]) - start
+        byte_count = sum([transfer.bytes for transfer, _unc_path in transfers])
+        chunk_rates = [rate for transfer, _unc_path in transfers for rate in transfer.chunk_rates]
+
+        result = {
+            'direction': direction,
+            'host': self.host,
+            'filename': ','.join([transfer.filename for transfer, _unc_path in transfers]),
+            'files': len(transfers),
+            'bytes': byte_count,
+            'transfer_time': transfer_time,
+            'rate': _mbps(byte_count, transfer_time),
+            'chunk_rate_min': min(chunk_rates) if chunk_rates else 0.0,
+            'chunk_rate_max': max(chunk_rates) if chunk_rates else 0.0,
+        }
+
+        self.file_logger.info('smb_host: {}, {} of {} ({} bytes), time to transfer: {}, rate in Mbps {} (chunk min: {}, max: {})'.format(
+            self.host, direction, result['filename'], byte_count, round(transfer_time, 3), round(result['rate'], 2),
+            round(result['chunk_rate_min'], 2), round(result['chunk_rate_max'], 2)))
+
+        return result
+
+    def read_test(self, path, filenames):
+        '''
+        Read the files (concurrently) from the share path. Returns a dict of
+        the results (see _run_transfers()), or False if any read fails.
+        '''
+        transfers = [(SmbTransfer(filename), self._unc_path(path, filename)) for filename in filenames]
+
+        return self._run_transfers('read', transfers, self._read_file, ())
+
+    def write_test(self, path, file_count, size):
+        '''
+        Write file_count files of the size given (bytes) concurrently to the
+        share path (the files are removed after the test). Returns a dict of
+        the results, or False if any write fails.
+        '''
+        transfers = []
+
+        for file_num in range(1, int(file_count) + 1):
+            filename = 'wiperf_smb_test_{}_{}.tmp'.format(os.getpid(), file_num)
+            transfers.append((SmbTransfer(filename), self._unc_path(path, filename)))
+
+        return self._run_transfers('write', transfers, self._write_file, (int(size),))
@@ -0,0 +1,192 @@
+"""
+Speedtest server cache - saves the Ookla speedtest servers closest to the
+probe (ranked by latency) across poll cycles, so that the full server list
+does not have to be downloaded & every candidate pinged before each test.
+
+While the cache is within its TTL, only the top few servers are re-probed
+(a few latency.txt requests each) to pick the best server. The cache is
+fully refreshed when the TTL expires, none of the probed servers respond,
+or a test to the selected server fails.
+"""
+import json
+import os
+import time
+import urllib.request
+import speedtest
+
+# number of candidate servers ranked on a full refresh
+CANDIDATE_COUNT = 5
+
+# number of latency requests sent to each server probed
+PROBE_REQUESTS = 3
+
+# timeout of each latency request (secs)
+PROBE_TIMEOUT = 2
+
+def probe_server(server, requests=PROBE_REQUESTS, timeout=PROBE_TIMEOUT):
+    """
+    Measure the latency (mS) to a speedtest server (min of several requests
+    for the server's latency.txt file). Returns None if the server does not
+    respond.
+    """
+    latency_url = '{}/latency.txt'.format(os.path.dirname(server['url']))
+    latencies = []
+
+    for i in range(requests):
+        url = '{}?x={}.{}'.format(latency_url, int(time.time() * 1000), i)
+        request = urllib.request.Request(url, headers={'User-Agent': 'wiperf'})
+
+        try:
+            start = time.monotonic()
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if response.read(9) != b'test=test':
+                    continue
+            latencies.append((time.monotonic() - start) * 1000)
+        except (OSError, ValueError):
+            continue
+
+    return round(min(latencies), 3) if latencies else None
+
+
+class SpeedtestServerCache(object):
+    '''
+    A class to select the best speedtest server, using a cache of servers
+    ranked by latency
+    '''
+
+    def __init__(self, config_vars, file_logger, server_id=''):
+
+        self.file_logger = file_logger
+        self.server_id = str(server_id)
+
+        self.cache_file = config_vars['server_cache_file']
+        self.ttl = int(config_vars['server_cache_ttl'])
+        self.probe_count = max(int(config_vars['server_cache_probe_count']), 1)
+
+        # client ip reported by speedtest.net at the last full refresh
+        self.client_ip = ''
+
+    def _read_cache(self):
+
+        try:
+            with open(self.cache_file, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if not cache.get('servers'):
+            return None
+
+        # ignore the cache if the server configured has changed
+        if str(cache.get('server_id', '')) != self.server_id:
+            self.file_logger.info("Speedtest server changed, ignoring server cache.")
+            return None
+
+        age = time.time() - cache.get('time', 0)
+        if not (0 <= age < self.ttl):
+            self.file_logger.info("Speedtest server cache expired.")
+            return None
+
+        return cache
+
+    def _write_cache(self, cache):
+
+        tmp_file = self.cache_file + '.tmp'
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(tmp_file, 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(tmp_file, self.cache_file)
+        except (IOError, OSError) as err:
+            self.file_logger.error("Unable to save speedtest server cache to {}: {}".format(self.cache_file, err))
+
+    def invalidate(self):
+        '''
+        Remove the cache (e.g. after a test to the selected server fails), so
+        that the servers are re-ranked next time
+        '''
+        try:
+            os.remove(self.cache_file)
+        except OSError:
+            pass
+
+    def _rank(self, servers):
+
+        probed = []
+
+        for server in servers:
+            server['latency'] = probe_server(server)
+            self.file_logger.debug("Speedtest server {} latency: {} mS".format(server['host'], server['latency']))
+
+            if server['latency'] is not None:
+                probed.append(server)
+
+        return sorted(probed, key=lambda server: server['latency'])
+
+    def _refresh(self, st=None):
+
+        self.file_logger.info("Refreshing speedtest server cache...")
+
+        try:
+            if st is None:
+                st = speedtest.Speedtest()
+
+            if self.server_id:
+                servers = st.get_servers(servers=[self.server_id])
+                candidates = [server for server_list in servers.values() for server in server_list]
+            else:
+                st.get_servers()
+                candidates = st.get_closest_servers(limit=CANDIDATE_COUNT)
+
+            self.client_ip = str(st.config['client']['ip'])
+
+        except Exception as error:
+            self.file_logger.error("Speedtest error: unable to get server list, reason: {}".format(error))
+            return None
+
+        ranked = self._rank(candidates)
+
+        if not ranked:
+            self.file_logger.error("Speedtest error: none of the {} candidate servers responded.".format(len(candidates)))
+            return None
+
+        self._write_cache({
+            'server_id': self.server_id,
+            'time': time.time(),
+            'client_ip': self.client_ip,
+            'servers': ranked,
+        })
+
+        return ranked[0]
+
+    def get_best_server(self, st=None):
+        '''
+        Return the best server (speedtest.net server dict, plus its
+        'latency'), or None if no server is available. If the cache needs to
+        be refreshed, the Speedtest object supplied is used (if any) to get
+        the server list.
+        '''
+        cache = self._read_cache()
+
+        if not cache:
+            return self._refresh(st)
+
+        self.client_ip = cache.get('client_ip', '')
+
+        # re-probe the top servers only
+        servers = cache['servers']
+        top_servers = self._rank(servers[:self.probe_count])
+
+        if not top_servers:
+            self.file_logger.warning("Cached speedtest servers not responding.")
+            return self._refresh(st)
+
+        # keep the refresh time, so that the cache still expires on time
+        cache['servers'] = top_servers + servers[self.probe_count:]
+        self._write_cache(cache)
+
+        best = top_servers[0]
+        self.file_logger.info("Speedtest info: using cached server: {} ({} mS)".format(best['host'], best['latency']))
+
+        return best
@@ -1,5 +1,6 @@
 
 import os
+import threading
 import time
 
 class StatusFile(object):
@@ -13,9 +14,20 @@ class StatusFile(object):
         self.status_file =  status_file
         self.file_logger = file_logger
 
+        # tests may run concurrently, so serialise status file updates
+        self.lock = threading.Lock()
+
     # write current status msg to file in /tmp for display on FPMS
     def write_status_file(self, text=""):
 
+        with self.lock:
+            self._write_status_file(text)
+
+        time.sleep(1)
+        return True
+
+    def _write_status_file(self, text):
+
         if text == '':
 
             # if no text sent, delete file
@@ -30,7 +42,4 @@ class StatusFile(object):
                 with open(self.status_file, 'w') as statusf:
                     statusf.write(str(text))
             except Exception as ex:
-                self.file_logger.error("Issue writing status file: {}.".format(ex))
-
-        time.sleep(1)
-        return True
\ No newline at end of file
+                self.file_logger.error("Issue writing status file: {}.".format(ex))
\ No newline at end of file
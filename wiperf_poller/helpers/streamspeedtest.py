@@ -0,0 +1,404 @@
+"""
+Streaming speedtest engine - runs a download & upload test against an Ookla
+style speedtest server (random*.jpg downloads, upload.php uploads), with a
+cap on the data used by the test (for metered links, e.g. LTE backhaul).
+
+Throughput is sampled as the test runs, and each direction of the test is
+stopped as soon as the throughput has settled (or the byte budget/max
+duration is reached), rather than after a fixed amount of data. The samples
+give the ramp-up time (time to reach 90% of the final throughput) &
+stability (coefficient of variation of the samples after ramp-up) of each
+direction.
+"""
+import math
+import os
+import threading
+import time
+import urllib.request
+
+# secs between throughput samples
+SAMPLE_INTERVAL = 0.25
+
+# number of samples checked to decide if the throughput has settled
+STABLE_SAMPLES = 8
+
+# max coefficient of variation of the samples for throughput to be settled
+STABLE_TOLERANCE = 0.1
+
+# min test time before the throughput may be considered settled (secs)
+MIN_TEST_TIME = 2
+
+# proportion of final throughput reached at the end of ramp-up
+RAMPUP_LEVEL = 0.9
+
+# sizes of the images downloaded (pixels: random<size>x<size>.jpg)
+DOWNLOAD_SIZES = [1500, 2000, 2500, 3000, 3500, 4000]
+
+# size of each upload request (bytes)
+UPLOAD_SIZE = 1024 * 1024
+
+# size of each read/write (bytes)
+CHUNK_SIZE = 64 * 1024
+
+USER_AGENT = 'wiperf'
+
+class _TestStopped(Exception):
+
+    pass
+
+
+class ByteCounter(object):
+    '''
+    Thread-safe count of the bytes transferred by a test, with a cap on the
+    total bytes (transfers reserve their bytes before they are sent/read)
+    '''
+
+    def __init__(self, budget):
+
+        self.budget = int(budget)
+        self.count = 0
+        self.reserved = 0
+        # time of the last transfer
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        '''
+        Reserve up to size bytes of the budget - returns the number of bytes
+        that may be transferred (0 when the budget is used up)
+        '''
+        with self.lock:
+            size = max(min(size, self.budget - self.reserved), 0)
+            self.reserved += size
+            return size
+
+    def add(self, size, reserved=None):
+        '''
+        Record bytes transferred (any unused part of the bytes reserved for
+        the transfer is returned to the budget)
+        '''
+        with self.lock:
+            self.count += size
+            self.last_time = time.monotonic()
+            if reserved is not None:
+                self.reserved -= reserved - size
+
+    def exhausted(self):
+
+        with self.lock:
+            return self.reserved >= self.budget
+
+
+def throughput_stats(samples, final_mbps=None):
+    """
+    Calculate the throughput figures of a test direction from its throughput
+    samples ([(secs since start, mbps)]). The final throughput is the mean of
+    the last samples, unless supplied. Returns a dict:
+
+        { 'mbps': final throughput, 'rampup_ms': time to reach 90% of the
+          final throughput, 'stability_percent': coefficient of variation of
+          the samples after ramp-up (%) }
+    """
+    if final_mbps is None:
+        final_samples = [mbps for _secs, mbps in samples[-STABLE_SAMPLES:]]
+        final_mbps = sum(final_samples) / len(final_samples) if final_samples else 0.0
+
+    rampup_index = 0
+    for index, (_secs, mbps) in enumerate(samples):
+        if mbps >= final_mbps * RAMPUP_LEVEL:
+            rampup_index = index
+            break
+
+    # time at start of the sample period in which 90% was reached
+    rampup_secs = samples[rampup_index - 1][0] if rampup_index else 0
+
+    steady_samples = [mbps for _secs, mbps in samples[rampup_index:]]
+
+    return {
+        'mbps': final_mbps,
+        'rampup_ms': int(rampup_secs * 1000),
+        'stability_percent': coefficient_of_variation(steady_samples) * 100,
+    }
+
+def coefficient_of_variation(values):
+    """
+    Return the coefficient of variation (std dev / mean) of a list of values
+    """
+    if not values:
+        return 0.0
+
+    mean = sum(values) / len(values)
+
+    if not mean:
+        return 0.0
+
+    variance = sum([(value - mean) ** 2 for value in values]) / len(values)
+
+    return math.sqrt(variance) / mean
+
+
+class StreamSpeedtest(object):
+    '''
+    A class to run a speedtest with a byte budget & early stop once the
+    throughput has settled
+    '''
+
+    def __init__(self, file_logger, server_url, byte_budget, max_duration=10, threads=4, timeout=10):
+        '''
+        server_url: base url of the server (e.g. http://host:8080/speedtest)
+        byte_budget: max bytes used by the test (download + upload)
+        max_duration: max duration of each direction (secs)
+        '''
+        self.file_logger = file_logger
+        self.server_url = server_url.rstrip('/')
+        self.byte_budget = int(byte_budget)
+        self.max_duration = float(max_duration)
+        self.threads = max(int(threads), 1)
+        self.timeout = timeout
+
+        # stop_event stops the workers of the current test direction
+        self.stop_event = threading.Event()
+        self.cancel_event = threading.Event()
+
+    def latency(self, count=3):
+        '''
+        Measure the http latency to the server (mS). Returns (min latency,
+        jitter), or (None, None) if the server is not reachable
+        '''
+        latencies = []
+
+        for i in range(count):
+            url = '{}/latency.txt?x={}.{}'.format(self.server_url, int(time.time() * 1000), i)
+            request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+
+            try:
+                start = time.monotonic()
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read(9)
+                latencies.append((time.monotonic() - start) * 1000)
+            except (OSError, ValueError) as err:
+                self.file_logger.debug("Speedtest latency check failed: {}".format(err))
+
+        if not latencies:
+            return (None, None)
+
+        jitter = 0.0
+        if len(latencies) > 1:
+            jitter = sum([abs(latencies[i] - latencies[i - 1]) for i in range(1, len(latencies))]) / (len(latencies) - 1)
+
+        return (min(latencies), jitter)
+
+    def _download_worker(self, worker_num, counter, errors):
+
+        request_num = 0
+
+        while not self.stop_event.is_set():
+
+            size = DOWNLOAD_SIZES[(worker_num + request_num) % len(DOWNLOAD_SIZES)]
+            url = '{}/random{}x{}.jpg?x={}.{}'.format(self.server_url, size, size, int(time.time() * 1000), request_num)
+            request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT, 'Cache-Control': 'no-cache'})
+            request_num += 1
+
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+
+                    while not self.stop_event.is_set():
+
+                        reserved = counter.reserve(CHUNK_SIZE)
+                        if not reserved:
+                            return
+
+                        data = response.read(reserved)
+                        counter.add(len(data), reserved)
+
+                        if not data:
+                            break
+
+            except (OSError, ValueError) as err:
+                errors.append(str(err))
+                if len(errors) > self.threads * 2:
+                    return
+
+    def _upload_data(self, counter, size):
+
+        chunk = os.urandom(CHUNK_SIZE)
+
+        yield b'content1='
+        counter.add(9)
+        sent = 9
+
+        while sent < size:
+
+            if self.stop_event.is_set():
+                raise _TestStopped()
+
+            data = chunk[:min(CHUNK_SIZE, size - sent)]
+
+            # bytes are counted as they are handed to the connection
+            counter.add(len(data))
+            sent += len(data)
+
+            yield data
+
+    def _upload_worker(self, worker_num, counter, errors):
+
+        request_num = 0
+
+        while not self.stop_event.is_set():
+
+            # the budget for the whole request is reserved up front, so that
+            # each request started is completed when the budget runs out
+            size = counter.reserve(UPLOAD_SIZE)
+            if size < CHUNK_SIZE:
+                return
+
+            url = '{}/upload.php?x={}.{}'.format(self.server_url, int(time.time() * 1000), request_num)
+            request_num += 1
+
+            request = urllib.request.Request(url, data=self._upload_data(counter, size), method='POST',
+                headers={'User-Agent': USER_AGENT, 'Content-Type': 'application/x-www-form-urlencoded',
+                'Content-Length': str(size)})
+
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+
+                # mark the time the server received the data
+                counter.add(0)
+
+            except _TestStopped:
+                return
+            except (OSError, ValueError) as err:
+                errors.append(str(err))
+                if len(errors) > self.threads * 2:
+                    return
+
+    def _run_direction(self, direction, byte_budget):
+
+        counter = ByteCounter(byte_budget)
+        errors = []
+
+        worker = self._download_worker if direction == 'download' else self._upload_worker
+
+        self.stop_event.clear()
+
+        workers = []
+        for worker_num in range(self.threads):
+            thread = threading.Thread(target=worker, args=(worker_num, counter, errors), name='speedtest-{}'.format(direction), daemon=True)
+            workers.append(thread)
+
+        start = time.monotonic()
+        for thread in workers:
+            thread.start()
+
+        samples = []
+        last_count = 0
+        last_time = start
+        stop_reason = 'duration'
+
+        while True:
+
+            if self.cancel_event.wait(SAMPLE_INTERVAL):
+                stop_reason = 'cancelled'
+                break
+
+            now = time.monotonic()
+            count = counter.count
+
+            samples.append((now - start, (count - last_count) * 8 / (now - last_time) / 1000000))
+            last_count = count
+            last_time = now
+
+            if not any([thread.is_alive() for thread in workers]):
+                stop_reason = 'budget' if counter.exhausted() else 'error'
+                break
+
+            if now - start >= self.max_duration:
+                stop_reason = 'duration'
+                break
+
+            if (now - start >= MIN_TEST_TIME) and (len(samples) >= STABLE_SAMPLES):
+                if coefficient_of_variation([mbps for _secs, mbps in samples[-STABLE_SAMPLES:]]) <= STABLE_TOLERANCE:
+                    stop_reason = 'converged'
+                    break
+
+        self.stop_event.set()
+
+        for thread in workers:
+            thread.join(timeout=self.timeout)
+
+        if stop_reason in ['budget', 'error']:
+            # the workers finished part way through the last sample
+            elapsed = counter.last_time - start
+        else:
+            elapsed = time.monotonic() - start
+
+        if errors:
+            self.file_logger.debug("Speedtest {} errors: {}".format(direction, errors[:5]))
+
+        self.file_logger.debug("Speedtest {} samples (mbps): {}".format(direction, [round(mbps, 1) for _secs, mbps in samples]))
+
+        if stop_reason == 'cancelled':
+            self.file_logger.error("Speedtest {} cancelled.".format(direction))
+            return None
+
+        if not counter.count:
+            self.file_logger.error("Speedtest {} failed: {}".format(direction, errors[0] if errors else 'no data transferred'))
+            return None
+
+        # if the throughput had not settled, the mean throughput of the whole
+        # test is used (uploaded bytes are counted as they are handed to the
+        # connection, so the samples overstate the early upload throughput
+        # while the socket buffers fill)
+        if stop_reason == 'converged':
+            result = throughput_stats(samples)
+        else:
+            result = throughput_stats(samples, counter.count * 8 / max(elapsed, 0.001) / 1000000)
+
+        result['bytes'] = counter.count
+        result['duration_ms'] = int(elapsed * 1000)
+        result['stop_reason'] = stop_reason
+
+        self.file_logger.info("Speedtest {}: {:.2f} mbps, {} bytes, ramp-up: {}ms, stability: {:.1f}%, stopped: {}".format(
+            direction, result['mbps'], result['bytes'], result['rampup_ms'], result['stability_percent'], stop_reason))
+
+        return result
+
+    def cancel(self):
+        '''
+        Stop a running test (may be called from another thread)
+        '''
+        self.cancel_event.set()
+
+    def run(self):
+        '''
+        Run the download & upload tests. Half of the byte budget is available
+        to the download test, & the rest of the budget to the upload test.
+
+        Returns a dict: {'latency_ms', 'jitter_ms', 'download', 'upload'}
+        (download/upload are dicts of the throughput figures, see
+        throughput_stats(), plus 'bytes', 'duration_ms' & 'stop_reason'), or
+        None if the test failed.
+        '''
+        self.cancel_event.clear()
+
+        latency_ms, jitter_ms = self.latency()
+
+        if latency_ms is None:
+            self.file_logger.error("Speedtest server {} not reachable.".format(self.server_url))
+            return None
+
+        download = self._run_direction('download', self.byte_budget // 2)
+        if not download:
+            return None
+
+        upload = self._run_direction('upload', self.byte_budget - download['bytes'])
+        if not upload:
+            return None
+
+        return {
+            'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms,
+            'download': download,
+            'upload': upload,
+        }
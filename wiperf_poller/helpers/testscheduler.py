@@ -0,0 +1,98 @@
+"""
+Test scheduler class - runs the poller tests according to the resources
+each test needs, so that lightweight tests can run concurrently
+
+Resource classes:
+
+    EXCLUSIVE  : bandwidth-heavy tests (e.g. speedtest, iperf3, SMB) that must
+                 run on their own so that they do not skew other results
+    DISRUPTIVE : tests that may disrupt connectivity (e.g. DHCP), which are
+                 run on their own after all other tests
+    CONCURRENT : lightweight tests (e.g. ping, DNS, HTTP) that can safely run
+                 alongside each other
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+EXCLUSIVE = 'exclusive'
+DISRUPTIVE = 'disruptive'
+CONCURRENT = 'concurrent'
+
+class TestScheduler(object):
+
+    '''
+    A class to run poller tests, running consecutive concurrent-safe tests in
+    parallel (up to the configured concurrency limit)
+    '''
+
+    def __init__(self, file_logger, concurrency=1, cycle_timer=None):
+
+        self.file_logger = file_logger
+        self.concurrency = max(int(concurrency), 1)
+        self.cycle_timer = cycle_timer
+        self.tests = []
+
+    def add_test(self, name, resource_class, test_func, *args):
+        '''
+        Add a test to the schedule. Tests are run in the order added, apart
+        from disruptive tests, which are always run last.
+        '''
+        if resource_class not in [EXCLUSIVE, DISRUPTIVE, CONCURRENT]:
+            raise ValueError("Unknown test resource class: {}".format(resource_class))
+
+        self.tests.append((name, resource_class, test_func, args))
+
+    def _run_test(self, test):
+
+        name, resource_class, test_func, args = test
+
+        self.file_logger.debug("Running test: {} ({})".format(name, resource_class))
+
+        if self.cycle_timer:
+            with self.cycle_timer.phase('test_{}'.format(name)):
+                test_func(*args)
+        else:
+            test_func(*args)
+
+    def _run_concurrent_tests(self, tests):
+
+        if not tests:
+            return
+
+        if self.concurrency == 1 or len(tests) == 1:
+            for test in tests:
+                self._run_test(test)
+            return
+
+        self.file_logger.info("Running tests concurrently: {}".format(", ".join([test[0] for test in tests])))
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(tests))) as executor:
+
+            futures = [executor.submit(self._run_test, test) for test in tests]
+
+            # re-raise any exception (including sys.exit() calls) from the tests,
+            # once all tests have completed
+            for future in futures:
+                future.result()
+
+    def run_tests(self):
+        '''
+        Run all scheduled tests
+        '''
+        tests = [test for test in self.tests if test[1] != DISRUPTIVE]
+        tests += [test for test in self.tests if test[1] == DISRUPTIVE]
+
+        concurrent_tests = []
+
+        for test in tests:
+
+            if test[1] == CONCURRENT:
+                concurrent_tests.append(test)
+                continue
+
+            # run any concurrent tests queued so far before this exclusive test
+            self._run_concurrent_tests(concurrent_tests)
+            concurrent_tests = []
+
+            self._run_test(test)
+
+        self._run_concurrent_tests(concurrent_tests)
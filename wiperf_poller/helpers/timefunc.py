@@ -2,44 +2,166 @@
 Miscellaneous time functions
 """
 
+import ctypes
+import ctypes.util
+import threading
 import time
 import subprocess
 from wiperf_poller.helpers.os_cmds import TIMEDATECTL_CMD
 
-def time_synced():
+# adjtimex() return value when the kernel clock is not synchronized
+TIME_ERROR = 5
 
-    # check if clock sync status is true from "timedatectl status" command
-    cmd = "{} status".format(TIMEDATECTL_CMD)
-    cmd_output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True).decode()
+class TimeSyncStatus(object):
 
-    for line in cmd_output.split('\n'):
-       if ("System clock" in line) and ("yes" in line):
-            return True
-    
-    return False
+    '''
+    A class to provide the clock sync status of the probe. The status is
+    cached and only re-checked once the cached value is older than 'ttl'
+    seconds, so that it may be queried for every result exported.
+
+    The sync status is read from the kernel using the adjtimex() syscall (as
+    used by timedatectl). If this is not available, the output of a single
+    "timedatectl status" command is used instead.
+    '''
+
+    def __init__(self, ttl=60):
+
+        self.ttl = ttl
+        self.synced = False
+        self.last_check = None
+        self.lock = threading.Lock()
+
+        # struct timex buffer for adjtimex() (modes field left as 0, so
+        # the call is read-only)
+        self.adjtimex = None
+        self.timex_buf = ctypes.create_string_buffer(512)
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.adjtimex = libc.adjtimex
+            self.adjtimex.argtypes = [ctypes.c_char_p]
+            self.adjtimex.restype = ctypes.c_int
+        except (OSError, AttributeError, TypeError):
+            self.adjtimex = None
+
+    def set_ttl(self, ttl):
+        '''
+        Set the max age (secs) of the cached sync status
+        '''
+        self.ttl = max(float(ttl), 0)
+
+    def _check_adjtimex(self):
+
+        ctypes.memset(self.timex_buf, 0, ctypes.sizeof(self.timex_buf))
+        result = self.adjtimex(self.timex_buf)
+
+        if result < 0:
+            return None
+
+        return result != TIME_ERROR
+
+    def _check_timedatectl(self):
+
+        # check if clock sync status is true from "timedatectl status" command
+        cmd = "{} status".format(TIMEDATECTL_CMD)
+
+        try:
+            cmd_output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True).decode()
+        except subprocess.CalledProcessError:
+            return False
+
+        for line in cmd_output.split('\n'):
+            if ("System clock" in line) and ("yes" in line):
+                return True
+
+        return False
 
-def now_as_nsecs():
-    return int(time.time() * 1000000000)
+    def refresh(self):
+        '''
+        Read the current clock sync status (ignoring any cached value)
+        '''
+        with self.lock:
+            return self._refresh()
 
-def now_as_usecs():
-    return int(time.time() * 1000000)
+    def _refresh(self):
 
-def now_as_msecs():
-    return int(time.time() * 1000)
+        synced = None
 
-def now_as_secs():
-    return int(time.time())
+        if self.adjtimex:
+            synced = self._check_adjtimex()
 
-def get_timestamp(config_vars):
+        if synced is None:
+            synced = self._check_timedatectl()
 
+        self.synced = synced
+        self.last_check = time.monotonic()
+
+        return synced
+
+    def is_synced(self):
+        '''
+        Return the clock sync status, re-checking it if the cached value
+        has expired
+        '''
+        with self.lock:
+            if (self.last_check is None) or (time.monotonic() - self.last_check >= self.ttl):
+                return self._refresh()
+
+            return self.synced
+
+# single sync status provider shared by all exporters & testers
+time_sync_status = TimeSyncStatus()
+
+def time_synced():
+    return time_sync_status.is_synced()
+
+def now_as_nsecs(secs=None):
+    return int((time.time() if secs is None else secs) * 1000000000)
+
+def now_as_usecs(secs=None):
+    return int((time.time() if secs is None else secs) * 1000000)
+
+def now_as_msecs(secs=None):
+    return int((time.time() if secs is None else secs) * 1000)
+
+def now_as_secs(secs=None):
+    return int(time.time() if secs is None else secs)
+
+def get_timestamp(config_vars, secs=None):
+    '''
+    Return a timestamp in the format required by the exporter (the current
+    time, unless a time (secs since epoch) is supplied)
+    '''
     if config_vars['time_format'] == "influxdb":
-        return now_as_msecs()
+        return now_as_msecs(secs)
 
     elif config_vars['time_format'] == "splunk":
-        return now_as_secs()
+        return now_as_secs(secs)
     
     elif config_vars['time_format'] == "influxdb2":
-        return now_as_msecs()
+        return now_as_msecs(secs)
     
     else:
-        return now_as_secs()
\ No newline at end of file
+        return now_as_secs(secs)
+
+def timestamp_units(time_format):
+    '''
+    Return the number of timestamp units per second of a time format (as
+    used by get_timestamp())
+    '''
+    if time_format in ["influxdb", "influxdb2"]:
+        return 1000
+
+    return 1
+
+def convert_timestamp(timestamp, from_format, to_format):
+    '''
+    Convert a timestamp from one exporter time format to another
+    '''
+    from_units = timestamp_units(from_format)
+    to_units = timestamp_units(to_format)
+
+    if from_units == to_units:
+        return timestamp
+
+    return int(timestamp * to_units / from_units)
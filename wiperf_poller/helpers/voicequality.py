@@ -0,0 +1,171 @@
+"""
+Voice quality analytics - estimates the quality of a voice call over the
+path tested, using a simplified ITU-T G.107 E-model (R-factor) & the MOS
+score derived from it. Rather than one score for a whole test (which hides
+short bursts of poor quality), a score is calculated for each iperf3 udp
+test interval or each window of ping rtt samples, and the distribution of
+the scores (min, 5th percentile, median) is reported.
+
+The calculations are done over lists of values. NumPy is used if installed
+and there are enough values to make it worthwhile, otherwise the same
+calculations are done in pure python (the usual case - a poll cycle only
+produces a few tens of intervals/samples, and importing NumPy on a Pi takes
+longer than the calculations themselves).
+"""
+from wiperf_poller.helpers.icmp import percentile
+
+# minimum number of values before NumPy is used (if available)
+NUMPY_MIN_VALUES = 500
+
+# default number of ping rtt samples in each window
+PING_WINDOW = 5
+
+# NumPy module (imported on first use): None = not yet imported, False = not available
+_numpy = None
+
+def _get_numpy():
+
+    global _numpy
+
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+
+    return _numpy
+
+def _as_list(value, count):
+
+    if isinstance(value, (list, tuple)):
+        return list(value)
+
+    return [value] * count
+
+def _r_factor(rtt_ms, jitter_ms, lost_percent):
+
+    effective_latency = (rtt_ms / 2) + (2 * jitter_ms) + 10.0
+
+    if effective_latency < 160:
+        r_value = 93.2 - (effective_latency / 40)
+    else:
+        r_value = 93.2 - ((effective_latency - 120) / 10)
+
+    return r_value - 2.5 * lost_percent
+
+def _mos(r_value):
+
+    if r_value < 0:
+        return 1.0
+    elif r_value < 100:
+        return 1 + 0.035 * r_value + 0.000007 * r_value * (r_value - 60) * (100 - r_value)
+    else:
+        return 4.5
+
+def _mos_scores_numpy(numpy, rtt_ms, jitter_ms, lost_percent):
+
+    rtt_ms = numpy.asarray(rtt_ms, dtype=float)
+    jitter_ms = numpy.asarray(jitter_ms, dtype=float)
+    lost_percent = numpy.asarray(lost_percent, dtype=float)
+
+    effective_latency = (rtt_ms / 2) + (2 * jitter_ms) + 10.0
+
+    r_values = numpy.where(effective_latency < 160, 93.2 - (effective_latency / 40), 93.2 - ((effective_latency - 120) / 10))
+    r_values = r_values - 2.5 * lost_percent
+
+    mos = 1 + 0.035 * r_values + 0.000007 * r_values * (r_values - 60) * (100 - r_values)
+    mos = numpy.where(r_values < 0, 1.0, numpy.where(r_values < 100, mos, 4.5))
+
+    return mos.tolist()
+
+def mos_scores(rtt_ms, jitter_ms, lost_percent):
+    """
+    Calculate the MOS score (1.0 to 4.5) for each set of rtt, jitter &
+    loss values supplied. Each arg may be a list of values or a single value
+    (which is used for every set). Returns a list of MOS scores.
+    """
+    count = max([len(value) for value in (rtt_ms, jitter_ms, lost_percent) if isinstance(value, (list, tuple))] or [1])
+
+    rtt_ms = _as_list(rtt_ms, count)
+    jitter_ms = _as_list(jitter_ms, count)
+    lost_percent = _as_list(lost_percent, count)
+
+    if count >= NUMPY_MIN_VALUES:
+        numpy = _get_numpy()
+        if numpy:
+            return _mos_scores_numpy(numpy, rtt_ms, jitter_ms, lost_percent)
+
+    return [_mos(_r_factor(rtt, jitter, lost)) for rtt, jitter, lost in zip(rtt_ms, jitter_ms, lost_percent)]
+
+def mos_stats(scores):
+    """
+    Summarise a list of MOS scores in to a dict of results fields:
+
+        { 'mos_min': lowest score, 'mos_p5': 5th percentile,
+          'mos_median': median score, 'mos_windows': number of scores }
+
+    Returns an empty dict if there are no scores.
+    """
+    if not scores:
+        return {}
+
+    ordered = sorted(scores)
+
+    return {
+        'mos_min': float(round(ordered[0], 2)),
+        'mos_p5': float(round(percentile(ordered, 5), 2)),
+        'mos_median': float(round(percentile(ordered, 50), 2)),
+        'mos_windows': len(ordered),
+    }
+
+def interval_mos_stats(intervals, rtt_ms):
+    """
+    MOS score distribution of the intervals of an iperf3 udp test (see
+    iperf3runner.parse_interval()). As iperf3 does not measure rtt, the rtt
+    supplied (e.g. from a ping to the iperf3 server) is used for every
+    interval.
+    """
+    intervals = [interval for interval in intervals
+        if not interval['omitted'] and interval['jitter_ms'] is not None and interval['lost_percent'] is not None]
+
+    if not intervals:
+        return {}
+
+    jitter_ms = [interval['jitter_ms'] for interval in intervals]
+    lost_percent = [interval['lost_percent'] for interval in intervals]
+
+    return mos_stats(mos_scores(rtt_ms, jitter_ms, lost_percent))
+
+def ping_mos_stats(rtts, lost_percent, window=PING_WINDOW):
+    """
+    MOS score distribution of a list of ping rtt samples (mS), calculated
+    over a sliding window of samples. The rtt of each window is its mean rtt
+    & its jitter the mean difference between consecutive samples. Lost
+    packets are not included in the rtt samples, so the loss of the whole
+    test is used for every window.
+    """
+    window = min(max(int(window), 2), len(rtts))
+
+    if window < 2:
+        return {}
+
+    # running totals of the rtts & the differences between consecutive rtts,
+    # so that the stats of each window are found without re-summing it
+    rtt_totals = [0.0]
+    for rtt in rtts:
+        rtt_totals.append(rtt_totals[-1] + rtt)
+
+    diff_totals = [0.0]
+    for i in range(1, len(rtts)):
+        diff_totals.append(diff_totals[-1] + abs(rtts[i] - rtts[i - 1]))
+
+    window_rtt = []
+    window_jitter = []
+
+    for start in range(len(rtts) - window + 1):
+        end = start + window
+        window_rtt.append((rtt_totals[end] - rtt_totals[start]) / window)
+        window_jitter.append((diff_totals[end - 1] - diff_totals[start]) / (window - 1))
+
+    return mos_stats(mos_scores(window_rtt, window_jitter, lost_percent))
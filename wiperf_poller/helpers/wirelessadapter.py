@@ -3,6 +3,8 @@ import subprocess
 import sys
 import time
 from wiperf_poller.helpers.os_cmds import IWCONFIG_CMD, IW_CMD, IF_CONFIG_CMD, ROUTE_CMD, IF_DOWN_CMD, IF_UP_CMD
+from wiperf_poller.helpers.netlink import Nl80211, NetlinkError
+from wiperf_poller.helpers.route import get_interface_ipv4, get_default_gateway, clear_route_cache
 
 
 class WirelessAdapter(object):
@@ -34,6 +36,10 @@ class WirelessAdapter(object):
         self.ip_addr = ''  # str
         self.def_gw = ''  # str
 
+        # nl80211 connection kept open for repeated station stats reads
+        self.station_nl80211 = None
+        self.station_nl80211_available = True
+
         self.file_logger.debug("#### Initialized WirelessAdapter instance... ####")
 
     def field_extractor(self, field_name, pattern, cmd_output_text):
@@ -337,13 +343,161 @@ class WirelessAdapter(object):
 
         return True
 
+    def nl80211_info(self):
+
+        #############################################################################
+        # Get wireless interface info directly from the kernel using nl80211
+        # (returns False if not available, so that we can fall back to the
+        # iwconfig/iw commands)
+        #############################################################################
+        try:
+            nl80211 = Nl80211()
+        except (NetlinkError, OSError) as err:
+            self.file_logger.debug("nl80211 not available ({}), will use iwconfig/iw commands".format(err))
+            return False
+
+        try:
+            if_info = nl80211.get_interface(self.wlan_if_name)
+            station_info = nl80211.get_station(self.wlan_if_name)
+        except (NetlinkError, OSError) as err:
+            self.file_logger.debug("Issue getting interface info using nl80211 ({}), will use iwconfig/iw commands".format(err))
+            return False
+        finally:
+            nl80211.close()
+
+        self.file_logger.debug("Wireless interface info (nl80211): {}, {}".format(if_info, station_info))
+
+        if (station_info is None) or not (if_info['ssid'] and station_info['bssid']):
+            self.file_logger.debug("Wireless interface not associated (nl80211), will use iwconfig/iw commands")
+            return False
+
+        self.ssid = if_info['ssid']
+        self.bssid = station_info['bssid']
+
+        # freqs reported in MHz by nl80211, but GHz by iwconfig
+        if if_info['freq']:
+            self.freq = if_info['freq'] / 1000
+        if if_info['center_freq']:
+            self.center_freq = if_info['center_freq'] / 1000
+
+        self.channel = self.channel_lookup(str(self.freq))
+
+        if if_info['channel_width']:
+            self.channel_width = if_info['channel_width']
+
+        if station_info['tx_bitrate'] is not None:
+            self.tx_bit_rate = station_info['tx_bitrate']
+        if station_info['rx_bitrate'] is not None:
+            self.rx_bit_rate = station_info['rx_bitrate']
+        if station_info['tx_mcs'] is not None:
+            self.tx_mcs = station_info['tx_mcs']
+        if station_info['rx_mcs'] is not None:
+            self.rx_mcs = station_info['rx_mcs']
+
+        signal = station_info['signal'] if station_info['signal'] is not None else station_info['signal_avg']
+        if signal is not None:
+            self.signal_level = float(signal)
+
+        # iwconfig "Tx excessive retries" is the count of frames that failed
+        # after all retries (nl80211 tx failed), not the count of retries
+        if station_info['tx_failed'] is not None:
+            self.tx_retries = station_info['tx_failed']
+
+        return True
+
+    def get_station_stats(self):
+        '''
+        Get a lightweight snapshot of the wireless adapter stats, for sampling
+        the stats at a high rate (no OS commands are run). Returns a dict with
+        the following keys (values are None if not available), or None if the
+        stats cannot be read:
+
+            bssid, signal (dBm), tx_bitrate (Mbps), rx_bitrate (Mbps), tx_mcs,
+            rx_mcs, tx_retries
+
+        The stats are read using nl80211, with a fallback to /proc/net/wireless
+        (which only provides the signal level & tx retries).
+        '''
+        if self.station_nl80211 is None and self.station_nl80211_available:
+            try:
+                self.station_nl80211 = Nl80211()
+            except (NetlinkError, OSError) as err:
+                # no point trying again for every sample
+                self.file_logger.debug("nl80211 not available ({}), using /proc/net/wireless for station stats".format(err))
+                self.station_nl80211_available = False
+
+        if self.station_nl80211 is None:
+            return self.proc_wireless_stats()
+
+        try:
+            station_info = self.station_nl80211.get_station(self.wlan_if_name)
+
+            if station_info is None:
+                return None
+
+            signal = station_info['signal'] if station_info['signal'] is not None else station_info['signal_avg']
+
+            return {
+                'bssid': station_info['bssid'],
+                'signal': signal,
+                'tx_bitrate': station_info['tx_bitrate'],
+                'rx_bitrate': station_info['rx_bitrate'],
+                'tx_mcs': station_info['tx_mcs'],
+                'rx_mcs': station_info['rx_mcs'],
+                'tx_retries': station_info['tx_failed'],
+            }
+
+        except (NetlinkError, OSError):
+            self.close_station_stats()
+
+        return self.proc_wireless_stats()
+
+    def close_station_stats(self):
+        '''
+        Close the nl80211 connection used to read station stats
+        '''
+        if self.station_nl80211:
+            self.station_nl80211.close()
+            self.station_nl80211 = None
+
+    def proc_wireless_stats(self, proc_file='/proc/net/wireless'):
+        '''
+        Get the signal level & tx retries of the wireless adapter from procfs
+        (returns None if not available)
+        '''
+        try:
+            with open(proc_file, 'r') as stats_file:
+                for line in stats_file:
+
+                    # e.g. " wlan0: 0000   70.  -40.  -256        0      0      0      0      0        0"
+                    if_name, _sep, fields = line.partition(':')
+                    if if_name.strip() != self.wlan_if_name:
+                        continue
+
+                    fields = fields.split()
+
+                    return {
+                        'bssid': None,
+                        'signal': float(fields[2].rstrip('.')),
+                        'tx_bitrate': None,
+                        'rx_bitrate': None,
+                        'tx_mcs': None,
+                        'rx_mcs': None,
+                        'tx_retries': int(fields[7]),
+                    }
+        except (OSError, ValueError, IndexError):
+            pass
+
+        return None
+
     def get_wireless_info(self):
         '''
         This function will look for various pieces of information from the
         wireless adapter which will be bundled with the speedtest results.
 
-        It is a wrapper around the following commands, so will no doubt break at
-        some stage:
+        The info is read from the kernel using nl80211 (netlink) where possible.
+        If nl80211 is not available, it falls back to being a wrapper around the
+        following commands, so will no doubt break at some stage:
             - iwconfig wlan0
             - iw dev wlan0 link
             - iw dev wlan0 info
@@ -360,21 +514,24 @@ class WirelessAdapter(object):
 
         self.file_logger.debug("Getting wireless adapter info...")
 
-        # get info using iwconfig cmd
-        if self.iwconfig() == False:
-            return False
+        # get info using nl80211, falling back to the iwconfig/iw cmds if required
+        if not self.nl80211_info():
 
-        # get info using iw info
-        if self.iw_info() == False:
-            return False
+            # get info using iwconfig cmd
+            if self.iwconfig() == False:
+                return False
 
-        # get info using iw link
-        if self.iw_link() == False:
-            return False
+            # get info using iw info
+            if self.iw_info() == False:
+                return False
 
-        # get info using iw station
-        if self.iw_station() == False:
-            return False
+            # get info using iw link
+            if self.iw_link() == False:
+                return False
+
+            # get info using iw station
+            if self.iw_station() == False:
+                return False
 
         # get the values extracted and return in a list
         results_list = [self.ssid, self.bssid, self.freq, self.tx_bit_rate,
@@ -386,13 +543,31 @@ class WirelessAdapter(object):
 
     def get_adapter_ip(self):
         '''
-        This method parses the output of the ifconfig command to figure out the
-        IP address of the wireless adapter.
+        This method figures out the IP address of the wireless adapter. The
+        address is read from the kernel (ioctl) where possible, otherwise
+        the output of the ifconfig command is parsed.
 
-        As this is a wrapper around a CLI command, it is likely to break at
-        some stage
+        As the fallback is a wrapper around a CLI command, it is likely to
+        break at some stage
         '''
 
+        # Get IP address directly from the kernel
+        try:
+            ip_addr = get_interface_ipv4(self.wlan_if_name)
+
+            self.ip_addr = ip_addr if ip_addr else "NA"
+
+            # Check to see if IP address is APIPA (169.254.x.x)
+            if self.ip_addr.startswith("169.254."):
+                self.ip_addr = "NA"
+
+            self.file_logger.debug("IP Address = " + self.ip_addr)
+
+            return self.ip_addr
+
+        except OSError as err:
+            self.file_logger.debug("Unable to get IP address via ioctl ({}), will use ifconfig command".format(err))
+
         # Get interface info
         try:
             cmd = "{} {}".format(IF_CONFIG_CMD, self.wlan_if_name)
@@ -426,13 +601,31 @@ class WirelessAdapter(object):
 
     def get_route_info(self):
         '''
-        This method parses the output of the route command to figure out the
-        IP address of the wireless adapter default gateway.
+        This method figures out the IP address of the wireless adapter default
+        gateway. The kernel routing table is read from /proc/net/route where
+        possible, otherwise the output of the route command is parsed.
 
-        As this is a wrapper around a CLI command, it is likely to break at
-        some stage
+        As the fallback is a wrapper around a CLI command, it is likely to
+        break at some stage
         '''
 
+        # Get def gw directly from the kernel routing table
+        try:
+            def_gw = get_default_gateway(self.wlan_if_name)
+
+            if def_gw is None:
+                error_descr = "Issue getting default gateway info from routing table (Prob due to multiple interfaces being up or wlan interface being wrong)."
+                self.file_logger.error(error_descr)
+                self.file_logger.error("Returning error...")
+                return False
+
+            self.def_gw = def_gw
+            self.file_logger.debug("Default GW = " + self.def_gw)
+            return
+
+        except (OSError, ValueError, StopIteration) as err:
+            self.file_logger.debug("Unable to read routing table ({}), will use route command".format(err))
+
         # Get route info (used to figure out default gateway)
         try:
             cmd = "{} -n | grep ^0.0.0.0 | grep {}".format(ROUTE_CMD, self.wlan_if_name)
@@ -494,6 +687,9 @@ class WirelessAdapter(object):
             self.file_logger.error(error_descr)
             return False
 
+        # routes via the interface may have changed
+        clear_route_cache()
+
         self.file_logger.info("Interface bounce completed OK.")
         return True
     
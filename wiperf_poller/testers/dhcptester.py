@@ -3,6 +3,7 @@ A simple class to perform a DHCP release & renew and return the renewal time
 """
 import time
 import subprocess
+from wiperf_poller.helpers.dhcp import DhcpClient, DhcpError
 from wiperf_poller.helpers.wirelessadapter import WirelessAdapter
 from wiperf_poller.helpers.os_cmds import DHCLIENT_CMD
 from wiperf_poller.helpers.timefunc import get_timestamp
@@ -82,6 +83,13 @@ class DhcpTester(object):
                 subprocess.check_output("pkill -9 -f 'dhclient.pid'", shell=True)
             except subprocess.CalledProcessError as exc:
                 self.file_logger.info("Output from zombie processes kill: {}".format(exc))
+
+            # reap the dhclient process we started, so it is not left as a
+            # zombie (and its run time is included in the poll cycle timings)
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.file_logger.warning("dhcp: dhclient process did not exit.")
         
         except Exception as ex:
             self.file_logger.error("Issue renewing IP address: {}".format(ex))
@@ -95,6 +103,32 @@ class DhcpTester(object):
 
         return self.duration
 
+    def dhcp_exchange(self, interface, mode='renew', timeout=3):
+        """
+        Run a DHCP exchange directly (see helpers/dhcp.py) & time each phase.
+        Unlike dhcp_renewal(), the address of the interface is not released
+        and the interface is not bounced if the exchange fails.
+
+        Returns a dict of results (see DhcpClient.run()), or False if the
+        exchange failed
+        """
+        self.interface = interface
+
+        self.file_logger.info("Running dhcp exchange...(mode = {}, interface= {})".format(mode, self.interface))
+
+        try:
+            dhcp_result = DhcpClient(self.file_logger, interface, timeout=timeout).run(mode)
+        except (DhcpError, OSError) as ex:
+            self.file_logger.error("DHCP exchange failed: {}".format(ex))
+            return False
+
+        self.duration = int(round(dhcp_result['total_ms']))
+
+        self.file_logger.info("DHCP exchange time: {}mS (server: {}, relay: {}, retransmits: {})".format(
+            self.duration, dhcp_result['server_id'], dhcp_result['relay'], dhcp_result['retransmits']))
+
+        return dhcp_result
+
     def run_tests(self, status_file_obj, config_vars, exporter_obj):
 
         self.file_logger.info("Starting DHCP renewal test...")
@@ -109,7 +143,13 @@ class DhcpTester(object):
         tests_passed = True
 
         self.file_logger.info("Interface under test: {}".format(interface))
-        renewal_result = self.dhcp_renewal(interface, mode=config_vars['dhcp_test_mode'])
+
+        if config_vars['dhcp_engine'] == 'packet':
+            dhcp_result = self.dhcp_exchange(interface, mode=config_vars['dhcp_packet_mode'], timeout=float(config_vars['dhcp_timeout']))
+            renewal_result = self.duration if dhcp_result else False
+        else:
+            dhcp_result = {}
+            renewal_result = self.dhcp_renewal(interface, mode=config_vars['dhcp_test_mode'])
 
         if renewal_result:
 
@@ -118,6 +158,18 @@ class DhcpTester(object):
                 'renewal_time_ms': int(renewal_result),
             }
 
+            # per-phase results of the packet engine
+            if dhcp_result:
+                results_dict['mode'] = str(dhcp_result['mode'])
+                for phase in ['discover_offer_ms', 'request_ack_ms', 'inform_ack_ms']:
+                    if phase in dhcp_result:
+                        results_dict[phase] = round(float(dhcp_result[phase]), 1)
+                results_dict['server_id'] = str(dhcp_result['server_id'])
+                results_dict['relay'] = str(dhcp_result['relay'])
+                results_dict['retransmits'] = int(dhcp_result['retransmits'])
+                if dhcp_result['lease_time'] is not None:
+                    results_dict['lease_time'] = int(dhcp_result['lease_time'])
+
             # define column headers for CSV
             column_headers = list(results_dict.keys())
 
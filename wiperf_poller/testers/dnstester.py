@@ -3,6 +3,7 @@ A simple class to perform a DNS lookup against a number of targets and return th
 '''
 import time
 import socket
+from wiperf_poller.helpers.dnsquery import DnsQuery, DnsQueryEngine, RCODE_NAMES, read_resolvers
 from wiperf_poller.helpers.timefunc import get_timestamp
 
 class DnsTester(object):
@@ -56,6 +57,92 @@ class DnsTester(object):
 
         return self.dns_result
     
+    def dns_lookups(self, targets, resolvers, query_types=['A'], timeout=2, repeat=1, repeat_stat='best', cache_check=True):
+        '''
+        Query each resolver supplied for each target (& query type), with all
+        queries sent concurrently. Each query may be repeated a number of
+        times, with the best (or median) lookup time reported.
+
+        If cache checking is enabled, a non-recursive query is sent to the
+        resolver first. If this is answered, the name was already cached by
+        the resolver (i.e. the lookup time is not a full recursive lookup).
+
+        Returns a list of results dicts (one per target/resolver/query type):
+
+            { 'dns_target': target,
+              'dns_server': resolver,
+              'query_type': query type,
+              'lookup_time_ms': lookup time (float) or False if lookup failed,
+              'rcode': response code (or -1 if no response),
+              'cache_hit': 1 if name cached on resolver, otherwise 0 }
+        '''
+        engine = DnsQueryEngine(self.file_logger, timeout=timeout)
+
+        lookups = []
+        for target in targets:
+            for resolver in resolvers:
+                for query_type in query_types:
+                    lookups.append((target, resolver, query_type))
+
+        # check which names are already cached by the resolvers (must be
+        # done before the timed lookups, as they will populate the cache)
+        cache_hits = {}
+
+        if cache_check:
+            probes = [DnsQuery(resolver, target, query_type, recursion_desired=False) for target, resolver, query_type in lookups]
+            engine.run_queries(probes)
+
+            for lookup, probe in zip(lookups, probes):
+                cache_hits[lookup] = 1 if (probe.response and probe.response['answers']) else 0
+
+        # run the timed lookups (each round of queries sent concurrently)
+        rounds = []
+        for _ in range(max(int(repeat), 1)):
+            rounds.append(engine.run_queries([DnsQuery(resolver, target, query_type) for target, resolver, query_type in lookups]))
+
+        results = []
+
+        for index, lookup in enumerate(lookups):
+
+            target, resolver, query_type = lookup
+            queries = [queries[index] for queries in rounds]
+
+            answered = [query for query in queries if query.response]
+            latencies = sorted([query.latency_ms for query in answered if query.response['rcode'] == 0])
+
+            if answered:
+                rcode = answered[-1].response['rcode']
+            else:
+                rcode = -1
+
+            lookup_time = False
+
+            if latencies:
+                if repeat_stat == 'median':
+                    lookup_time = latencies[len(latencies) // 2]
+                else:
+                    lookup_time = latencies[0]
+
+                self.file_logger.debug("DNS lookup for: {} ({}) via {} succeeded: {} (samples: {})".format(target, query_type, resolver,
+                    round(lookup_time, 3), [round(latency, 3) for latency in latencies]))
+            else:
+                if answered:
+                    error = RCODE_NAMES.get(rcode, "rcode {}".format(rcode))
+                else:
+                    error = queries[-1].error
+                self.file_logger.error("DNS test lookup to {} ({}) via {} failed. Err msg: {}".format(target, query_type, resolver, error))
+
+            results.append({
+                'dns_target': target,
+                'dns_server': resolver,
+                'query_type': query_type,
+                'lookup_time_ms': lookup_time,
+                'rcode': rcode,
+                'cache_hit': cache_hits.get(lookup, 0),
+            })
+
+        return results
+
     def run_tests(self, status_file_obj, config_vars, exporter_obj):
 
         self.file_logger.info("Starting DNS tests...")
@@ -72,24 +159,57 @@ class DnsTester(object):
             target_name = 'dns_target{}'.format(target_num)
             dns_targets.append(config_vars[target_name])
 
-        dns_index = 0
         delete_file = True
         tests_passed = True
 
-        for dns_target in dns_targets:
+        # resolvers to query (default: first resolver in resolv.conf)
+        if config_vars['dns_servers']:
+            resolvers = [server.strip() for server in config_vars['dns_servers'].split(',') if server.strip()]
+        else:
+            resolvers = read_resolvers()[:1]
+
+        query_types = []
+        for query_type in config_vars['dns_query_types'].split(','):
+            query_type = query_type.strip().upper()
+
+            if query_type in ['A', 'AAAA']:
+                query_types.append(query_type)
+            elif query_type:
+                self.file_logger.error("Unsupported DNS query type in config file: {} (ignored)".format(query_type))
+
+        if not query_types:
+            query_types = ['A']
 
-            dns_index += 1
+        # list of (index, target) tuples, skipping empty targets
+        indexed_targets = [(index + 1, dns_target) for index, dns_target in enumerate(dns_targets) if dns_target != '']
 
-            # move on to next if no DNS entry data
-            if dns_target == '':
-                continue
+        if resolvers:
+            dns_results = self.dns_lookups([target for _index, target in indexed_targets], resolvers, query_types,
+                timeout=config_vars['dns_timeout'], repeat=config_vars['dns_repeat'],
+                repeat_stat=config_vars['dns_repeat_stat'], cache_check=(config_vars['dns_cache_check'] == 'yes'))
 
-            dns_result = self.dns_single_lookup(dns_target)
+            # add the index of each target to its results (results are returned
+            # in target order, with one result per resolver & query type)
+            results_per_target = len(resolvers) * len(query_types)
+            for result_num, dns_result in enumerate(dns_results):
+                dns_result['dns_index'] = indexed_targets[result_num // results_per_target][0]
+        else:
+            # no resolvers found, fall back to system resolver lookups
+            self.file_logger.warning("No DNS servers found, using system resolver for DNS tests.")
+            dns_results = []
+            for dns_index, dns_target in indexed_targets:
+                dns_results.append({'dns_index': dns_index, 'dns_target': dns_target, 'lookup_time_ms': self.dns_single_lookup(dns_target)})
 
-            if dns_result:
+        for dns_result in dns_results:
+
+            dns_index = dns_result['dns_index']
+            dns_target = dns_result['dns_target']
+
+            # (a sub-millisecond lookup is a valid result)
+            if dns_result['lookup_time_ms'] is not False:
 
                 # summarise result for log
-                result_str = ' {}: {}ms'.format(dns_target, dns_result)
+                result_str = ' {}: {}ms'.format(dns_target, round(dns_result['lookup_time_ms'], 3))
 
                 # drop abbreviated results in log file
                 self.file_logger.info("DNS results: {}".format(result_str))
@@ -98,9 +218,17 @@ class DnsTester(object):
                     'time': get_timestamp(config_vars),
                     'dns_index': int(dns_index),
                     'dns_target': str(dns_target),
-                    'lookup_time_ms': int(dns_result)
+                    'lookup_time_ms': int(round(dns_result['lookup_time_ms']))
                 }
 
+                # resolver level details (not available from system resolver)
+                if 'dns_server' in dns_result:
+                    results_dict['dns_server'] = str(dns_result['dns_server'])
+                    results_dict['query_type'] = str(dns_result['query_type'])
+                    results_dict['lookup_time_us'] = int(round(dns_result['lookup_time_ms'] * 1000))
+                    results_dict['rcode'] = int(dns_result['rcode'])
+                    results_dict['cache_hit'] = int(dns_result['cache_hit'])
+
                 # define column headers for CSV
                 column_headers = list(results_dict.keys())
 
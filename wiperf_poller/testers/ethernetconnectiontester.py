@@ -84,29 +84,25 @@ class EthernetConnectionTester(object):
                     lockf_obj.delete_lock_file()
                     sys.exit()
 
-        # Check we can get to the mgt platform (function will exit script if no connectivity)
-        self.file_logger.info("Checking we can get to the management platform (host = {}, port = {}, type = {})".format(config_vars['data_host'], 
-            config_vars['data_port'], config_vars['exporter_type']))
-
+        # Check we can get to each mgt platform (results for a platform that
+        # cannot be reached are spooled)
         mgt_connection_obj = MgtConnectionTester(config_vars, self.file_logger, self.platform)
 
-        # if we can't hit the mgt platform, set exporter to the local spooler if spooling enabled
+        # if we can't hit any mgt platform, carry on only if we can spool results
         exit_msg = ''
 
-        if not mgt_connection_obj.check_connection(lockf_obj): 
-     
-            # Can't get to mgt platform - spooling enabled? 
+        if not exporter_obj.check_destinations(mgt_connection_obj):
+
+            # Can't get to mgt platform - spooling enabled?
             if config_vars['results_spool_enabled'] == 'yes':
-                
+
                 # We have spooling enabled, are we time-sync'ed?
                 if not time_synced():
                     exit_msg = "Unable to reach mgt platform, unable to spool as probe not time sync'ed"
-                else:
-                    config_vars['exporter_type'] = 'spooler'
-            
+
             else:
                 exit_msg = 'Unable to reach mgt platform, local spooling disabled - exiting'
-        
+
         if exit_msg:
             self.file_logger.warning(exit_msg)
             lockf_obj.delete_lock_file()
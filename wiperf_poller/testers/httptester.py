@@ -3,10 +3,13 @@ A simple class to perform a http get and return the time taken
 '''
 import time
 import socket
+import threading
 import warnings
 import requests
 from requests.exceptions import HTTPError
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from wiperf_poller.helpers.httpprobe import HttpProbe, uses_proxy
 from wiperf_poller.helpers.timefunc import get_timestamp
 
 class HttpTester(object):
@@ -24,7 +27,11 @@ class HttpTester(object):
         self.http_server_response_time = 0
         self.http_status_code = 0
 
-    def http_get(self, http_target):
+        # http gets may run concurrently, so results are only saved as
+        # attributes (for the get_* methods) under a lock
+        self.lock = threading.Lock()
+
+    def http_get(self, http_target, timeout=5):
         '''
         This function will do a http/https get to the specifed target URL
 
@@ -35,15 +42,18 @@ class HttpTester(object):
 
         self.file_logger.debug("HTTP test target: {}".format(http_target))
 
+        status_code = 0
+        server_response_time = 0
+
         # TODO: Perform 3 tests and avg best 2 to remove anomalies?
         start = time.time()
         try:
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            response = requests.get(http_target, verify=False, timeout=5)
-            self.http_status_code = response.status_code
+            response = requests.get(http_target, verify=False, timeout=float(timeout))
+            status_code = response.status_code
 
             # server reposnse time (uS , converted to mS)- http headers, not full page load
-            self.http_server_response_time = int(response.elapsed.microseconds/1000)
+            server_response_time = int(response.elapsed.total_seconds() * 1000)
 
             # If the response was successful, no Exception will be raised
             response.raise_for_status()
@@ -53,21 +63,78 @@ class HttpTester(object):
             self.file_logger.error('Other error occurred: {}'.format(err))
 
         end = time.time()
-        time_taken = int(round((end - start) * 1000))
-        self.http_get_duration = time_taken
+        get_duration = int(round((end - start) * 1000))
 
         # if we got a status code of zero, then something went wrong
         # therefore we need to drop our results to avoid bad duration results
-        if self.http_status_code == 0:
-            self.http_status_code = False
-            self.http_get_duration = False
-            self.http_server_response_time = False
+        if status_code == 0:
+            status_code = False
+            get_duration = False
+            server_response_time = False
+
+        with self.lock:
+            self.http_status_code = status_code
+            self.http_get_duration = get_duration
+            self.http_server_response_time = server_response_time
 
-        self.file_logger.debug("http get for: {} : {}mS, server repsonse time: {}ms (code: {}).".format(http_target, self.http_get_duration, self.http_server_response_time, self.http_status_code))
+        self.file_logger.debug("http get for: {} : {}mS, server repsonse time: {}ms (code: {}).".format(http_target, get_duration, server_response_time, status_code))
 
         # return status code & elapsed duration in mS
-        return (self.http_status_code, self.http_get_duration, self.http_server_response_time)
+        return (status_code, get_duration, server_response_time)
     
+    def http_probe(self, http_target, timeout=5, mode='cold'):
+        '''
+        This function will do a http/https get to the specifed target URL, with
+        a timing breakdown of each phase of the get (see HttpProbe.get()).
+
+        In 'warm' mode, an initial (untimed) get is performed to open a
+        connection to the target, which is then re-used for the timed get.
+
+        If a proxy is configured for the target, the get is performed with the
+        requests module (with no timing breakdown).
+
+        Returns False if the get fails, otherwise a dict of results (including
+        server_response_ms: the time taken to receive the response headers).
+        '''
+        self.file_logger.debug("HTTP test target: {} (mode: {})".format(http_target, mode))
+
+        if uses_proxy(http_target):
+            self.file_logger.debug("Proxy configured for {}, using requests module for http test.".format(http_target))
+            (status_code, get_duration, server_response_time) = self.http_get(http_target, timeout)
+
+            if not status_code:
+                return False
+
+            return {'status_code': status_code, 'total_ms': get_duration, 'server_response_ms': server_response_time}
+
+        probe = HttpProbe(self.file_logger, timeout=timeout)
+
+        try:
+            if mode == 'warm':
+                probe.get(http_target)
+
+            result = probe.get(http_target)
+
+        except Exception as err:
+            self.file_logger.error('Error occurred during http get to {}: {}'.format(http_target, err))
+            return False
+
+        finally:
+            probe.close()
+
+        # server response time as measured by the requests module (time until
+        # the response headers are received, including dns, connect & tls)
+        result['server_response_ms'] = result['dns_ms'] + result['connect_ms'] + result['tls_ms'] + result['ttfb_ms']
+
+        if result['status_code'] >= 400:
+            self.file_logger.error('HTTP error occurred: {} for url: {}'.format(result['status_code'], http_target))
+
+        self.file_logger.debug("http get for: {} : {}mS (dns: {}mS, connect: {}mS, tls: {}mS, ttfb: {}mS, transfer: {}mS, bytes: {}, reused: {}) (code: {}).".format(
+            http_target, round(result['total_ms'], 2), round(result['dns_ms'], 2), round(result['connect_ms'], 2), round(result['tls_ms'], 2),
+            round(result['ttfb_ms'], 2), round(result['transfer_ms'], 2), result['bytes'], result['reused'], result['status_code']))
+
+        return result
+
     def run_tests(self, status_file_obj, config_vars, exporter_obj, watchd, check_correct_mode_interface,):
 
         self.file_logger.info("Starting HTTP tests...")
@@ -89,15 +156,12 @@ class HttpTester(object):
         all_tests_fail = True
         tests_passed = True
 
-        for http_target in http_targets:
-
-            http_index += 1
+        # list of (index, target) tuples, skipping empty targets
+        indexed_targets = [(index + 1, http_target) for index, http_target in enumerate(http_targets) if http_target != '']
 
-            # move on to next if no HTTP entry data
-            if http_target == '':
-                continue
+        # check tests will go over correct interface
+        for _index, http_target in indexed_targets:
 
-            # check test will go over correct interface
             target_hostname = http_target.split('/')[2]
             if check_correct_mode_interface(target_hostname, config_vars, self.file_logger):
                 pass
@@ -107,65 +171,79 @@ class HttpTester(object):
                 # we will break here if we have an issue as something bad has happened...don't want to run more tests
                 config_vars['test_issue'] = True
                 tests_passed = False
+                indexed_targets = []
                 break
 
-            self.file_logger.info("Starting http test to : {}".format(http_target))
+        # run the http tests (concurrently, up to the configured limit)
+        timeout = config_vars['http_timeout']
+        mode = config_vars['http_mode']
 
-            http_result = self.http_get(http_target)
+        http_results = []
 
-            if http_result:
+        if indexed_targets:
+            self.file_logger.info("Starting http tests to : {}".format(", ".join([target for _index, target in indexed_targets])))
+
+            with ThreadPoolExecutor(max_workers=max(int(config_vars['http_concurrency']), 1)) as executor:
+                http_results = list(executor.map(lambda target: self.http_probe(target[1], timeout, mode), indexed_targets))
 
-                http_status_code = http_result[0]
-                http_get_time = http_result[1]
-                http_server_response_time = http_result[2]
-
-                # test if http get returned a code - False = bad http get test
-                if http_status_code:
-                    # summarise result for log
-                    result_str = ' {}: {}ms (status code: {})'.format(http_target, http_get_time, http_status_code)
-
-                    # drop abbreviated results in log file
-                    self.file_logger.info("HTTP results: {}".format(result_str))
-
-                    results_dict = {
-                        'time': get_timestamp(config_vars),
-                        'http_index': int(http_index),
-                        'http_target': str(http_target),
-                        'http_get_time_ms': int(http_get_time),
-                        'http_status_code': int(http_status_code),
-                        'http_server_response_time_ms': int(http_server_response_time)
-                    }
-
-                    # define column headers for CSV
-                    column_headers = list(results_dict.keys())
-
-                    # dump the results
-                    data_file = config_vars['http_data_file']
-                    test_name = "HTTP"
-                    if exporter_obj.send_results(config_vars, results_dict, column_headers, data_file, test_name, self.file_logger, delete_data_file=delete_file):
-                        self.file_logger.info("HTTP results sent OK.")
-                    else:
-                        self.file_logger.error("Issue sending HTTP results")
-                        tests_passed = False
-
-                    all_tests_fail = False
+        for (http_index, http_target), http_result in zip(indexed_targets, http_results):
 
+            # test if http get returned a result - False = bad http get test
+            if http_result:
+
+                http_status_code = http_result['status_code']
+                http_get_time = int(round(http_result['total_ms']))
+                http_server_response_time = int(round(http_result['server_response_ms']))
+
+                # summarise result for log
+                result_str = ' {}: {}ms (status code: {})'.format(http_target, http_get_time, http_status_code)
+
+                # drop abbreviated results in log file
+                self.file_logger.info("HTTP results: {}".format(result_str))
+
+                results_dict = {
+                    'time': get_timestamp(config_vars),
+                    'http_index': int(http_index),
+                    'http_target': str(http_target),
+                    'http_get_time_ms': int(http_get_time),
+                    'http_status_code': int(http_status_code),
+                    'http_server_response_time_ms': int(http_server_response_time)
+                }
+
+                # phase timing breakdown (not available if via proxy)
+                if 'dns_ms' in http_result:
+                    results_dict['http_dns_time_ms'] = round(float(http_result['dns_ms']), 2)
+                    results_dict['http_connect_time_ms'] = round(float(http_result['connect_ms']), 2)
+                    results_dict['http_tls_time_ms'] = round(float(http_result['tls_ms']), 2)
+                    results_dict['http_ttfb_ms'] = round(float(http_result['ttfb_ms']), 2)
+                    results_dict['http_transfer_time_ms'] = round(float(http_result['transfer_ms']), 2)
+                    results_dict['http_bytes'] = int(http_result['bytes'])
+                    results_dict['http_mbps'] = round(float(http_result['mbps']), 2)
+                    results_dict['http_redirects'] = int(http_result['redirects'])
+                    results_dict['http_mode'] = str(mode)
+
+                # define column headers for CSV
+                column_headers = list(results_dict.keys())
+
+                # dump the results
+                data_file = config_vars['http_data_file']
+                test_name = "HTTP"
+                if exporter_obj.send_results(config_vars, results_dict, column_headers, data_file, test_name, self.file_logger, delete_data_file=delete_file):
+                    self.file_logger.info("HTTP results sent OK.")
                 else:
-                    self.file_logger.error("HTTP test had issue and failed, check agent.log")
+                    self.file_logger.error("Issue sending HTTP results")
                     tests_passed = False
 
-                self.file_logger.info("HTTP test ended.")
-
-                # Make sure we don't delete data file next time around
-                delete_file = False
+                all_tests_fail = False
 
             else:
-                self.file_logger.error(
-                    "HTTP test error - no results (check logs) - exiting HTTP tests")
-                config_vars['test_issue'] = True
-                config_vars['test_issue_descr'] = "HTTP test failure"
+                self.file_logger.error("HTTP test had issue and failed, check agent.log")
                 tests_passed = False
-                break
+
+            self.file_logger.info("HTTP test ended.")
+
+            # Make sure we don't delete data file next time around
+            delete_file = False
 
         # if all tests fail, and there are more than 2 tests, signal a possible issue
         if all_tests_fail and (http_index > 1):
@@ -14,8 +14,12 @@ from iperf3 import Client
 import timeout_decorator
 
 from wiperf_poller.testers.pingtester import PingTester
+from wiperf_poller.helpers.iperf3matrix import Iperf3Matrix
+from wiperf_poller.helpers.iperf3runner import Iperf3Runner
+from wiperf_poller.helpers.os_cmds import IPERF3_CMD
 from wiperf_poller.helpers.route import inject_test_traffic_static_route
 from wiperf_poller.helpers.timefunc import get_timestamp
+from wiperf_poller.helpers.voicequality import mos_scores, interval_mos_stats
 
 class IperfTester(object):
     """
@@ -27,9 +31,98 @@ class IperfTester(object):
         self.platform = platform
         self.file_logger = file_logger
 
+        # iperf3 program runner (the iperf3 python module is used if the
+        # iperf3 program is not available)
+        self.iperf3_runner = None
+        if IPERF3_CMD:
+            self.iperf3_runner = Iperf3Runner(file_logger)
+
+    def tcp_iperf_client_test(self, server_hostname, duration=10, port=5201, streams=1, reverse=False, bandwidth=0, debug=False):
+
+        if not self.iperf3_runner:
+            return self.tcp_iperf_module_test(server_hostname, duration=duration, port=port, streams=streams, reverse=reverse,
+                bandwidth=bandwidth, debug=debug)
+
+        if debug:
+            self.file_logger.debug("TCP iperf server test params: server: {}, port: {}, protocol: {}, duration: {}, streams: {}, reverse: {}".format(
+                server_hostname, port, "TCP", duration, streams, reverse))
+
+        self.file_logger.info("Starting tcp iperf3 test...")
+
+        result = self.iperf3_runner.run(server_hostname, port=port, protocol='tcp', duration=duration, bandwidth=bandwidth, streams=streams,
+            reverse=reverse, on_interval=self.log_interval)
+
+        if result.error:
+            self.file_logger.error("iperf TCP test error: {}".format(result.error))
+            return False
+
+        return result
+
+    def udp_iperf_client_test(self, server_hostname, duration=10, port=5201, bandwidth=10000000, reverse=False, debug=False):
+
+        if not self.iperf3_runner:
+            return self.udp_iperf_module_test(server_hostname, duration=duration, port=port, bandwidth=bandwidth, reverse=reverse, debug=debug)
+
+        if debug:
+            self.file_logger.debug("UDP iperf server test params: server: {}, port: {}, protocol: {}, duration: {}, bandwidth: {}, reverse: {}".format(
+                server_hostname, port, 'udp', duration, bandwidth, reverse))
+
+        self.file_logger.info("Starting udp iperf3 test...")
+
+        result = self.iperf3_runner.run(server_hostname, port=port, protocol='udp', duration=duration, bandwidth=bandwidth, blksize=500,
+            reverse=reverse, on_interval=self.log_interval)
+
+        if result.error:
+            self.file_logger.error("iperf UDP test error: {}".format(result.error))
+            return False
+
+        return result
+
+    def log_interval(self, interval):
+
+        self.file_logger.debug("iperf3 interval {:.1f}-{:.1f}s: {:.1f} Mbps (retransmits: {}, cwnd: {} KB, jitter: {} ms, lost: {}%)".format(
+            interval['start'], interval['end'], interval['mbps'], interval['retransmits'], interval['cwnd_kbytes'],
+            interval['jitter_ms'], interval['lost_percent']))
+
+    def interval_stats(self, result, protocol):
+        """
+        Summarise the interval results of a test (if available) in to a dict of
+        additional results fields
+        """
+        intervals = [interval for interval in getattr(result, 'intervals', []) if not interval['omitted']]
+
+        if not intervals:
+            return {}
+
+        stats = {}
+
+        mbps = [interval['mbps'] for interval in intervals]
+        stats['interval_mbps_min'] = float(round(min(mbps), 1))
+        stats['interval_mbps_max'] = float(round(max(mbps), 1))
+
+        if protocol == 'tcp':
+            cwnd = [interval['cwnd_kbytes'] for interval in intervals if interval['cwnd_kbytes'] is not None]
+            if cwnd:
+                stats['cwnd_max_kbytes'] = float(round(max(cwnd), 1))
+        else:
+            # jitter & loss are only reported by the receiving end of the test
+            # (the server's intervals, unless running in reverse mode)
+            receiver_intervals = [interval for interval in getattr(result, 'receiver_intervals', intervals) if not interval['omitted']]
+
+            jitter = [interval['jitter_ms'] for interval in receiver_intervals if interval['jitter_ms'] is not None]
+            if jitter:
+                stats['interval_jitter_max_ms'] = float(round(max(jitter), 1))
+            else:
+                self.file_logger.info("No interval jitter/loss results returned by iperf3 (server output not available?)")
+
+            lost = [interval['lost_percent'] for interval in receiver_intervals if interval['lost_percent'] is not None]
+            if lost:
+                stats['interval_lost_max_percent'] = float(round(max(lost), 1))
+
+        return stats
 
     @timeout_decorator.timeout(60, use_signals=False)
-    def tcp_iperf_client_test(self, server_hostname, duration=10, port=5201, debug=False):
+    def tcp_iperf_module_test(self, server_hostname, duration=10, port=5201, streams=1, reverse=False, bandwidth=0, debug=False):
 
         result= ''
 
@@ -39,6 +132,10 @@ class IperfTester(object):
         iperf_client.port = port
         iperf_client.protocol = 'tcp'
         iperf_client.duration = duration
+        iperf_client.num_streams = streams
+        iperf_client.reverse = reverse
+        if bandwidth:
+            iperf_client.bandwidth = bandwidth
 
         if debug:
             self.file_logger.debug("TCP iperf server test params: server: {}, port: {}, protocol: {}, duration: {}".format(server_hostname, port, "TCP", duration))
@@ -63,27 +160,10 @@ class IperfTester(object):
         Returns:
             MOS value -- float (1.0 to 4.5)
         """
-        #effective_latency=(rtt_avg_ms/2*jitter_ms)+40
-        effective_latency=(rtt_avg_ms/2) + (2*jitter_ms) + 10.0
-
-        if effective_latency < 160:
-            R = 93.2 - (effective_latency/40)
-        else:
-            R = 93.2 - ((effective_latency-120)/10)
-
-        R = R - 2.5 * lost_percent
-
-        if R < 0 :
-            mos_score=1.0
-        elif R <100:
-            mos_score = 1 + 0.035*R + 0.000007*R*(R-60)*(100-R)
-        else:
-            mos_score=4.5
-        
-        return mos_score
+        return mos_scores(rtt_avg_ms, jitter_ms, lost_percent)[0]
 
     @timeout_decorator.timeout(60, use_signals=False)
-    def udp_iperf_client_test(self, server_hostname, duration=10, port=5201, bandwidth=10000000, debug=False):
+    def udp_iperf_module_test(self, server_hostname, duration=10, port=5201, bandwidth=10000000, reverse=False, debug=False):
 
         iperf_client = Client()
 
@@ -95,6 +175,7 @@ class IperfTester(object):
         iperf_client.blksize = 500
         iperf_client.num_streams = 1
         iperf_client.zerocopy = True
+        iperf_client.reverse = reverse
 
         if debug:
             self.file_logger.debug("UDP iperf server test params: server: {}, port: {}, protocol: {}, duration: {}, bandwidth: {}".format(server_hostname, port, 'udp', duration, bandwidth))
@@ -114,6 +195,8 @@ class IperfTester(object):
         duration = int(config_vars['iperf3_tcp_duration'])
         port = int(config_vars['iperf3_tcp_port'])
         server_hostname = config_vars['iperf3_tcp_server_hostname']
+        streams = int(config_vars['iperf3_tcp_streams'])
+        reverse = config_vars['iperf3_tcp_reverse'] == 'yes'
 
         self.file_logger.info("Starting iperf3 tcp test ({}:{})...".format(server_hostname, str(port)))
         status_file_obj.write_status_file("iperf3 tcp")
@@ -135,7 +218,7 @@ class IperfTester(object):
         # run iperf test
         result = False
         try:
-            result = self.tcp_iperf_client_test(server_hostname, duration=duration, port=port, debug=False)
+            result = self.tcp_iperf_client_test(server_hostname, duration=duration, port=port, streams=streams, reverse=reverse, debug=False)
         except:
             self.file_logger.error("TCP iperf3 test process timed out.")
 
@@ -149,6 +232,7 @@ class IperfTester(object):
             results_dict['sent_bytes'] =  int(result.sent_bytes)
             results_dict['received_bytes'] =  int(result.received_bytes)
             results_dict['retransmits'] =  int(result.retransmits)
+            results_dict.update(self.interval_stats(result, 'tcp'))
 
             # define column headers for CSV
             column_headers = list(results_dict.keys())
@@ -178,6 +262,7 @@ class IperfTester(object):
         port = int(config_vars['iperf3_udp_port'])
         server_hostname = config_vars['iperf3_udp_server_hostname']
         bandwidth = int(config_vars['iperf3_udp_bandwidth'])
+        reverse = config_vars['iperf3_udp_reverse'] == 'yes'
 
         self.file_logger.info("Starting iperf3 udp test ({}:{})...".format(server_hostname, str(port)))
         status_file_obj.write_status_file("iperf3 udp")
@@ -197,9 +282,8 @@ class IperfTester(object):
                 return False
 
         # Run a ping to the iperf server to get an rtt to feed in to MOS score calc
+        # (an unmeasured warm-up ping is sent first to seed the arp cache)
         ping_obj = PingTester(self.file_logger, platform=self.platform)
-        ping_obj.ping_host(server_hostname, 1) # one ping to seed arp cache
-        
         ping_result = ping_obj.ping_host(server_hostname, 5)
 
         # ping results
@@ -211,7 +295,7 @@ class IperfTester(object):
         # Run the iperf test
         result = False
         try:
-            result = self.udp_iperf_client_test(server_hostname, duration=duration, port=port, bandwidth=bandwidth, debug=False)
+            result = self.udp_iperf_client_test(server_hostname, duration=duration, port=port, bandwidth=bandwidth, reverse=reverse, debug=False)
         except:
             self.file_logger.error("UDP iperf3 test process timed out")
 
@@ -227,6 +311,8 @@ class IperfTester(object):
             results_dict['lost_packets'] =  int(result.lost_packets)
             results_dict['lost_percent'] =  float(round(result.lost_percent, 1))
             results_dict['mos_score'] = float(round(self.calculate_mos(rtt_avg_ms,results_dict['jitter_ms'], results_dict['lost_percent']), 2))
+            results_dict.update(self.interval_stats(result, 'udp'))
+            results_dict.update(interval_mos_stats(getattr(result, 'receiver_intervals', []), rtt_avg_ms))
 
             # define column headers for CSV
             column_headers = list(results_dict.keys())
@@ -254,4 +340,105 @@ class IperfTester(object):
 
         else:
             self.file_logger.error("iperf3 udp test failed.")
-            return False
\ No newline at end of file
+            return False
+
+    def run_matrix_tests(self, config_vars, status_file_obj, check_correct_mode_interface, exporter_obj):
+        """
+        Run the next set of tests from the iperf3 test matrix (as many as will
+        fit in the matrix time budget). Tests are run one after another.
+        """
+        matrix = Iperf3Matrix(config_vars, self.file_logger)
+
+        if not matrix.cells:
+            self.file_logger.error("No iperf3 matrix tests configured (check servers, protocols & directions)")
+            return False
+
+        duration = matrix.duration
+        streams = int(config_vars['iperf3_matrix_streams'])
+
+        status_file_obj.write_status_file("iperf3 matrix")
+
+        # routes already checked/fixed this cycle: {server: True/False}
+        route_ok = {}
+        tests_passed = True
+
+        for cell in matrix.get_tests():
+
+            self.file_logger.info("Starting iperf3 matrix test: {}".format(cell.cell_id))
+
+            # check test to iperf3 server will go via correct interface
+            if cell.server_hostname not in route_ok:
+
+                route_ok[cell.server_hostname] = True
+
+                if not check_correct_mode_interface(cell.server_hostname, config_vars, self.file_logger):
+
+                    # if route looks wrong, try to fix it
+                    self.file_logger.warning("Route to iperf3 server {} not over correct interface...injecting static route".format(cell.server_hostname))
+
+                    if not inject_test_traffic_static_route(cell.server_hostname, config_vars, self.file_logger):
+                        route_ok[cell.server_hostname] = False
+
+            if not route_ok[cell.server_hostname]:
+                self.file_logger.error("Unable to run iperf3 matrix test {} as route to destination not over correct interface...bypassing test".format(cell.cell_id))
+                tests_passed = False
+                continue
+
+            # run iperf test
+            result = False
+            try:
+                if cell.protocol == 'tcp':
+                    result = self.tcp_iperf_client_test(cell.server_hostname, duration=duration, port=cell.port, streams=streams,
+                        reverse=cell.reverse, bandwidth=cell.bandwidth)
+                else:
+                    result = self.udp_iperf_client_test(cell.server_hostname, duration=duration, port=cell.port,
+                        bandwidth=cell.bandwidth, reverse=cell.reverse)
+            except:
+                self.file_logger.error("iperf3 matrix test process timed out ({})".format(cell.cell_id))
+
+            if not result:
+                self.file_logger.error("iperf3 matrix test failed: {}".format(cell.cell_id))
+                tests_passed = False
+                continue
+
+            # results are tagged with the matrix cell details
+            results_dict = {}
+
+            results_dict['time'] = get_timestamp(config_vars)
+            results_dict['cell'] = cell.cell_id
+            results_dict['server'] = cell.server_hostname
+            results_dict['port'] = cell.port
+            results_dict['direction'] = cell.direction
+            results_dict['bandwidth'] = cell.bandwidth
+
+            if cell.protocol == 'tcp':
+                results_dict['sent_mbps'] =  float(round(result.sent_Mbps, 1))
+                results_dict['received_mbps'] =  float(round(result.received_Mbps, 1))
+                results_dict['sent_bytes'] =  int(result.sent_bytes)
+                results_dict['received_bytes'] =  int(result.received_bytes)
+                results_dict['retransmits'] =  int(result.retransmits)
+                data_file = config_vars['iperf3_matrix_tcp_data_file']
+            else:
+                results_dict['bytes'] =  int(result.bytes)
+                results_dict['mbps'] =  float(round(result.Mbps, 1))
+                results_dict['jitter_ms'] =  float(round(result.jitter_ms, 1))
+                results_dict['packets'] =  int(result.packets)
+                results_dict['lost_packets'] =  int(result.lost_packets)
+                results_dict['lost_percent'] =  float(round(result.lost_percent, 1))
+                data_file = config_vars['iperf3_matrix_udp_data_file']
+
+            results_dict.update(self.interval_stats(result, cell.protocol))
+            results_dict['location'] = config_vars['location']
+
+            column_headers = list(results_dict.keys())
+
+            self.file_logger.info("Iperf3 matrix results ({}): {}".format(cell.cell_id, results_dict))
+
+            test_name = "iperf3_matrix_{}".format(cell.protocol)
+
+            if not exporter_obj.send_results(config_vars, results_dict, column_headers, data_file, test_name, self.file_logger):
+                self.file_logger.error("Error sending iperf3 matrix test result.")
+                tests_passed = False
+
+        self.file_logger.info("Iperf3 matrix tests ended.")
+        return tests_passed
@@ -8,6 +8,13 @@ from wiperf_poller.helpers.ethernetadapter import EthernetAdapter
 from wiperf_poller.helpers.route import check_correct_mgt_interface, inject_mgt_static_route, is_ipv6
 from wiperf_poller.helpers.os_cmds import NC_CMD
 
+# config.ini host & port parameters of each exporter type
+EXPORTER_HOST_PORT = {
+    'splunk': ('splunk_host', 'splunk_port'),
+    'influxdb': ('influx_host', 'influx_port'),
+    'influxdb2': ('influx2_host', 'influx2_port'),
+}
+
 class MgtConnectionTester(object):
     """
     Class to implement network mgt connection tests for wiperf
@@ -19,11 +26,24 @@ class MgtConnectionTester(object):
         self.platform = platform
         self.file_logger = file_logger
 
-    def check_connection(self, lockf_obj):
+    def check_connection(self, lockf_obj, exporter_type=None):
+        """
+        Check that the mgt platform of the exporter type supplied (or the
+        first exporter type configured if none supplied) can be reached
+
+        Returns:
+            bool: True if the mgt platform can be reached
+        """
+        if exporter_type is None:
+            exporter_type = self.config_vars['exporter_type']
+
+        if exporter_type not in EXPORTER_HOST_PORT:
+            self.file_logger.info("  Unknown exporter type configured in config.ini: {} (exiting)".format(exporter_type))
+            sys.exit()
 
-        exporter_type = self.config_vars['exporter_type']
-        data_host = self.config_vars['data_host']
-        data_port = self.config_vars['data_port']
+        host_param, port_param = EXPORTER_HOST_PORT[exporter_type]
+        data_host = self.config_vars[host_param]
+        data_port = self.config_vars[port_param]
         mgt_interface = self.config_vars['mgt_if']
 
         # check if the route to the mgt server is over the correct interface...fix with route injection if not
@@ -38,11 +58,10 @@ class MgtConnectionTester(object):
                 if check_correct_mgt_interface(data_host, mgt_interface, self.file_logger):
                     self.file_logger.info("  Routing issue corrected OK.")
                 else:
-                    self.file_logger.warning("  We still have a routing issue. Will have to exit as mgt traffic over correct interface not possible")
+                    self.file_logger.warning("  We still have a routing issue. Mgt platform cannot be used as mgt traffic over correct interface not possible")
                     self.file_logger.warning("  Suggest making static routing additions or adding an additional metric to the interface causing the issue.")
                     self.file_logger.warning("  (*** Note ***: check you have configured the correct mgt interface if this message persists)")
-                    lockf_obj.delete_lock_file()
-                    sys.exit()
+                    return False
 
         # if we are using hec, make sure we can access the hec network port, otherwise we are wasting our time
         if exporter_type == 'splunk':
@@ -113,9 +132,5 @@ class MgtConnectionTester(object):
                 return False
 
             return True
-        
-        else:
-            self.file_logger.info("  Unknown exporter type configured in config.ini: {} (exiting)".format(exporter_type))
-            sys.exit()
 
 
@@ -7,12 +7,15 @@ import time
 import re
 import subprocess
 from sys import stderr
+from wiperf_poller.helpers.icmp import IcmpPinger, rtt_stats
 from wiperf_poller.helpers.os_cmds import PING_CMD
 from wiperf_poller.helpers.timefunc import get_timestamp
+from wiperf_poller.helpers.voicequality import ping_mos_stats
 
 class PingTester(object):
     '''
-    A class to ping a host - a basic wrapper around a CLI ping command
+    A class to ping hosts - uses an in-process ICMP engine, falling back to
+    the CLI ping command if ICMP sockets are not available
     '''
 
     def __init__(self, file_logger, platform="rpi"):
@@ -46,8 +49,67 @@ class PingTester(object):
             'rtt_max': self.rtt_max,
             'rtt_mdev': self.rtt_mdev}
 
+        (When the ICMP engine is used, 'rtt_p50', 'rtt_p95', 'jitter' and
+        'rtts' (a list of the rtt of each packet) are also returned)
         '''
+        self.host = host
+
+        ping_result = self.ping_hosts([host], count, ping_timeout, ping_interval)[0]
+
+        if ping_result:
+            self.pkts_tx = ping_result['pkts_tx']
+            self.pkts_rx = ping_result['pkts_rx']
+            self.pkt_loss = ping_result['pkt_loss']
+            self.test_time = ping_result['test_time']
+            self.rtt_min = ping_result['rtt_min']
+            self.rtt_avg = ping_result['rtt_avg']
+            self.rtt_max = ping_result['rtt_max']
+            self.rtt_mdev = ping_result['rtt_mdev']
+
+        return ping_result
+
+    def ping_hosts(self, hosts, count, ping_timeout=1, ping_interval=0.2):
+        '''
+        Ping a list of hosts concurrently. Returns a list of results (in the
+        same order as the hosts supplied), in the format returned by ping_host()
+        '''
+        self.file_logger.debug("Pinging hosts: {} (count={})".format(", ".join(hosts), count))
+
+        try:
+            pinger = IcmpPinger(self.file_logger, timeout=ping_timeout, interval=ping_interval)
+            ping_results = pinger.ping_hosts(hosts, count)
+        except OSError as err:
+            self.file_logger.warning("Unable to use ICMP socket ({}), using ping command instead.".format(err))
+            return [self._ping_host_cmd(host, count, ping_timeout, ping_interval) for host in hosts]
+
+        results = []
+
+        for ping_result in ping_results:
+
+            if not ping_result:
+                results.append(False)
+                continue
+
+            if not ping_result['pkts_rx']:
+                self.file_logger.error("Hit an error when pinging {} : no replies received".format(ping_result['host']))
+                results.append(False)
+                continue
+
+            ping_result.update(rtt_stats(ping_result['rtts']))
+
+            self.file_logger.debug("Ping rtt samples (mS) for {}: {}".format(ping_result['host'],
+                [round(rtt, 3) for rtt in ping_result['rtts']]))
+            self.file_logger.info('ping_host: {}, pkts_tx: {}, pkts_rx: {}, pkt_loss: {}, rtt_avg: {}'.format(
+                ping_result['host'], ping_result['pkts_tx'], ping_result['pkts_rx'], ping_result['pkt_loss'], round(ping_result['rtt_avg'], 3)))
+
+            results.append(ping_result)
 
+        return results
+
+    def _ping_host_cmd(self, host, count, ping_timeout=1, ping_interval=0.2):
+        '''
+        Ping a host using the CLI ping command (format of results as ping_host())
+        '''
         self.host = host
 
         self.file_logger.debug("Pinging host: " + str(host) + " (count=" + str(count) + ")")
@@ -160,48 +222,37 @@ class PingTester(object):
       
         tests_passed = True
 
-        # initial ping to populate arp cache and avoid arp timeput for first test ping
-        for ping_host in ping_hosts:
-            if ping_host == '':
-                continue
-            else:
-                # check for def_gw keyword
-                if ping_host == 'def_gw':
-                    ping_host = adapter.get_def_gw()
+        # check tests will go over correct interface
+        for index, ping_host in enumerate(ping_hosts):
 
-                # check tests will go over correct interface
-                if check_correct_mode_interface(ping_host, config_vars, self.file_logger):
-                    self.ping_host(ping_host, 1)
-                else:
-                    self.file_logger.error(
-                        "Unable to ping {} as route to destination not over correct interface...bypassing ping tests".format(ping_host))
-                    # we will break here if we have an issue as something bad has happened...don't want to run more tests
-                    config_vars['test_issue'] = True
-                    tests_passed = False
-                    break
+            # check for def_gw keyword
+            if ping_host == 'def_gw':
+                ping_host = adapter.get_def_gw()
+                ping_hosts[index] = ping_host
 
-        # run actual ping tests
+            if not check_correct_mode_interface(ping_host, config_vars, self.file_logger):
+                self.file_logger.error(
+                    "Unable to ping {} as route to destination not over correct interface...bypassing ping tests".format(ping_host))
+                # we will break here if we have an issue as something bad has happened...don't want to run more tests
+                config_vars['test_issue'] = True
+                tests_passed = False
+                break
+
+        # run actual ping tests (all hosts pinged at the same time)
         ping_index = 0
         all_tests_fail = True
 
-        for ping_host in ping_hosts:
+        # bail if we have had DNS issues
+        if config_vars['test_issue'] == True:
+            self.file_logger.error("As we had previous issues, bypassing ping tests.")
+            ping_results = []
+        else:
+            ping_results = self.ping_hosts(ping_hosts, ping_count, config_vars['ping_timeout'], config_vars['ping_interval'])
 
-            # bail if we have had DNS issues
-            if config_vars['test_issue'] == True:
-                self.file_logger.error("As we had previous issues, bypassing ping tests.")
-                break
+        for ping_result in ping_results:
 
             ping_index += 1
 
-            if ping_host == '':
-                continue
-            else:
-                # check for def_gw keyword
-                if ping_host == 'def_gw':
-                    ping_host = adapter.get_def_gw()
-
-                ping_result = self.ping_host(ping_host, ping_count)
-
             results_dict = {}
 
             # ping results
@@ -218,6 +269,13 @@ class PingTester(object):
                 results_dict['rtt_max_ms'] = round(float(ping_result['rtt_max']), 2)
                 results_dict['rtt_mdev_ms'] = round(float(ping_result['rtt_mdev']), 2)
 
+                # extra stats only available from the ICMP engine
+                if 'rtts' in ping_result:
+                    results_dict['rtt_p50_ms'] = round(float(ping_result['rtt_p50']), 2)
+                    results_dict['rtt_p95_ms'] = round(float(ping_result['rtt_p95']), 2)
+                    results_dict['jitter_ms'] = round(float(ping_result['jitter']), 2)
+                    results_dict.update(ping_mos_stats(ping_result['rtts'], ping_result['pkt_loss']))
+
                 # define column headers for CSV
                 column_headers = list(results_dict.keys())
 
@@ -9,12 +9,14 @@ import os
 import subprocess
 import timeout_decorator
 from wiperf_poller.helpers.os_cmds import SMB_CP, SMB_MOUNT, MOUNT, LS_CMD, UMOUNT_CMD
+from wiperf_poller.helpers.smbengine import SmbEngine, smb_modules, import_err
 from wiperf_poller.helpers.route import inject_test_traffic_static_route
 from wiperf_poller.helpers.timefunc import get_timestamp
 
 class SmbTester(object):
     '''
-    A class to perform an SMB copy from a host - a basic wrapper around a CLI copy and mount command
+    A class to perform an SMB copy from a host - uses the smbprotocol module
+    if available, otherwise a basic wrapper around a CLI copy and mount command
     '''
 
     def __init__(self, file_logger, platform="rpi"):
@@ -206,29 +208,123 @@ class SmbTester(object):
             'rate':self.transfert_rate}
 
 
+    def smb_mount_test(self, host, filename, path, username, password):
+        """
+        Run an SMB test by mounting the remote volume & copying the file
+        from it. Returns a list of results (empty if the test failed).
+        """
+        # create mount point if does not exist
+        if not os.path.exists(self.mount_point):
+
+            if not self._create_mount_point(self.mount_point):
+                self.file_logger.error("Unable to create mount point for SMB tests: {}".format(self.mount_point))
+                return []
+            else:
+                self.file_logger.info("Created mount point OK")
+
+        # check if a volume already mounted to mount point, unmount if it is
+        if self._already_mounted(host, path):
+            self.file_logger.info("Path already mounted")
+
+            # attempt a umount
+            if not self._unmount_volume(host, path):
+                self.file_logger.error("Unable to unmount existing mount.")
+                return []
+            else:
+                self.file_logger.info("Unmounted OK")
+
+        # SMB mount the remote volume
+        if not self._mount_volume(host, path, self.mount_point, username, password):
+            self.file_logger.error("Mount failed.")
+            return []
+        else:
+            self.file_logger.info("Mounted OK")
+
+        # perform the copy
+        smb_result = False
+        try:
+            smb_result = self.smb_copy(host, filename, path, username, password, 1)
+        except:
+            self.file_logger.error("SMB copy process timed out.")
+
+        # Unmount the volume
+        if not self._unmount_volume(host, path):
+            self.file_logger.warning("Unmount failed.")
+        else:
+            self.file_logger.info("Unmounted OK")
+
+        return [smb_result] if smb_result else []
+
+    def smb_engine_test(self, host, filename, path, username, password, config_vars):
+        """
+        Run an SMB test using the smbprotocol module (see helpers/smbengine.py).
+        The filename may be a comma separated list of files to be read
+        concurrently. Returns a list of results, one per test direction run
+        (empty if all tests failed).
+        """
+        direction = config_vars['smb_direction']
+
+        smb_engine = SmbEngine(self.file_logger, host, username, password, port=config_vars['smb_port'])
+
+        if not smb_engine.connect():
+            return []
+
+        smb_results = []
+
+        try:
+            if direction in ['read', 'both']:
+                filenames = [name.strip() for name in filename.split(',') if name.strip()]
+                smb_result = smb_engine.read_test(path, filenames)
+                if smb_result:
+                    smb_results.append(smb_result)
+
+            if direction in ['write', 'both']:
+                size = int(float(config_vars['smb_write_size_mb']) * 1024 * 1024)
+                smb_result = smb_engine.write_test(path, config_vars['smb_write_files'], size)
+                if smb_result:
+                    smb_results.append(smb_result)
+        finally:
+            smb_engine.close()
+
+        return smb_results
+
     def run_tests(self, status_file_obj, config_vars, adapter, check_correct_mode_interface, exporter_obj, watchd):
 
         self.file_logger.info("Starting SMB test...")
         status_file_obj.write_status_file("SMB tests")
 
-        self.file_logger.info("Checking we have required software packages for these tests")
+        # use the smbprotocol module if available (unless the mount engine is configured)
+        use_engine = False
+
+        if config_vars['smb_engine'] in ['auto', 'smbprotocol']:
+            if smb_modules:
+                use_engine = True
+            elif config_vars['smb_engine'] == 'smbprotocol':
+                self.file_logger.error("smbprotocol module not available ({}), unable to run SMB tests.".format(import_err))
+                return False
+            else:
+                self.file_logger.info("smbprotocol module not available, using mount & copy for SMB tests.")
+
+        if not use_engine:
 
-        packages = {
-            'smb copy': SMB_CP, 
-            'smb mount': SMB_MOUNT, 
-            'mount': MOUNT, 
-            'ls': LS_CMD, 
-            'umount': UMOUNT_CMD
-        }
-        for package_name, package_installed in packages.items():
+            self.file_logger.info("Checking we have required software packages for these tests")
 
-            self.file_logger.debug("Checking for package: {}".format(package_name))
+            packages = {
+                'smb copy': SMB_CP, 
+                'smb mount': SMB_MOUNT, 
+                'mount': MOUNT, 
+                'ls': LS_CMD, 
+                'umount': UMOUNT_CMD
+            }
+            for package_name, package_installed in packages.items():
 
-            if not package_installed:
-                self.file_logger.error("Unable to find required package: {}".format(package_name))
-                return False
+                self.file_logger.debug("Checking for package: {}".format(package_name))
 
-        self.file_logger.info("Packages all present.")
+                if not package_installed:
+                    self.file_logger.error("Unable to find required package: {}".format(package_name))
+                    return False
+
+            self.file_logger.info("Packages all present.")
 
         global_username = config_vars['smb_global_username']
         global_password = config_vars['smb_global_password']
@@ -280,51 +376,14 @@ class SmbTester(object):
                     tests_passed = False
                     break               
 
-            # create mount point if does not exist
-            if not os.path.exists(self.mount_point):
-
-                if not self._create_mount_point(self.mount_point):
-                    self.file_logger.error("Unable to create mount point for SMB tests: {}".format(self.mount_point))
-                    tests_passed = False
-                    continue
-                else:
-                    self.file_logger.info("Created mount point OK")
-            
-            # check if a volume already mounted to mount point, unmount if it is
-            if self._already_mounted(smb_host, path):
-                self.file_logger.info("Path already mounted")
-
-                # attempt a umount
-                if not self._unmount_volume(smb_host, path):
-                    self.file_logger.error("Unable to unmount existing mount.")
-                    tests_passed = False
-                    continue 
-                else:
-                    self.file_logger.info("Unmounted OK")      
-
-            # SMB mount the remote volume
-            if not self._mount_volume(smb_host, path, self.mount_point, smb_username, smb_password):
-                self.file_logger.error("Mount failed.")
-                tests_passed = False
-                continue
-            else:
-                self.file_logger.info("Mounted OK")
-
-            # perform the copy
-            smb_result = False
-            try:
-                smb_result=self.smb_copy(smb_host, filename, path, smb_username, smb_password, 1)
-            except:
-                self.file_logger.error("SMB copy process timed out.")
-            
-            # Unmount the volume
-            if not self._unmount_volume(smb_host, path):
-                self.file_logger.warning("Unmount failed.")
+            if use_engine:
+                smb_results = self.smb_engine_test(smb_host, filename, path, smb_username, smb_password, config_vars)
             else:
-                self.file_logger.info("Unmounted OK") 
+                smb_results = self.smb_mount_test(smb_host, filename, path, smb_username, smb_password)
 
             # Send SMB results to exporter
-            if smb_result:
+            for smb_result in smb_results:
+                results_dict = {}
                 results_dict['time'] = get_timestamp(config_vars)
                 results_dict['smb_index'] = int(smb_index)
                 results_dict['smb_host'] = str(smb_result['host'])
@@ -332,6 +391,14 @@ class SmbTester(object):
                 results_dict['smb_time'] = round(float(smb_result['transfer_time']), 2)
                 results_dict['smb_rate'] = round(smb_result['rate'], 2)
 
+                # extra results only available from the smbprotocol engine
+                if 'direction' in smb_result:
+                    results_dict['direction'] = str(smb_result['direction'])
+                    results_dict['files'] = int(smb_result['files'])
+                    results_dict['bytes'] = int(smb_result['bytes'])
+                    results_dict['smb_chunk_rate_min'] = round(smb_result['chunk_rate_min'], 2)
+                    results_dict['smb_chunk_rate_max'] = round(smb_result['chunk_rate_max'], 2)
+
                 # define column headers for CSV
                 column_headers = list(results_dict.keys())
                 
@@ -354,7 +421,7 @@ class SmbTester(object):
                 # signal that at least one test passed
                 all_tests_fail = False
 
-            else:
+            if not smb_results:
                 self.file_logger.error("SMB test failed.")
                 tests_passed = False
             
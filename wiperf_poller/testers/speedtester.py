@@ -3,7 +3,10 @@ import sys
 import time
 import subprocess
 import json
+import os
 from wiperf_poller.helpers.os_cmds import LIBRESPEED_CMD
+from wiperf_poller.helpers.speedtestservers import SpeedtestServerCache
+from wiperf_poller.helpers.streamspeedtest import StreamSpeedtest
 from wiperf_poller.helpers.timefunc import get_timestamp
 
 class Speedtester(object):
@@ -214,30 +217,35 @@ mbytes_received: {}, latency_ms: {}, jitter_ms: {}, client_ip: {}, provider: {}'
         # check if we have specific target server
         if server_id:
             self.file_logger.info("Speedtest info: specific server ID provided for test: {}".format(str(server_id)))
-            try:
-                st.get_servers(servers=[server_id])
-            except Exception as error:
-                self.file_logger.error("Speedtest error: unable to get details of specified server: {}, reason: {}".format(
-                    str(server_id), error))
-                return False
-        else:
-            try:
-                st.get_best_server()
-            except Exception as error:
-                self.file_logger.error("Speedtest error: unable to get best server, reason: {}".format(error))
-                return False
+
+        # get the best server from the server cache (refreshed if required)
+        server_cache = SpeedtestServerCache(self.config_vars, self.file_logger, server_id)
+        server = server_cache.get_best_server(st)
+
+        if not server:
+            self.file_logger.error("Speedtest error: unable to get best server")
+            return False
+
+        try:
+            st.get_best_server(servers=[server])
+        except Exception as error:
+            self.file_logger.error("Speedtest error: unable to use server {}, reason: {}".format(server['host'], error))
+            server_cache.invalidate()
+            return False
 
         # run download test
         try:
             st.download()
         except Exception as error:
             self.file_logger.error("Download test error: {}".format(error))
+            server_cache.invalidate()
             return False
 
         try:
             st.upload(pre_allocate=False)
         except Exception as error:
             self.file_logger.error("Upload test error: {}".format(error))
+            server_cache.invalidate()
             return False
 
         results_dict = st.results.dict()
@@ -263,6 +271,75 @@ mbytes_received: {}, latency_ms: {}, jitter_ms: {}, client_ip: {}, provider: {}'
             'provider': provider}
 
 
+    def streamspeedtest(self, server_id=''):
+        """
+        This function runs a speedtest with a byte budget (see
+        helpers/streamspeedtest.py) and returns the result as a dictionary
+        in the same format as the ookla speedtest, plus the ramp-up time,
+        stability & reason for stopping each direction of the test
+
+        The test is run against the server at stream_server_url if configured,
+        otherwise the best Ookla server is selected (see
+        helpers/speedtestservers.py).
+        """
+        server_url = self.config_vars['stream_server_url']
+        server_cache = None
+
+        if server_url:
+            server = {'url': server_url, 'name': server_url, 'client_ip': 'NA'}
+        else:
+            server_cache = SpeedtestServerCache(self.config_vars, self.file_logger, server_id)
+            best_server = server_cache.get_best_server()
+
+            if not best_server:
+                self.file_logger.error("Speedtest error: unable to get best server")
+                return False
+
+            server = {'url': os.path.dirname(best_server['url']), 'name': str(best_server['host']),
+                'client_ip': server_cache.client_ip or 'NA'}
+
+        stream_test = StreamSpeedtest(self.file_logger, server['url'],
+            float(self.config_vars['stream_byte_budget_mb']) * 1024 * 1024,
+            max_duration=self.config_vars['stream_max_duration'],
+            threads=self.config_vars['stream_threads'])
+
+        test_results = stream_test.run()
+
+        if not test_results:
+            self.file_logger.error("Speedtest error: test to {} failed.".format(server['name']))
+
+            # re-rank the servers next time
+            if server_cache:
+                server_cache.invalidate()
+
+            return False
+
+        download = test_results['download']
+        upload = test_results['upload']
+
+        test_time = get_timestamp(self.config_vars)
+        download_rate_mbps = round(float(download['mbps']), 2)
+        upload_rate_mbps = round(float(upload['mbps']), 2)
+        ping_time = int(test_results['latency_ms'])
+        server_name = str(server['name'])
+        mbytes_sent = round(int(upload['bytes'])/1024000, 2)
+        mbytes_received = round(int(download['bytes'])/1024000, 2)
+        latency_ms = int(test_results['latency_ms'])
+        jitter_ms = int(test_results['jitter_ms'])
+        client_ip = str(server['client_ip'])
+        provider = 'Stream'
+
+        self.file_logger.info('time: {}, ping_time: {}, download_rate_mbps: {}, upload_rate_mbps: {}, server_name: {}, mbytes_sent: {},  \
+mbytes_received: {}, latency_ms: {}, jitter_ms: {}, client_ip: {}, provider: {}'.format(
+            test_time, ping_time, download_rate_mbps, upload_rate_mbps, server_name, mbytes_sent, mbytes_received, latency_ms, jitter_ms, client_ip, provider))
+
+        return {'time': test_time, 'ping_time': ping_time, 'download_rate_mbps': download_rate_mbps, 'upload_rate_mbps': upload_rate_mbps,
+            'server_name': server_name, 'mbytes_sent': mbytes_sent, 'mbytes_received': mbytes_received, 'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms, 'client_ip': client_ip, 'provider': provider,
+            'download_rampup_ms': int(download['rampup_ms']), 'download_stability_percent': round(float(download['stability_percent']), 1),
+            'download_stop_reason': download['stop_reason'], 'upload_rampup_ms': int(upload['rampup_ms']),
+            'upload_stability_percent': round(float(upload['stability_percent']), 1), 'upload_stop_reason': upload['stop_reason']}
+
     def run_tests(self, status_file_obj, check_correct_mode_interface, config_vars, exporter_obj, lockf_obj):
 
         self.file_logger.info("Starting speedtest ({})...".format(config_vars['provider']))
@@ -283,6 +360,10 @@ mbytes_received: {}, latency_ms: {}, jitter_ms: {}, client_ip: {}, provider: {}'
                 self.file_logger.debug("Running Librespeed speedtest.")
                 speedtest_results = self.librespeed(server_id=config_vars['server_id'], args=config_vars['librespeed_args'])
 
+            elif config_vars['provider'] == 'stream':
+                self.file_logger.debug("Running stream speedtest.")
+                speedtest_results = self.streamspeedtest(config_vars['server_id'])
+
             else:
                 self.file_logger.error("Unknown speedtest provider: {}".format(config_vars['provider']))
                 return False